@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cold start benchmark - the init phase of the Lambda function (importing lambda_function) and the first
+use of its AWS clients, each run in a fresh Python interpreter like a new Lambda container. Also lists
+the modules that take the longest to import (python -X importtime).
+
+It also builds the clients the function uses - EC2, the DynamoDB resource and its client, Lambda - both with
+plain boto3.client() / boto3.resource() calls (default session and configuration, as the function used to)
+and through the shared aws_clients factory, and times the first use of each.
+
+No AWS calls are made - creating the clients does not need an AWS account.
+
+    python Benchmarks/bench_cold_start.py --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lambda')
+
+ENVIRONMENT = {
+    'TGWRegion': 'us-west-2',
+    'TGWID': 'tgw-0000000000000000a',
+    'TGWAttachmentID1': 'tgw-attach-0000000000000001',
+    'TGWAttachmentID2': 'tgw-attach-0000000000000002',
+    'DynamoDBLockTable': 'DynamoDBLockTable',
+    'FallbackSupport': 'yes',
+    'LOGLEVEL': 'WARNING',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+}
+
+COLD_START = '''
+import json, time
+start_time = time.perf_counter()
+import lambda_function
+init_time = time.perf_counter()
+# what the first invocation touches before its first API call
+lambda_function.ec2.meta.events
+lambda_function.dynamodb_resource.meta.client.meta.events
+first_use_time = time.perf_counter()
+print(json.dumps({'init': init_time - start_time, 'firstUse': first_use_time - init_time}))
+'''
+
+# the clients of the function, and the service of each, built without and with the factory
+CLIENTS = {
+    'boto3': '''
+import boto3
+ec2 = boto3.client('ec2', region_name='us-west-2')
+dynamodb_resource = boto3.resource('dynamodb')
+dynamodb = boto3.client('dynamodb')
+lambda_client = boto3.client('lambda')
+''',
+    'factory': '''
+import aws_clients
+ec2 = aws_clients.client('ec2', region_name='us-west-2', max_pool_connections=10)
+dynamodb_resource = aws_clients.resource('dynamodb')
+dynamodb = aws_clients.client('dynamodb')
+lambda_client = aws_clients.client('lambda')
+''',
+}
+
+CLIENT_START = '''
+import json, time
+start_time = time.perf_counter()
+%s
+init_time = time.perf_counter()
+ec2.meta.events
+dynamodb_resource.meta.client.meta.events
+dynamodb.meta.events
+lambda_client.meta.events
+first_use_time = time.perf_counter()
+print(json.dumps({'init': init_time - start_time, 'firstUse': first_use_time - init_time}))
+'''
+
+
+def run(code, *options):
+    environment = dict(os.environ)
+    environment.update(ENVIRONMENT)
+    return subprocess.run([sys.executable] + list(options) + ['-c', code], cwd=LAMBDA_DIR, env=environment,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+
+def print_samples(samples):
+    for name in ('init', 'firstUse'):
+        values = sorted(sample[name] * 1000 for sample in samples)
+        print('%-9s p50: %7.1fms  min: %7.1fms  max: %7.1fms' % (name, statistics.median(values), values[0], values[-1]))
+    totals = sorted((sample['init'] + sample['firstUse']) * 1000 for sample in samples)
+    print('%-9s p50: %7.1fms  min: %7.1fms  max: %7.1fms' % ('total', statistics.median(totals), totals[0], totals[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to list')
+    args = parser.parse_args()
+
+    print('lambda_function:')
+    print_samples([json.loads(run(COLD_START).stdout) for i in range(args.runs)])
+    for name, code in CLIENTS.items():
+        print('\nclients, %s:' % name)
+        print_samples([json.loads(run(CLIENT_START % code).stdout) for i in range(args.runs)])
+
+    # import time: self [us] | cumulative | imported package
+    imports = []
+    for line in run('import lambda_function', '-X', 'importtime').stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative_time, module = [field.strip() for field in line[len('import time:'):].split('|')]
+        imports.append((int(cumulative_time), int(self_time), module))
+    print('\nslowest imports (cumulative / self):')
+    for cumulative_time, self_time, module in sorted(imports, reverse=True)[:args.top]:
+        print('%8.1fms %8.1fms  %s' % (cumulative_time / 1000.0, self_time / 1000.0, module))
+
+
+if __name__ == '__main__':
+    main()
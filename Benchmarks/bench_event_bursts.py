@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+Flapping tunnel benchmark - one VPN connection bouncing DOWN/UP every few seconds, handled by invoking
+lambda_handler once per EventBridge event (the direct rule target) and through the SQS event queue with
+different batching windows. With --deliveries every event is delivered that many times, the way EventBridge
+may deliver an event more than once - the repeated deliveries of a direct event are dropped as duplicates.
+
+Runs on a simulated clock against the in-memory AWS stand-ins. Reports the Lambda invocations, the route
+sweeps (invocations that moved routes), the sweeps per minute, the duplicate events dropped and the API calls made.
+
+    python Benchmarks/bench_event_bursts.py --flap-interval 5 --duration 300 --windows 0 10 30 60
+    python Benchmarks/bench_event_bursts.py --deliveries 3
+"""
+
+import argparse
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lambda'))
+
+os.environ.update({
+    'TGWRegion': 'us-west-2',
+    'TGWID': 'tgw-0000000000000000a',
+    'TGWAttachmentID1': 'tgw-attach-0000000000000001',
+    'TGWAttachmentID2': 'tgw-attach-0000000000000002',
+    'DynamoDBLockTable': 'DynamoDBLockTable',
+    'FallbackSupport': 'yes',
+    # every fallback is measured, not held back by flap dampening
+    'FlapDampening': 'no',
+    'LOGLEVEL': 'WARNING',
+})
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import lambda_function
+from simulator import InMemoryDynamoDBResource, InMemoryEC2Client, InMemoryEventQueue
+
+EPOCH = datetime.datetime(2020, 1, 1)
+
+
+def set_up(args):
+    if lambda_function.lock_client is not None:
+        lambda_function.lock_client.close()
+    lambda_function.lock_client = None
+    lambda_function.topology_cache = None
+    lambda_function.event_dedupe = None
+    ec2 = InMemoryEC2Client()
+    ec2.add_vpn_attachment(os.environ['TGWID'], os.environ['TGWAttachmentID1'], 'vpn-0000000000000001')
+    ec2.add_vpn_attachment(os.environ['TGWID'], os.environ['TGWAttachmentID2'], 'vpn-0000000000000002')
+    for i in range(args.route_tables):
+        route_table_id = 'tgw-rtb-%016d' % i
+        ec2.add_route_table(os.environ['TGWID'], route_table_id)
+        for j in range(args.routes):
+            ec2.add_route(route_table_id, '10.%d.%d.0/24' % (i, j), os.environ['TGWAttachmentID1'])
+    dynamodb_resource = InMemoryDynamoDBResource()
+    lambda_function.ec2 = ec2
+    lambda_function.dynamodb_resource = dynamodb_resource
+    # the in-memory EC2 API is not throttled
+    lambda_function.ec2_rate_limiter = lambda_function.RateLimiter(0)
+    # keep the EMF metric documents out of the report
+    lambda_function.metrics.sink = lambda document: None
+    return ec2, dynamodb_resource
+
+
+def flap_events(args):
+    # (time, change type) of every tunnel event - DOWN first, then alternating
+    events = []
+    for i in range(int(args.duration / args.flap_interval)):
+        events.append((i * args.flap_interval, 'VPN-CONNECTION-IPSEC-DOWN' if i % 2 == 0 else 'VPN-CONNECTION-IPSEC-UP'))
+    return events
+
+
+def tunnel_event(timestamp, change_type):
+    return {
+        'id': 'event-%010d' % (timestamp * 1000),
+        'time': (EPOCH + datetime.timedelta(seconds=timestamp)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'detail-type': 'Network Manager Status Update',
+        'source': 'aws.networkmanager',
+        'detail': {
+            'changeType': change_type,
+            'transitGatewayArn': 'arn:aws:ec2:us-west-2:123456789012:transit-gateway/' + os.environ['TGWID'],
+            'transitGatewayAttachmentArn': 'arn:aws:ec2:us-west-2:123456789012:transit-gateway-attachment/' + os.environ['TGWAttachmentID1'],
+            'vpnConnectionArn': 'arn:aws:ec2:us-west-2:123456789012:vpn-connection/vpn-0000000000000001',
+        }
+    }
+
+
+def set_tunnels(ec2, change_type):
+    status = 'DOWN' if change_type == 'VPN-CONNECTION-IPSEC-DOWN' else 'UP'
+    ec2.set_tunnel_status('vpn-0000000000000001', status, status)
+
+
+def run_direct(args):
+    ec2, dynamodb_resource = set_up(args)
+    results = []
+    for timestamp, change_type in flap_events(args):
+        set_tunnels(ec2, change_type)
+        for delivery in range(args.deliveries):
+            results.append(lambda_function.lambda_handler(tunnel_event(timestamp, change_type), None))
+    return results, ec2, dynamodb_resource
+
+
+def run_batched(args, batching_window):
+    ec2, dynamodb_resource = set_up(args)
+    queue = InMemoryEventQueue(batching_window)
+    results = []
+
+    def deliver_batches(until):
+        while queue.next_batch_time() is not None and queue.next_batch_time() < until:
+            results.append(lambda_function.lambda_handler(queue.receive_batch(queue.next_batch_time()), None))
+
+    for timestamp, change_type in flap_events(args):
+        deliver_batches(timestamp)
+        set_tunnels(ec2, change_type)
+        for delivery in range(args.deliveries):
+            queue.send(tunnel_event(timestamp, change_type), timestamp)
+    deliver_batches(float('inf'))
+    return results, ec2, dynamodb_resource
+
+
+def report(name, args, results, ec2, dynamodb_resource):
+    sweeps = len([result for result in results if result['routesChanged'] > 0])
+    duplicates = len([result for result in results if result.get('action') == 'duplicate'])
+    dynamodb_writes = sum(count for operation_name, count in dynamodb_resource.calls.items() if operation_name != 'GetItem')
+    print('%-12s %11d %7d %10.1f %10d %13d %13d %15d' % (
+        name, len(results), sweeps, sweeps * 60.0 / args.duration, duplicates,
+        ec2.calls['ReplaceTransitGatewayRoute'], ec2.calls['SearchTransitGatewayRoutes'], dynamodb_writes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flap-interval', type=float, default=5.0, help='seconds between tunnel events')
+    parser.add_argument('--duration', type=float, default=300.0, help='simulated seconds of flapping')
+    parser.add_argument('--windows', type=float, nargs='+', default=[0.0, 10.0, 30.0, 60.0], help='SQS batching windows to compare')
+    parser.add_argument('--route-tables', type=int, default=4)
+    parser.add_argument('--routes', type=int, default=50, help='static routes per route table')
+    parser.add_argument('--deliveries', type=int, default=1, help='times every event is delivered')
+    args = parser.parse_args()
+
+    print('%d events, %d route tables x %d routes' % (len(flap_events(args)), args.route_tables, args.routes))
+    print('%-12s %11s %7s %10s %10s %13s %13s %15s' % ('mode', 'invocations', 'sweeps', 'sweeps/min', 'duplicates', 'route writes', 'route search', 'DynamoDB writes'))
+    report('direct', args, *run_direct(args))
+    for batching_window in args.windows:
+        report('window %gs' % batching_window, args, *run_batched(args, batching_window))
+    if lambda_function.lock_client is not None:
+        lambda_function.lock_client.close()
+
+
+if __name__ == '__main__':
+    main()
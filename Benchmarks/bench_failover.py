@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+Failover benchmark suite - failover and fallback of one attachment group across topology sizes, against
+the in-memory AWS stand-ins with simulated latency, throttling and pagination limits.
+
+For every topology size (route tables x static routes per route table) it runs, in one warm container:
+- failover, cold: the first DOWN event, with nothing cached;
+- fallback: the UP event that moves the routes back;
+- failover, warm: a DOWN event with the topology cached;
+- fallback again, then tunnel lost: a DOWN event with one tunnel still up, planning the failover ahead;
+- failover, planned: the DOWN event of the last tunnel, run from the plan;
+- health check: nothing to change.
+With --prefix-lists the static routes are first migrated onto prefix list references, and the routes are moved
+by modifying the references from then on.
+Reports the wall time of each, the API calls made (and throttled) and how it ended.
+
+    python Benchmarks/bench_failover.py --sizes 1x10 4x50 16x100 32x250 --ec2-latency 0.02 --dynamodb-latency 0.005
+    python Benchmarks/bench_failover.py --sizes 8x1500 --max-results 1000 --ec2-rate 100
+    python Benchmarks/bench_failover.py --sizes 32x250 --route-index
+    python Benchmarks/bench_failover.py --sizes 32x250 --prefix-lists
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lambda'))
+
+os.environ.update({
+    'TGWRegion': 'us-west-2',
+    'TGWID': 'tgw-0000000000000000a',
+    'TGWAttachmentID1': 'tgw-attach-0000000000000001',
+    'TGWAttachmentID2': 'tgw-attach-0000000000000002',
+    'DynamoDBLockTable': 'DynamoDBLockTable',
+    'FallbackSupport': 'yes',
+    # every fallback is measured, not held back by flap dampening
+    'FlapDampening': 'no',
+    'LOGLEVEL': 'WARNING',
+})
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+from botocore.exceptions import ClientError
+import lambda_function
+from simulator import InMemoryDynamoDBResource, InMemoryEC2Client
+
+
+def tunnel_event(change_type, attachment_id, vpn_connection_id):
+    return {
+        'detail': {
+            'changeType': change_type,
+            'transitGatewayArn': 'arn:aws:ec2:us-west-2:123456789012:transit-gateway/' + os.environ['TGWID'],
+            'transitGatewayAttachmentArn': 'arn:aws:ec2:us-west-2:123456789012:transit-gateway-attachment/' + attachment_id,
+            'vpnConnectionArn': 'arn:aws:ec2:us-west-2:123456789012:vpn-connection/' + vpn_connection_id,
+        }
+    }
+
+
+def parse_size(size):
+    route_tables, routes = size.split('x')
+    return int(route_tables), int(routes)
+
+
+def fresh_container(args):
+    # the module state of a new Lambda container, on top of new stand-ins
+    ec2 = InMemoryEC2Client(latency=args.ec2_latency, calls_per_second=args.ec2_rate or None, max_results=args.max_results)
+    dynamodb_resource = InMemoryDynamoDBResource(latency=args.dynamodb_latency, calls_per_second=args.dynamodb_rate or None)
+    dynamodb_resource.create_table('RouteIndexTable', ('attachment_id', 'route'))
+    lambda_function.RouteIndexTableName = 'RouteIndexTable' if args.route_index else ''
+    lambda_function.RoutingMode = 'prefix-list' if args.prefix_lists else 'static'
+    lambda_function.route_index_table = None
+    lambda_function.route_index_cache = None
+    lambda_function.ec2 = ec2
+    lambda_function.dynamodb_resource = dynamodb_resource
+    lambda_function.lock_client = None
+    lambda_function.topology_cache = None
+    lambda_function.ec2_rate_limiter = lambda_function.RateLimiter(args.rate_limit)
+    lambda_function.metrics.sink = lambda document: None
+    return ec2, dynamodb_resource
+
+
+def run(route_table_count, route_count, args):
+    ec2, dynamodb_resource = fresh_container(args)
+    ec2.add_vpn_attachment(os.environ['TGWID'], os.environ['TGWAttachmentID1'], 'vpn-0000000000000001')
+    ec2.add_vpn_attachment(os.environ['TGWID'], os.environ['TGWAttachmentID2'], 'vpn-0000000000000002')
+    for i in range(route_table_count):
+        route_table_id = 'tgw-rtb-%016d' % i
+        ec2.add_route_table(os.environ['TGWID'], route_table_id)
+        for j in range(route_count):
+            ec2.add_route(route_table_id, '10.%d.%d.%d/28' % (i % 256, j // 16 % 256, j % 16 * 16), os.environ['TGWAttachmentID1'])
+
+    down = tunnel_event('VPN-CONNECTION-IPSEC-DOWN', os.environ['TGWAttachmentID1'], 'vpn-0000000000000001')
+    up = tunnel_event('VPN-CONNECTION-IPSEC-UP', os.environ['TGWAttachmentID1'], 'vpn-0000000000000001')
+    steps = [
+        ('migration', None, {'detail': {'changeType': 'VPN-CONNECTION-IPSEC-MIGRATE', 'dryRun': False}}),
+    ] if args.prefix_lists else []
+    steps += [
+        ('failover, cold', ('DOWN', 'DOWN'), down),
+        ('fallback', ('UP', 'UP'), up),
+        ('failover, warm', ('DOWN', 'DOWN'), down),
+        ('fallback', ('UP', 'UP'), up),
+        ('tunnel lost', ('DOWN', 'UP'), down),
+        ('failover, planned', ('DOWN', 'DOWN'), down),
+        ('health check', None, {'detail': {'changeType': 'VPN-CONNECTION-IPSEC-HEALTHCHECK'}}),
+    ]
+    rows = []
+    for scenario, tunnel_status, event in steps:
+        if tunnel_status:
+            ec2.set_tunnel_status('vpn-0000000000000001', *tunnel_status)
+        ec2.calls.clear()
+        ec2.endpoint.throttled.clear()
+        dynamodb_resource.calls.clear()
+        start_time = time.monotonic()
+        try:
+            result = lambda_function.lambda_handler(event, None)
+            outcome = 'ok'
+            if 'migration' in result:
+                result['routesChanged'] = sum(migration.get('routesDeleted', 0) for migration in result['migration'])
+        except (ClientError, lambda_function.IPsecManagementError) as e:
+            # e.g. throttled past the retries of the client - the rest of the routes are left to the next run
+            result = {'routesChanged': 0}
+            outcome = e.response['Error']['Code'] if isinstance(e, ClientError) else type(e).__name__
+        wall_time = time.monotonic() - start_time
+        rows.append((scenario, result['routesChanged'], wall_time, dict(ec2.calls), sum(ec2.endpoint.throttled.values()), sum(dynamodb_resource.calls.values()), outcome))
+    if lambda_function.lock_client is not None:
+        lambda_function.lock_client.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['1x10', '4x50', '16x100', '32x250'], help='route tables x routes per route table')
+    parser.add_argument('--ec2-latency', type=float, default=0.02, help='EC2 round trip time, seconds')
+    parser.add_argument('--dynamodb-latency', type=float, default=0.005, help='DynamoDB round trip time, seconds')
+    parser.add_argument('--ec2-rate', type=float, default=0, help='EC2 calls per second over which calls are throttled, 0 for none')
+    parser.add_argument('--dynamodb-rate', type=float, default=0, help='DynamoDB calls per second over which calls are throttled, 0 for none')
+    parser.add_argument('--max-results', type=int, default=None, help='most results per describe / search call')
+    parser.add_argument('--route-index', action='store_true', help='keep the route index in the route index table')
+    parser.add_argument('--prefix-lists', action='store_true', help='migrate the static routes onto prefix list references first')
+    parser.add_argument('--rate-limit', type=float, default=0, help='EC2MaxCallsPerSecond of the Lambda function, 0 for none')
+    args = parser.parse_args()
+
+    print('EC2 latency %dms, DynamoDB latency %dms, EC2 throttled over %s calls/s, SweepParallelism %d, EC2MaxCallsPerSecond %s, route index %s, routing %s' % (
+        args.ec2_latency * 1000, args.dynamodb_latency * 1000, args.ec2_rate or 'no', lambda_function.SweepParallelism, args.rate_limit or 'no',
+        'table' if args.route_index else 'topology cache', 'prefix lists' if args.prefix_lists else 'static routes'))
+    print('%-8s %-17s %6s %9s %8s %8s %8s %8s %9s %8s  %s' % (
+        'size', 'scenario', 'routes', 'wall time', 'describe', 'search', 'replace', 'EC2', 'throttled', 'DynamoDB', 'outcome'))
+    for size in args.sizes:
+        route_table_count, route_count = parse_size(size)
+        for scenario, routes_changed, wall_time, ec2_calls, throttled, dynamodb_calls, outcome in run(route_table_count, route_count, args):
+            print('%-8s %-17s %6d %8.0fms %8d %8d %8d %8d %9d %8d  %s' % (
+                size, scenario, routes_changed, wall_time * 1000,
+                sum(count for operation_name, count in ec2_calls.items() if operation_name.startswith('Describe')),
+                ec2_calls.get('SearchTransitGatewayRoutes', 0), ec2_calls.get('ReplaceTransitGatewayRoute', 0) + ec2_calls.get('ModifyTransitGatewayPrefixListReference', 0),
+                sum(ec2_calls.values()), throttled, dynamodb_calls, outcome))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+Health check benchmark - the scheduled health check of a fleet of attachment groups sharing the route tables of
+one TGW, reconciled group by group (HealthCheckMode group) and as one fleet (HealthCheckMode fleet), against
+the in-memory AWS stand-ins with simulated latency.
+
+For every fleet size (attachment groups x route tables x static routes per group and route table) it runs, on a
+new container each:
+- drift: the first attachment of every group DOWN, with its routes still in place;
+- in place: a second health check, with nothing to change.
+Reports the wall time, the routes changed, the EC2 calls and searches made, and the DynamoDB calls and writes made.
+
+    python Benchmarks/bench_health_check.py --sizes 4x8x25 16x8x25 64x8x10 --ec2-latency 0.02
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lambda'))
+
+TGWID = 'tgw-0000000000000000a'
+MaxGroups = 256
+
+# the groups are configured before the function is loaded - each benchmark size uses the first ones
+os.environ.update({
+    'TGWRegion': 'us-west-2',
+    'TGWConfig': json.dumps({'TransitGateways': [{
+        'TransitGatewayId': TGWID,
+        'AttachmentGroups': [
+            {'Name': 'group-%03d' % i, 'Attachments': ['tgw-attach-%03d%013d' % (i, 1), 'tgw-attach-%03d%013d' % (i, 2)]}
+            for i in range(MaxGroups)
+        ],
+    }]}),
+    'DynamoDBLockTable': 'DynamoDBLockTable',
+    'FallbackSupport': 'yes',
+    'FlapDampening': 'no',
+    'LOGLEVEL': 'WARNING',
+})
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import lambda_function
+from simulator import InMemoryDynamoDBResource, InMemoryEC2Client
+
+
+def parse_size(size):
+    groups, route_tables, routes = size.split('x')
+    return int(groups), int(route_tables), int(routes)
+
+
+def fresh_container(args, group_count):
+    # the module state of a new Lambda container, on top of new stand-ins, watching the first group_count groups
+    if lambda_function.lock_client is not None:
+        lambda_function.lock_client.close()
+    ec2 = InMemoryEC2Client(latency=args.ec2_latency)
+    dynamodb_resource = InMemoryDynamoDBResource(latency=args.dynamodb_latency)
+    lambda_function.ec2 = ec2
+    lambda_function.dynamodb_resource = dynamodb_resource
+    lambda_function.lock_client = None
+    lambda_function.topology_cache = None
+    lambda_function.route_index_cache = None
+    lambda_function.AttachmentGroups = lambda_function.load_config()[:group_count]
+    lambda_function.AttachmentGroupIndex = lambda_function.index_groups(lambda_function.AttachmentGroups)
+    lambda_function.ec2_rate_limiter = lambda_function.RateLimiter(0)
+    lambda_function.metrics.sink = lambda document: None
+    return ec2, dynamodb_resource
+
+
+def run(mode, group_count, route_table_count, route_count, args):
+    ec2, dynamodb_resource = fresh_container(args, group_count)
+    lambda_function.HealthCheckMode = mode
+    for i, group in enumerate(lambda_function.AttachmentGroups):
+        for j, attachment_id in enumerate(group.TGWAttachmentIDs):
+            ec2.add_vpn_attachment(TGWID, attachment_id, 'vpn-%03d%013d' % (i, j + 1))
+        ec2.set_tunnel_status('vpn-%03d%013d' % (i, 1), 'DOWN', 'DOWN')
+    for k in range(route_table_count):
+        route_table_id = 'tgw-rtb-%016d' % k
+        ec2.add_route_table(TGWID, route_table_id)
+        for i, group in enumerate(lambda_function.AttachmentGroups):
+            for j in range(route_count):
+                ec2.add_route(route_table_id, '10.%d.%d.%d/28' % (i % 256, (k * 16 + j // 16) % 256, j % 16 * 16), group.TGWAttachmentIDs[0])
+
+    rows = []
+    for scenario in ('drift', 'in place'):
+        ec2.calls.clear()
+        dynamodb_resource.calls.clear()
+        start_time = time.monotonic()
+        result = lambda_function.lambda_handler({'detail': {'changeType': 'VPN-CONNECTION-IPSEC-HEALTHCHECK'}}, None)
+        wall_time = time.monotonic() - start_time
+        rows.append((scenario, result['routesChanged'], wall_time, sum(ec2.calls.values()), ec2.calls.get('SearchTransitGatewayRoutes', 0),
+                     sum(dynamodb_resource.calls.values()), dynamodb_resource.calls.get('PutItem', 0)))
+    lambda_function.lock_client.close()
+    lambda_function.lock_client = None
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['4x8x25', '16x8x25', '64x8x10'], help='attachment groups x route tables x routes per group and route table')
+    parser.add_argument('--ec2-latency', type=float, default=0.02, help='EC2 round trip time, seconds')
+    parser.add_argument('--dynamodb-latency', type=float, default=0.005, help='DynamoDB round trip time, seconds')
+    args = parser.parse_args()
+
+    print('EC2 latency %dms, DynamoDB latency %dms, SweepParallelism %d, LockScope %s' % (
+        args.ec2_latency * 1000, args.dynamodb_latency * 1000, lambda_function.SweepParallelism, lambda_function.LockScope))
+    print('%-10s %-6s %-9s %6s %9s %8s %8s %8s %8s' % ('size', 'mode', 'scenario', 'routes', 'wall time', 'EC2', 'search', 'DynamoDB', 'PutItem'))
+    for size in args.sizes:
+        group_count, route_table_count, route_count = parse_size(size)
+        for mode in ('group', 'fleet'):
+            for scenario, routes_changed, wall_time, ec2_calls, search_calls, dynamodb_calls, put_calls in run(mode, group_count, route_table_count, route_count, args):
+                print('%-10s %-6s %-9s %6d %8.0fms %8d %8d %8d %8d' % (
+                    size, mode, scenario, routes_changed, wall_time * 1000, ec2_calls, search_calls, dynamodb_calls, put_calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures how long DynamoDBLockClient.close() takes after a typical acquire/release cycle.
+
+The close() time is billed Lambda time - it used to depend on where the background threads were in
+their heartbeat_period sleep. --baseline puts the sleep-based heartbeat loops back, for the time close() took
+before they were made interruptible.
+
+    python Benchmarks/bench_lock_close.py [--iterations 10] [--baseline]
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lambda'))
+
+from python_dynamodb_lock.python_dynamodb_lock import DynamoDBLockClient
+from simulator import InMemoryDynamoDBResource
+
+
+class SleepingDynamoDBLockClient(DynamoDBLockClient):
+    """
+    The lock client with the heartbeat loops of the baseline - time.sleep() till the next loop, which neither a
+    shutdown nor a change in the set of locks cuts short.
+    """
+
+    def _wait_until(self, deadline, locks_version=None):
+        remaining_time = deadline - time.monotonic()
+        if remaining_time > 0:
+            time.sleep(remaining_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10, help='acquire/release/close cycles')
+    parser.add_argument('--baseline', action='store_true', help='sleep-based heartbeat loops, as before')
+    args = parser.parse_args()
+
+    lock_client_class = SleepingDynamoDBLockClient if args.baseline else DynamoDBLockClient
+    dynamodb_resource = InMemoryDynamoDBResource()
+    close_times = []
+    for i in range(args.iterations):
+        lock_client = lock_client_class(dynamodb_resource, heartbeat_period=datetime.timedelta(seconds=5))
+        lock = lock_client.acquire_lock('benchmark')
+        # some work under the lock, so that close() does not always line up with the heartbeat window
+        time.sleep((i % 5) * 0.25)
+        lock.release()
+        start_time = time.monotonic()
+        lock_client.close()
+        close_times.append(time.monotonic() - start_time)
+    print('%s close() over %d iterations: mean %.3fs, max %.3fs' % (
+        'baseline' if args.baseline else 'current', args.iterations, statistics.mean(close_times), max(close_times)))
+
+
+if __name__ == '__main__':
+    main()
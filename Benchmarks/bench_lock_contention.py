@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local lock contention benchmark - N concurrent acquirers fighting over a single DynamoDBLock.
+
+Every acquirer has its own DynamoDBLockClient (like concurrent Lambda executions do), and all of them
+share one in-memory DynamoDB stand-in with a simulated round trip time. Reports the time to acquire
+(p50/p99) and the DynamoDB calls per acquisition for each acquire_lock() retry strategy.
+
+    python Benchmarks/bench_lock_contention.py --acquirers 8 --rounds 3 --hold 0.1
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lambda'))
+
+from python_dynamodb_lock.python_dynamodb_lock import BackoffRetryStrategy, DynamoDBLockClient
+from simulator import InMemoryDynamoDBResource
+
+
+STRATEGIES = {
+    'fixed': None,
+    'backoff': BackoffRetryStrategy(),
+}
+
+
+def run(strategy_name, args):
+    dynamodb_resource = InMemoryDynamoDBResource(latency=args.latency)
+    acquire_times = []
+    results_lock = threading.Lock()
+    start_barrier = threading.Barrier(args.acquirers)
+
+    def acquirer():
+        lock_client = DynamoDBLockClient(
+            dynamodb_resource,
+            heartbeat_period=datetime.timedelta(seconds=args.heartbeat_period),
+            retry_strategy=STRATEGIES[strategy_name],
+        )
+        start_barrier.wait()
+        for i in range(args.rounds):
+            start_time = time.monotonic()
+            lock = lock_client.acquire_lock('benchmark', retry_timeout=datetime.timedelta(minutes=30))
+            with results_lock:
+                acquire_times.append(time.monotonic() - start_time)
+            time.sleep(args.hold)
+            lock.release()
+            # let the others have a go before coming back for the lock
+            time.sleep(args.think)
+        lock_client.close()
+
+    threads = [threading.Thread(target=acquirer) for i in range(args.acquirers)]
+    start_time = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.monotonic() - start_time
+
+    acquisitions = len(acquire_times)
+    percentiles = statistics.quantiles(acquire_times, n=100) if acquisitions > 1 else acquire_times * 99
+    acquire_calls = dynamodb_resource.calls['GetItem'] + dynamodb_resource.calls['PutItem']
+    print('%-8s acquisitions: %4d  p50: %7.3fs  p99: %7.3fs  wall: %7.2fs  DynamoDB calls/acquisition: %5.1f (all: %5.1f)' % (
+        strategy_name,
+        acquisitions,
+        statistics.median(acquire_times),
+        percentiles[98],
+        wall_time,
+        acquire_calls / acquisitions,
+        sum(dynamodb_resource.calls.values()) / acquisitions,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--acquirers', type=int, default=8, help='number of concurrent acquirers')
+    parser.add_argument('--rounds', type=int, default=3, help='acquisitions per acquirer')
+    parser.add_argument('--hold', type=float, default=0.1, help='seconds each lock is held for')
+    parser.add_argument('--think', type=float, default=0.2, help='seconds between releasing the lock and the next acquisition')
+    parser.add_argument('--latency', type=float, default=0.005, help='simulated DynamoDB round trip in seconds')
+    parser.add_argument('--heartbeat-period', type=float, default=5.0, help='heartbeat_period of the lock clients in seconds')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), action='append', help='strategies to run (default: all)')
+    args = parser.parse_args()
+    for strategy_name in args.strategy or sorted(STRATEGIES, reverse=True):
+        run(strategy_name, args)
+
+
+if __name__ == '__main__':
+    main()
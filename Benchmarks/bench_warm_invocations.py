@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Calls lambda_handler repeatedly in one process - like a warm Lambda container does - against the
+in-memory AWS stand-ins, alternating tunnel DOWN and UP events.
+
+Shows the structured result and the metrics of every invocation, and that the module level state (the
+EC2 client, the DynamoDB resource and the lock client) survives from one invocation to the next.
+
+    python Benchmarks/bench_warm_invocations.py [invocations]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lambda'))
+
+os.environ.update({
+    'TGWRegion': 'us-west-2',
+    'TGWID': 'tgw-0000000000000000a',
+    'TGWAttachmentID1': 'tgw-attach-0000000000000001',
+    'TGWAttachmentID2': 'tgw-attach-0000000000000002',
+    'DynamoDBLockTable': 'DynamoDBLockTable',
+    'FallbackSupport': 'yes',
+    # every fallback is measured, not held back by flap dampening
+    'FlapDampening': 'no',
+    'LOGLEVEL': 'WARNING',
+})
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import lambda_function
+from simulator import InMemoryDynamoDBResource, InMemoryEC2Client
+
+
+def tunnel_event(change_type, attachment_id, vpn_connection_id):
+    return {
+        'detail': {
+            'changeType': change_type,
+            'transitGatewayArn': 'arn:aws:ec2:us-west-2:123456789012:transit-gateway/' + os.environ['TGWID'],
+            'transitGatewayAttachmentArn': 'arn:aws:ec2:us-west-2:123456789012:transit-gateway-attachment/' + attachment_id,
+            'vpnConnectionArn': 'arn:aws:ec2:us-west-2:123456789012:vpn-connection/' + vpn_connection_id,
+        }
+    }
+
+
+def main(invocations):
+    ec2 = InMemoryEC2Client()
+    ec2.add_vpn_attachment(os.environ['TGWID'], os.environ['TGWAttachmentID1'], 'vpn-0000000000000001')
+    ec2.add_vpn_attachment(os.environ['TGWID'], os.environ['TGWAttachmentID2'], 'vpn-0000000000000002')
+    for i in range(4):
+        route_table_id = 'tgw-rtb-%016d' % i
+        ec2.add_route_table(os.environ['TGWID'], route_table_id)
+        for j in range(50):
+            ec2.add_route(route_table_id, '10.%d.%d.0/24' % (i, j), os.environ['TGWAttachmentID1'])
+    lambda_function.ec2 = ec2
+    lambda_function.dynamodb_resource = InMemoryDynamoDBResource()
+    # the in-memory EC2 API is not throttled
+    lambda_function.ec2_rate_limiter = lambda_function.RateLimiter(0)
+
+    # the EMF documents the function would write to its log
+    metric_documents = []
+    lambda_function.metrics.sink = metric_documents.append
+
+    module_state = None
+    for i in range(invocations):
+        if i % 2 == 0:
+            ec2.set_tunnel_status('vpn-0000000000000001', 'DOWN', 'DOWN')
+            event = tunnel_event('VPN-CONNECTION-IPSEC-DOWN', os.environ['TGWAttachmentID1'], 'vpn-0000000000000001')
+        else:
+            ec2.set_tunnel_status('vpn-0000000000000001', 'UP', 'UP')
+            event = tunnel_event('VPN-CONNECTION-IPSEC-UP', os.environ['TGWAttachmentID1'], 'vpn-0000000000000001')
+        del metric_documents[:]
+        result = lambda_function.lambda_handler(event, None)
+        state = (id(lambda_function.ec2), id(lambda_function.dynamodb_resource), id(lambda_function.lock_client))
+        ec2_calls = sum(value for document in metric_documents for name, value in document.items() if name.startswith('EC2.') and not name.endswith('.Latency'))
+        dynamodb_calls = sum(value for document in metric_documents for name, value in document.items() if name.startswith('DynamoDB.') and not name.endswith('.Latency'))
+        print('invocation %2d: %-9s routes changed: %4d  total: %4dms  EC2 calls: %4d  DynamoDB calls: %2d  module state %s' % (
+            i + 1, result['action'], result['routesChanged'], result['timings']['total'], ec2_calls, dynamodb_calls,
+            'reused' if state == module_state else 'created'))
+        module_state = state
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 6)
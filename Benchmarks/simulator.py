@@ -0,0 +1,774 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-memory stand-ins for the AWS APIs used by the IPsec management Lambda function - so that the
+lock client and the failover logic can be exercised and benchmarked without an AWS account.
+"""
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+from botocore.model import ServiceId
+import collections
+import copy
+import datetime
+import ipaddress
+import json
+import random
+import re
+import threading
+import time
+import types
+
+
+def client_error(code, message, operation_name, **extra):
+    """
+    Builds a botocore ClientError the way the real clients raise it.
+    """
+    response = {'Error': {'Code': code, 'Message': message}}
+    response.update(extra)
+    return ClientError(response, operation_name)
+
+
+class ConditionExpression:
+    """
+    Evaluates the subset of the DynamoDB condition-expression syntax used by this repository:
+    attribute_exists(), attribute_not_exists(), comparisons, AND, OR, NOT and parentheses.
+    """
+
+    _TOKENS = re.compile(r'\s*(attribute_exists|attribute_not_exists|AND|OR|NOT|<>|<=|>=|=|<|>|\(|\)|,|[#:]?[A-Za-z0-9_.]+)')
+
+    def __init__(self, expression, names=None, values=None):
+        self._tokens = self._TOKENS.findall(expression)
+        self._names = names or {}
+        self._values = values or {}
+
+    def evaluate(self, item):
+        self._item = item
+        self._position = 0
+        result = self._or()
+        if self._position != len(self._tokens):
+            raise ValueError('Unexpected token: ' + self._tokens[self._position])
+        return result
+
+    def _peek(self):
+        return self._tokens[self._position] if self._position < len(self._tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        self._position += 1
+        return token
+
+    def _or(self):
+        result = self._and()
+        while self._peek() == 'OR':
+            self._next()
+            right = self._and()
+            result = result or right
+        return result
+
+    def _and(self):
+        result = self._not()
+        while self._peek() == 'AND':
+            self._next()
+            right = self._not()
+            result = result and right
+        return result
+
+    def _not(self):
+        if self._peek() == 'NOT':
+            self._next()
+            return not self._not()
+        return self._comparison()
+
+    def _comparison(self):
+        token = self._next()
+        if token == '(':
+            result = self._or()
+            self._next()
+            return result
+        if token in ('attribute_exists', 'attribute_not_exists'):
+            self._next()
+            name = self._name(self._next())
+            self._next()
+            return (name in self._item) == (token == 'attribute_exists')
+        left = self._operand(token)
+        operator = self._next()
+        right = self._operand(self._next())
+        if left is None or right is None:
+            return operator == '<>' and left != right
+        return {
+            '=': lambda: left == right,
+            '<>': lambda: left != right,
+            '<': lambda: left < right,
+            '<=': lambda: left <= right,
+            '>': lambda: left > right,
+            '>=': lambda: left >= right,
+        }[operator]()
+
+    def _name(self, token):
+        return self._names.get(token, token)
+
+    def _operand(self, token):
+        if token.startswith(':'):
+            return self._values[token]
+        return self._item.get(self._name(token))
+
+
+class EventHooks:
+    """
+    Stand-in for the botocore event system of a client (client.meta.events) - emits the before-call and
+    after-call events of every simulated API call, around its simulated round trip.
+    """
+
+    def __init__(self, service_name):
+        self.service_model = types.SimpleNamespace(service_id=ServiceId(service_name))
+        self._handlers = collections.OrderedDict()
+
+    def register(self, event_name, handler, unique_id=None):
+        self._handlers[unique_id or id(handler)] = (event_name, handler)
+
+    def call(self, operation_name, round_trip):
+        # like botocore, after-call is emitted for failed calls too - once the retries are over
+        model = types.SimpleNamespace(name=operation_name)
+        context = {}
+        self._emit('before-call', model, context)
+        try:
+            round_trip(operation_name)
+        finally:
+            self._emit('after-call', model, context)
+
+    def _emit(self, stage, model, context):
+        event_name = stage + '.' + self.service_model.service_id.hyphenize() + '.' + model.name
+        for registered_event_name, handler in list(self._handlers.values()):
+            if event_name == registered_event_name or event_name.startswith(registered_event_name + '.'):
+                handler(event_name=event_name, model=model, context=context)
+
+
+class ServiceEndpoint:
+    """
+    The service side of a simulated API - the round trip time of every call, and a token bucket throttling
+    the calls over calls_per_second. Throttled calls are retried with exponential backoff and full jitter,
+    the way the adaptive / standard retry modes of the SDK do, and fail with the throttling error of the
+    service once max_attempts are used up.
+    """
+
+    def __init__(self, service_name, throttling_error_code, latency=0.0, calls_per_second=None, burst=None, max_attempts=5):
+        """
+        :param float latency: The round trip time (in seconds) of every call, or a dict of operation name ->
+            round trip time, with the 'default' entry for the operations not in it
+        :param float calls_per_second: The sustained call rate over which calls are throttled, None for no throttling
+        :param int burst: The calls that can be made at once after an idle period, calls_per_second by default
+        """
+        self.events = EventHooks(service_name)
+        self.calls = collections.Counter()
+        self.throttled = collections.Counter()
+        self.throttling_error_code = throttling_error_code
+        self.latency = latency
+        self.calls_per_second = calls_per_second
+        self.burst = burst or max(calls_per_second or 1, 1)
+        self.max_attempts = max_attempts
+        self._tokens = self.burst
+        self._refill_time = time.monotonic()
+        self._thread_lock = threading.Lock()
+
+    def call(self, operation_name):
+        with self._thread_lock:
+            self.calls[operation_name] += 1
+        self.events.call(operation_name, self._round_trip)
+
+    def _round_trip(self, operation_name):
+        latency = self.latency.get(operation_name, self.latency.get('default', 0.0)) if isinstance(self.latency, dict) else self.latency
+        for attempt in range(self.max_attempts):
+            if latency:
+                time.sleep(latency)
+            if self._take_token():
+                return
+            with self._thread_lock:
+                self.throttled[operation_name] += 1
+            if attempt + 1 < self.max_attempts:
+                time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 2.0)))
+        raise client_error(self.throttling_error_code, 'Rate exceeded', operation_name)
+
+    def _take_token(self):
+        if not self.calls_per_second:
+            return True
+        with self._thread_lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refill_time) * self.calls_per_second)
+            self._refill_time = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+def paginate(items, NextToken, MaxResults, max_results):
+    """
+    The page of items asked for, and the NextToken of the following page - max_results caps the page size
+    the way the service does, whatever MaxResults the caller asked for.
+    """
+    start = int(NextToken or 0)
+    page_size = min(size for size in (MaxResults, max_results, len(items) - start) if size is not None)
+    page_size = max(page_size, 0)
+    next_token = str(start + page_size) if start + page_size < len(items) else None
+    return items[start:start + page_size], next_token
+
+
+class InMemoryDynamoDBTable:
+    """
+    Thread-safe stand-in for a boto3 DynamoDB Table - get/put/update/delete_item with condition expressions,
+    query on the partition key and batch_writer.
+    """
+
+    def __init__(self, name, key_names, endpoint=None, thread_lock=None, page_size=None):
+        self.name = name
+        self.key_names = key_names
+        self.items = {}
+        # the most items a query returns, in place of the 1 MB limit of the real API
+        self.page_size = page_size
+        self._endpoint = endpoint or ServiceEndpoint('DynamoDB', 'ProvisionedThroughputExceededException')
+        self._thread_lock = thread_lock or threading.RLock()
+
+    def _call(self, operation_name):
+        # the simulated network round trip happens outside of the table lock
+        self._endpoint.call(operation_name)
+
+    def _key(self, key):
+        return tuple(key[name] for name in self.key_names)
+
+    def _check(self, operation_name, item, condition, names, values, return_values=None):
+        if condition and not ConditionExpression(condition, names, values).evaluate(item or {}):
+            extra = {}
+            if return_values == 'ALL_OLD' and item is not None:
+                # like the real client, the item comes back in the low-level wire format
+                serializer = TypeSerializer()
+                extra['Item'] = dict((name, serializer.serialize(value)) for name, value in item.items())
+            raise client_error('ConditionalCheckFailedException', 'The conditional request failed', operation_name, **extra)
+
+    def get_item(self, Key, ConsistentRead=False):
+        self._call('GetItem')
+        with self._thread_lock:
+            item = self.items.get(self._key(Key))
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                 ReturnValuesOnConditionCheckFailure=None):
+        self._call('PutItem')
+        with self._thread_lock:
+            key = self._key(Item)
+            self._check('PutItem', self.items.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                        ReturnValuesOnConditionCheckFailure)
+            self.items[key] = copy.deepcopy(Item)
+            return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ReturnValuesOnConditionCheckFailure=None):
+        self._call('UpdateItem')
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        with self._thread_lock:
+            key = self._key(Key)
+            item = self.items.get(key)
+            self._check('UpdateItem', item, ConditionExpression, names, values, ReturnValuesOnConditionCheckFailure)
+            self.items[key] = self._updated_item(item, Key, UpdateExpression, names, values)
+            return {}
+
+    def query(self, KeyConditionExpression, ConsistentRead=False, ExclusiveStartKey=None, Limit=None):
+        """
+        Only partition key equality conditions - Key(name).eq(value) - are supported.
+        """
+        self._call('Query')
+        expression = KeyConditionExpression.get_expression()
+        assert expression['operator'] == '=', 'Only partition key equality conditions are supported'
+        key_name, value = expression['values'][0].name, expression['values'][1]
+        assert key_name == self.key_names[0], 'Only partition key equality conditions are supported'
+        with self._thread_lock:
+            keys = sorted(key for key in self.items if key[0] == value)
+            if ExclusiveStartKey is not None:
+                keys = [key for key in keys if key > self._key(ExclusiveStartKey)]
+            page_size = min(size for size in (Limit, self.page_size, len(keys)) if size is not None)
+            response = {'Items': [copy.deepcopy(self.items[key]) for key in keys[:page_size]]}
+            if page_size < len(keys):
+                response['LastEvaluatedKey'] = dict(zip(self.key_names, keys[page_size - 1]))
+            return response
+
+    def batch_writer(self):
+        return InMemoryBatchWriter(self)
+
+    def batch_write(self, requests):
+        """One BatchWriteItem call - put / delete requests, 25 at most, none of them unprocessed."""
+        assert len(requests) <= 25, 'BatchWriteItem takes 25 requests at most'
+        self._call('BatchWriteItem')
+        with self._thread_lock:
+            keys = [self._key(request.get('Item') or request.get('Key')) for operation, request in requests]
+            if len(set(keys)) < len(keys):
+                raise client_error('ValidationException', 'Provided list of item keys contains duplicates', 'BatchWriteItem')
+            for (operation, request), key in zip(requests, keys):
+                if operation == 'PutRequest':
+                    self.items[key] = copy.deepcopy(request['Item'])
+                else:
+                    self.items.pop(key, None)
+
+    @staticmethod
+    def _updated_item(item, key, update_expression, names, values):
+        item = copy.deepcopy(item) if item is not None else dict(key)
+        assert update_expression.startswith('SET '), 'Only SET update expressions are supported'
+        for assignment in update_expression[4:].split(','):
+            name, value = [token.strip() for token in assignment.split('=')]
+            item[names.get(name, name)] = values[value]
+        return item
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ReturnValuesOnConditionCheckFailure=None):
+        self._call('DeleteItem')
+        with self._thread_lock:
+            key = self._key(Key)
+            self._check('DeleteItem', self.items.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                        ReturnValuesOnConditionCheckFailure)
+            self.items.pop(key, None)
+            return {}
+
+
+class InMemoryBatchWriter:
+    """
+    Stand-in for the batch writer of a boto3 Table - buffers the writes, and sends them 25 at a time.
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._requests = []
+
+    def put_item(self, Item):
+        self._add(('PutRequest', {'Item': Item}))
+
+    def delete_item(self, Key):
+        self._add(('DeleteRequest', {'Key': Key}))
+
+    def _add(self, request):
+        self._requests.append(request)
+        if len(self._requests) == 25:
+            self._flush()
+
+    def _flush(self):
+        if self._requests:
+            self._table.batch_write(self._requests)
+            self._requests = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._flush()
+
+
+class InMemoryDynamoDBResource:
+    """
+    Stand-in for boto3.resource('dynamodb') - tables are created on first use, keyed like the lock table.
+    """
+
+    def __init__(self, key_names=('lock_key', 'sort_key'), latency=0.0, calls_per_second=None, burst=None, max_attempts=5, page_size=None):
+        """
+        :param tuple key_names: The partition and sort key names of the tables not created with create_table()
+        :param float latency: The simulated round trip time (in seconds) of every call, see ServiceEndpoint
+        :param float calls_per_second: The call rate over which calls are throttled, None for no throttling
+        :param int page_size: The most items a query returns
+        """
+        self.endpoint = ServiceEndpoint('DynamoDB', 'ProvisionedThroughputExceededException', latency, calls_per_second, burst, max_attempts)
+        self.calls = self.endpoint.calls
+        self._key_names = key_names
+        self._page_size = page_size
+        self._tables = {}
+        # one lock for all the tables - so that transactions can span several of them
+        self._thread_lock = threading.RLock()
+        self.meta = types.SimpleNamespace(client=InMemoryDynamoDBClient(self))
+
+    def create_table(self, name, key_names):
+        """A table keyed differently from the lock table."""
+        self._tables[name] = InMemoryDynamoDBTable(name, key_names, self.endpoint, self._thread_lock, self._page_size)
+        return self._tables[name]
+
+    def Table(self, name):
+        if name not in self._tables:
+            self._tables[name] = InMemoryDynamoDBTable(name, self._key_names, self.endpoint, self._thread_lock, self._page_size)
+        return self._tables[name]
+
+    def batch_get_item(self, RequestItems):
+        """One BatchGetItem call - 100 keys at most, all of them processed."""
+        assert sum(len(request['Keys']) for request in RequestItems.values()) <= 100, 'BatchGetItem takes 100 keys at most'
+        self.endpoint.call('BatchGetItem')
+        with self._thread_lock:
+            responses = {}
+            for name, request in RequestItems.items():
+                table = self.Table(name)
+                items = [table.items.get(table._key(key)) for key in request['Keys']]
+                responses[name] = [copy.deepcopy(item) for item in items if item is not None]
+            return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class InMemoryDynamoDBClient:
+    """
+    Stand-in for the low-level DynamoDB client behind an InMemoryDynamoDBResource (resource.meta.client).
+    """
+
+    def __init__(self, dynamodb_resource):
+        self._dynamodb_resource = dynamodb_resource
+        events = dynamodb_resource.endpoint.events
+        self.meta = types.SimpleNamespace(events=events, service_model=events.service_model)
+
+    def transact_write_items(self, TransactItems):
+        """
+        All-or-nothing Update / ConditionCheck operations - any failed condition cancels the whole
+        transaction, with the per-item CancellationReasons of the real API.
+        """
+        self._dynamodb_resource.endpoint.call('TransactWriteItems')
+        deserializer = TypeDeserializer()
+
+        def deserialize(values):
+            return dict((name, deserializer.deserialize(value)) for name, value in (values or {}).items())
+
+        with self._dynamodb_resource._thread_lock:
+            operations = []
+            reasons = []
+            for transact_item in TransactItems:
+                (operation_name, operation), = transact_item.items()
+                assert operation_name in ('Update', 'ConditionCheck'), 'Unsupported transaction operation: ' + operation_name
+                table = self._dynamodb_resource.Table(operation['TableName'])
+                key = deserialize(operation['Key'])
+                names = operation.get('ExpressionAttributeNames', {})
+                values = deserialize(operation.get('ExpressionAttributeValues'))
+                item = table.items.get(table._key(key))
+                condition = operation.get('ConditionExpression')
+                if condition and not ConditionExpression(condition, names, values).evaluate(item or {}):
+                    reasons.append({'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'})
+                else:
+                    reasons.append({'Code': 'None'})
+                operations.append((operation_name, operation, table, key, item, names, values))
+            if any(reason['Code'] != 'None' for reason in reasons):
+                raise client_error('TransactionCanceledException', 'Transaction cancelled', 'TransactWriteItems',
+                                   CancellationReasons=reasons)
+            for operation_name, operation, table, key, item, names, values in operations:
+                if operation_name == 'Update':
+                    table.items[table._key(key)] = table._updated_item(item, key, operation['UpdateExpression'], names, values)
+            return {}
+
+
+class InMemoryEC2Client:
+    """
+    Stand-in for boto3.client('ec2') - the Transit Gateway, VPN connection, route and managed prefix list APIs
+    used by the Lambda function, on top of an in-memory topology. Prefix lists and references are ready as
+    soon as they are created.
+    """
+
+    def __init__(self, latency=0.0, calls_per_second=None, burst=None, max_attempts=5, max_results=None):
+        """
+        :param float latency: The simulated round trip time (in seconds) of every call, see ServiceEndpoint
+        :param float calls_per_second: The call rate over which calls are throttled, None for no throttling
+        :param int max_results: The most results a describe / search call returns, None for as many as asked for
+        """
+        self.endpoint = ServiceEndpoint('EC2', 'RequestLimitExceeded', latency, calls_per_second, burst, max_attempts)
+        self.calls = self.endpoint.calls
+        self.max_results = max_results
+        # TGW route table ID -> {'TransitGatewayId': ..., 'Routes': {CIDR: TGW attachment ID},
+        # 'References': {prefix list ID: TGW attachment ID}}
+        self.route_tables = collections.OrderedDict()
+        # prefix list ID -> {'PrefixListName': ..., 'AddressFamily': ..., 'MaxEntries': ..., 'Version': ..., 'Entries': [CIDR]}
+        self.prefix_lists = collections.OrderedDict()
+        # TGW attachment ID -> {'TransitGatewayId': ..., 'ResourceId': VPN connection ID}
+        self.attachments = collections.OrderedDict()
+        # VPN connection ID -> list of tunnel (status, last status change) - status is 'UP' or 'DOWN'
+        self.vpn_connections = collections.OrderedDict()
+        self._thread_lock = threading.RLock()
+        events = self.endpoint.events
+        self.meta = types.SimpleNamespace(events=events, service_model=events.service_model)
+
+    # --- topology set-up
+
+    def add_vpn_attachment(self, transit_gateway_id, attachment_id, vpn_connection_id, tunnels=2):
+        self.attachments[attachment_id] = {'TransitGatewayId': transit_gateway_id, 'ResourceId': vpn_connection_id}
+        self.vpn_connections[vpn_connection_id] = [('UP', datetime.datetime.now(datetime.timezone.utc))] * tunnels
+
+    def add_route_table(self, transit_gateway_id, route_table_id):
+        self.route_tables[route_table_id] = {'TransitGatewayId': transit_gateway_id, 'Routes': collections.OrderedDict(), 'References': collections.OrderedDict()}
+
+    def add_route(self, route_table_id, destination_cidr_block, attachment_id):
+        self.route_tables[route_table_id]['Routes'][destination_cidr_block] = attachment_id
+
+    def set_tunnel_status(self, vpn_connection_id, *statuses):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.vpn_connections[vpn_connection_id] = [
+            (status, last_status_change if status == old_status else now)
+            for status, (old_status, last_status_change) in zip(statuses, self.vpn_connections[vpn_connection_id])
+        ]
+
+    def routes_to(self, attachment_id):
+        return [
+            (route_table_id, destination_cidr_block)
+            for route_table_id, route_table in self.route_tables.items()
+            for destination_cidr_block, route_attachment_id in route_table['Routes'].items()
+            if route_attachment_id == attachment_id
+        ]
+
+    def effective_routes_to(self, attachment_id):
+        # the CIDRs routed to the attachment, by static routes or prefix list references - a static route wins
+        # over the same CIDR in a prefix list
+        routes = []
+        for route_table_id, route_table in self.route_tables.items():
+            for prefix_list_id, route_attachment_id in route_table['References'].items():
+                for cidr in self.prefix_lists[prefix_list_id]['Entries']:
+                    if cidr not in route_table['Routes'] and route_attachment_id == attachment_id:
+                        routes.append((route_table_id, cidr))
+        return self.routes_to(attachment_id) + routes
+
+    # --- EC2 API
+
+    def _call(self, operation_name):
+        self.endpoint.call(operation_name)
+
+    @staticmethod
+    def _filters(Filters):
+        return dict((f['Name'], f['Values']) for f in Filters or [])
+
+    def describe_transit_gateway_route_tables(self, Filters=None, NextToken=None, MaxResults=None):
+        self._call('DescribeTransitGatewayRouteTables')
+        filters = self._filters(Filters)
+        route_tables = [
+            {'TransitGatewayRouteTableId': route_table_id, 'TransitGatewayId': route_table['TransitGatewayId']}
+            for route_table_id, route_table in self.route_tables.items()
+            if route_table['TransitGatewayId'] in filters.get('transit-gateway-id', [route_table['TransitGatewayId']])
+        ]
+        route_tables, next_token = paginate(route_tables, NextToken, MaxResults, self.max_results)
+        response = {'TransitGatewayRouteTables': route_tables}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def search_transit_gateway_routes(self, TransitGatewayRouteTableId, Filters, MaxResults=1000):
+        self._call('SearchTransitGatewayRoutes')
+        filters = self._filters(Filters)
+        routes = []
+        with self._thread_lock:
+            route_table = self.route_tables[TransitGatewayRouteTableId]
+            for destination_cidr_block, attachment_id in route_table['Routes'].items():
+                if attachment_id not in filters.get('attachment.transit-gateway-attachment-id', [attachment_id]):
+                    continue
+                network = ipaddress.ip_network(destination_cidr_block)
+                if 'route-search.exact-match' in filters and destination_cidr_block not in filters['route-search.exact-match']:
+                    continue
+                if 'route-search.subnet-of-match' in filters:
+                    prefix = ipaddress.ip_network(filters['route-search.subnet-of-match'][0])
+                    if network.version != prefix.version or not network.subnet_of(prefix):
+                        continue
+                routes.append({
+                    'DestinationCidrBlock': destination_cidr_block,
+                    'TransitGatewayAttachments': [{'TransitGatewayAttachmentId': attachment_id, 'ResourceType': 'vpn'}],
+                    'Type': 'static',
+                    'State': 'active',
+                })
+            # the routes of the prefix list references come without a CIDR
+            for prefix_list_id, attachment_id in route_table['References'].items():
+                if attachment_id not in filters.get('attachment.transit-gateway-attachment-id', [attachment_id]) or any(name.startswith('route-search.') for name in filters):
+                    continue
+                routes.append({
+                    'PrefixListId': prefix_list_id,
+                    'TransitGatewayAttachments': [{'TransitGatewayAttachmentId': attachment_id, 'ResourceType': 'vpn'}],
+                    'Type': 'static',
+                    'State': 'active',
+                })
+        max_results = min(MaxResults, self.max_results or MaxResults)
+        return {'Routes': routes[:max_results], 'AdditionalRoutesAvailable': len(routes) > max_results}
+
+    def replace_transit_gateway_route(self, DestinationCidrBlock, TransitGatewayRouteTableId, TransitGatewayAttachmentId):
+        self._call('ReplaceTransitGatewayRoute')
+        with self._thread_lock:
+            routes = self.route_tables[TransitGatewayRouteTableId]['Routes']
+            if DestinationCidrBlock not in routes:
+                raise client_error('InvalidRoute.NotFound', 'No route found for ' + DestinationCidrBlock, 'ReplaceTransitGatewayRoute')
+            routes[DestinationCidrBlock] = TransitGatewayAttachmentId
+        return {'Route': {'DestinationCidrBlock': DestinationCidrBlock, 'Type': 'static', 'State': 'active'}}
+
+    def delete_transit_gateway_route(self, TransitGatewayRouteTableId, DestinationCidrBlock):
+        self._call('DeleteTransitGatewayRoute')
+        with self._thread_lock:
+            routes = self.route_tables[TransitGatewayRouteTableId]['Routes']
+            if DestinationCidrBlock not in routes:
+                raise client_error('InvalidRoute.NotFound', 'No route found for ' + DestinationCidrBlock, 'DeleteTransitGatewayRoute')
+            del routes[DestinationCidrBlock]
+        return {'Route': {'DestinationCidrBlock': DestinationCidrBlock, 'Type': 'static', 'State': 'deleted'}}
+
+    def create_managed_prefix_list(self, PrefixListName, MaxEntries, AddressFamily, Entries=None):
+        self._call('CreateManagedPrefixList')
+        if len(Entries or []) > 100 or len(Entries or []) > MaxEntries:
+            raise client_error('InvalidParameterValue', 'Too many entries', 'CreateManagedPrefixList')
+        with self._thread_lock:
+            prefix_list_id = 'pl-%017x' % (len(self.prefix_lists) + 1)
+            self.prefix_lists[prefix_list_id] = {
+                'PrefixListName': PrefixListName, 'AddressFamily': AddressFamily, 'MaxEntries': MaxEntries, 'Version': 1,
+                'Entries': [entry['Cidr'] for entry in Entries or []],
+            }
+            return {'PrefixList': self._prefix_list(prefix_list_id)}
+
+    def _prefix_list(self, prefix_list_id):
+        prefix_list = self.prefix_lists[prefix_list_id]
+        return {
+            'PrefixListId': prefix_list_id, 'PrefixListName': prefix_list['PrefixListName'], 'AddressFamily': prefix_list['AddressFamily'],
+            'MaxEntries': prefix_list['MaxEntries'], 'Version': prefix_list['Version'],
+            'State': 'create-complete' if prefix_list['Version'] == 1 else 'modify-complete',
+        }
+
+    def describe_managed_prefix_lists(self, PrefixListIds=None, Filters=None, NextToken=None, MaxResults=None):
+        self._call('DescribeManagedPrefixLists')
+        filters = self._filters(Filters)
+        with self._thread_lock:
+            prefix_lists = [
+                self._prefix_list(prefix_list_id) for prefix_list_id, prefix_list in self.prefix_lists.items()
+                if (not PrefixListIds or prefix_list_id in PrefixListIds)
+                and prefix_list['PrefixListName'] in filters.get('prefix-list-name', [prefix_list['PrefixListName']])
+            ]
+        prefix_lists, next_token = paginate(prefix_lists, NextToken, MaxResults, self.max_results)
+        response = {'PrefixLists': prefix_lists}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def get_managed_prefix_list_entries(self, PrefixListId, NextToken=None, MaxResults=None):
+        self._call('GetManagedPrefixListEntries')
+        entries, next_token = paginate([{'Cidr': cidr} for cidr in self.prefix_lists[PrefixListId]['Entries']], NextToken, MaxResults, self.max_results)
+        response = {'Entries': entries}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def modify_managed_prefix_list(self, PrefixListId, CurrentVersion, AddEntries=None):
+        self._call('ModifyManagedPrefixList')
+        with self._thread_lock:
+            prefix_list = self.prefix_lists[PrefixListId]
+            if CurrentVersion != prefix_list['Version']:
+                raise client_error('PrefixListVersionMismatch', 'The prefix list is at version %d' % prefix_list['Version'], 'ModifyManagedPrefixList')
+            if len(AddEntries or []) > 100 or len(prefix_list['Entries']) + len(AddEntries or []) > prefix_list['MaxEntries']:
+                raise client_error('InvalidParameterValue', 'Too many entries', 'ModifyManagedPrefixList')
+            prefix_list['Entries'].extend(entry['Cidr'] for entry in AddEntries or [])
+            prefix_list['Version'] += 1
+            return {'PrefixList': self._prefix_list(PrefixListId)}
+
+    def _prefix_list_reference(self, route_table_id, prefix_list_id):
+        attachment_id = self.route_tables[route_table_id]['References'][prefix_list_id]
+        return {
+            'TransitGatewayRouteTableId': route_table_id, 'PrefixListId': prefix_list_id, 'PrefixListOwnerId': '123456789012',
+            'State': 'available', 'Blackhole': False,
+            'TransitGatewayAttachment': {'TransitGatewayAttachmentId': attachment_id, 'ResourceType': 'vpn', 'ResourceId': self.attachments[attachment_id]['ResourceId']},
+        }
+
+    def get_transit_gateway_prefix_list_references(self, TransitGatewayRouteTableId, Filters=None, NextToken=None, MaxResults=None):
+        self._call('GetTransitGatewayPrefixListReferences')
+        filters = self._filters(Filters)
+        with self._thread_lock:
+            references = [
+                self._prefix_list_reference(TransitGatewayRouteTableId, prefix_list_id)
+                for prefix_list_id, attachment_id in self.route_tables[TransitGatewayRouteTableId]['References'].items()
+                if attachment_id in filters.get('attachment.transit-gateway-attachment-id', [attachment_id])
+                and prefix_list_id in filters.get('prefix-list-id', [prefix_list_id])
+            ]
+        references, next_token = paginate(references, NextToken, MaxResults, self.max_results)
+        response = {'TransitGatewayPrefixListReferences': references}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def create_transit_gateway_prefix_list_reference(self, TransitGatewayRouteTableId, PrefixListId, TransitGatewayAttachmentId=None, Blackhole=False):
+        self._call('CreateTransitGatewayPrefixListReference')
+        with self._thread_lock:
+            references = self.route_tables[TransitGatewayRouteTableId]['References']
+            if PrefixListId in references:
+                raise client_error('IncorrectState', PrefixListId + ' is already referenced', 'CreateTransitGatewayPrefixListReference')
+            references[PrefixListId] = TransitGatewayAttachmentId
+            return {'TransitGatewayPrefixListReference': self._prefix_list_reference(TransitGatewayRouteTableId, PrefixListId)}
+
+    def modify_transit_gateway_prefix_list_reference(self, TransitGatewayRouteTableId, PrefixListId, TransitGatewayAttachmentId=None, Blackhole=False):
+        self._call('ModifyTransitGatewayPrefixListReference')
+        with self._thread_lock:
+            references = self.route_tables[TransitGatewayRouteTableId]['References']
+            if PrefixListId not in references:
+                raise client_error('InvalidPrefixListReference.NotFound', 'No reference found for ' + PrefixListId, 'ModifyTransitGatewayPrefixListReference')
+            references[PrefixListId] = TransitGatewayAttachmentId
+            return {'TransitGatewayPrefixListReference': self._prefix_list_reference(TransitGatewayRouteTableId, PrefixListId)}
+
+    def describe_transit_gateway_attachments(self, TransitGatewayAttachmentIds=None, Filters=None, NextToken=None, MaxResults=None):
+        self._call('DescribeTransitGatewayAttachments')
+        attachments = [
+            {
+                'TransitGatewayAttachmentId': attachment_id,
+                'TransitGatewayId': attachment['TransitGatewayId'],
+                'ResourceType': 'vpn',
+                'ResourceId': attachment['ResourceId'],
+                'State': 'available',
+            }
+            for attachment_id, attachment in self.attachments.items()
+            if not TransitGatewayAttachmentIds or attachment_id in TransitGatewayAttachmentIds
+        ]
+        attachments, next_token = paginate(attachments, NextToken, MaxResults, self.max_results)
+        response = {'TransitGatewayAttachments': attachments}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def describe_vpn_connections(self, VpnConnectionIds=None, Filters=None):
+        self._call('DescribeVpnConnections')
+        vpn_connections = []
+        for vpn_connection_id, tunnels in self.vpn_connections.items():
+            if VpnConnectionIds and vpn_connection_id not in VpnConnectionIds:
+                continue
+            vpn_connections.append({
+                'VpnConnectionId': vpn_connection_id,
+                'State': 'available',
+                'VgwTelemetry': [
+                    {'OutsideIpAddress': '203.0.113.%d' % (i + 1), 'Status': status, 'LastStatusChange': last_status_change, 'StatusMessage': ''}
+                    for i, (status, last_status_change) in enumerate(tunnels)
+                ],
+            })
+        return {'VpnConnections': vpn_connections}
+
+
+class InMemoryEventQueue:
+    """
+    Stand-in for the SQS queue between the EventBridge rule and the Lambda function. Events are sent with
+    their (simulated) time, and handed out as Lambda SQS events the way an event source mapping with a
+    batching window does - a batch is invoked when the window since its first message is over, or as soon
+    as it is full.
+    """
+
+    def __init__(self, batching_window, batch_size=100):
+        self.batching_window = batching_window
+        self.batch_size = batch_size
+        self._messages = collections.deque()
+        self._message_count = 0
+
+    def send(self, event, timestamp):
+        self._message_count += 1
+        self._messages.append((timestamp, 'message-%d' % self._message_count, event))
+
+    def __len__(self):
+        return len(self._messages)
+
+    def next_batch_time(self):
+        """Time the next batch is invoked at, None if the queue is empty."""
+        if not self._messages:
+            return None
+        if len(self._messages) >= self.batch_size:
+            return self._messages[self.batch_size - 1][0]
+        return self._messages[0][0] + self.batching_window
+
+    def receive_batch(self, now):
+        """The Lambda event for the batch due at the given time, None if no batch is due yet."""
+        batch_time = self.next_batch_time()
+        if batch_time is None or batch_time > now:
+            return None
+        records = []
+        while self._messages and len(records) < self.batch_size and self._messages[0][0] <= batch_time:
+            timestamp, message_id, event = self._messages.popleft()
+            records.append({
+                'messageId': message_id,
+                'eventSource': 'aws:sqs',
+                'body': json.dumps(event),
+                'attributes': {'SentTimestamp': str(int(timestamp * 1000))},
+            })
+        return {'Records': records}
@@ -0,0 +1,59 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+# Client tuning - failing fast on a stuck connection and retrying it is cheaper than waiting out the default
+# 60 second timeouts, and the adaptive retry mode backs off on its own when the API starts throttling
+AWSConnectTimeout = float(os.environ.get('AWSConnectTimeout', '2'))
+AWSReadTimeout = float(os.environ.get('AWSReadTimeout', '10'))
+AWSMaxAttempts = int(os.environ.get('AWSMaxAttempts', '5'))
+
+# one session, and one client / resource per service and region, shared by all the modules of the function
+session = None
+clients = {}
+thread_lock = threading.Lock()
+
+
+def client_config(max_pool_connections):
+
+    return Config(
+        connect_timeout=AWSConnectTimeout,
+        read_timeout=AWSReadTimeout,
+        retries={'mode': 'adaptive', 'total_max_attempts': AWSMaxAttempts},
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True,
+    )
+
+
+def get_session():
+
+    global session
+    with thread_lock:
+        if session is None:
+            session = boto3.session.Session()
+        return session
+
+
+def client(service_name, region_name=None, max_pool_connections=10):
+
+    # created on first use - the pool size of the first caller sticks, so callers running parallel
+    # requests should ask for the client first
+    key = ('client', service_name, region_name)
+    if key not in clients:
+        new_client = get_session().client(service_name, region_name=region_name, config=client_config(max_pool_connections))
+        with thread_lock:
+            clients.setdefault(key, new_client)
+    return clients[key]
+
+
+def resource(service_name, region_name=None, max_pool_connections=10):
+
+    key = ('resource', service_name, region_name)
+    if key not in clients:
+        new_resource = get_session().resource(service_name, region_name=region_name, config=client_config(max_pool_connections))
+        with thread_lock:
+            clients.setdefault(key, new_resource)
+            # the low-level client of the resource serves the plain client requests as well
+            clients.setdefault(('client', service_name, region_name), new_resource.meta.client)
+    return clients[key]
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+Builds IPsecManagementLambda.zip - the deployment package of the Lambda function - from the modules in this
+directory and the python_dynamodb_lock package. boto3 and botocore come with the Lambda Python runtime, so they
+are not packaged. The entries get a fixed timestamp, so the package only changes when the code does.
+
+    python Lambda/build_zip.py
+"""
+
+import os
+import sys
+import zipfile
+
+LAMBDA_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE = 'IPsecManagementLambda.zip'
+PACKAGES = ['python_dynamodb_lock']
+TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+
+def package_files():
+    # (path in the package, path on disk) of every module of the function, sorted
+    files = [
+        (name, os.path.join(LAMBDA_DIR, name)) for name in os.listdir(LAMBDA_DIR)
+        if name.endswith('.py') and name != os.path.basename(__file__)
+    ]
+    for package in PACKAGES:
+        for directory, directories, names in os.walk(os.path.join(LAMBDA_DIR, package)):
+            directories[:] = [name for name in directories if name != '__pycache__']
+            for name in names:
+                if name.endswith('.py'):
+                    path = os.path.join(directory, name)
+                    files.append((os.path.relpath(path, LAMBDA_DIR).replace(os.sep, '/'), path))
+    return sorted(files)
+
+
+def main():
+    package_path = os.path.join(LAMBDA_DIR, PACKAGE)
+    with zipfile.ZipFile(package_path, 'w', zipfile.ZIP_DEFLATED) as package:
+        for name, path in package_files():
+            entry = zipfile.ZipInfo(name, TIMESTAMP)
+            entry.compress_type = zipfile.ZIP_DEFLATED
+            entry.external_attr = 0o644 << 16
+            with open(path, 'rb') as source:
+                package.writestr(entry, source.read())
+            print(name)
+    print('Wrote ' + package_path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import collections
+import datetime
+import logging
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+
+def event_time_bucket(event_time, window):
+
+    # the number of the window seconds long time bucket of an EventBridge event time (ISO 8601 UTC), None without one
+    try:
+        event_timestamp = datetime.datetime.strptime(event_time or '', '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc).timestamp()
+    except ValueError:
+        return None
+    return int(event_timestamp // window)
+
+
+class EventDedupe:
+
+    # tells the deliveries of a tunnel event seen already apart from new events. An event is a duplicate if its event
+    # ID was handled, or if the last event of the same tunnel in the same time bucket was of the same change type - a
+    # DOWN after an UP is a new event whenever it comes. An event is marked in progress in the DynamoDB lock table
+    # with a conditional put before it is handled, and done once it was - only for as long as the invocation can run
+    # in progress, so that the retry of an invocation that timed out or was killed is handled. The IDs of the events
+    # done are also kept in a bounded LRU of the container - only an event ID is answered from memory, the last event
+    # of a tunnel may have been handled by another container, so it is always checked in the table.
+    def __init__(self, table, window, ttl, max_entries):
+        self.table = table
+        self.window = window
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # event ID -> change type, of the events done
+        self.seen = collections.OrderedDict()
+
+    def tunnel_key(self, VpnConnectionId, OutsideIpAddress, event_time):
+
+        # None without the outside IP - the tunnels of the connection cannot be told apart, so the event is only
+        # deduplicated on its ID, the DOWN of one tunnel must not pass for a delivery of the DOWN of the other
+        bucket = event_time_bucket(event_time, self.window)
+        if bucket is None or not OutsideIpAddress:
+            return None
+        return VpnConnectionId + '|' + OutsideIpAddress + '|' + str(bucket)
+
+    def check(self, event_id, VpnConnectionId, OutsideIpAddress, changeType, event_time, now, in_progress_ttl):
+
+        # marks the event in progress for in_progress_ttl seconds, and returns where it was found to be a duplicate -
+        # 'memory' or 'table' for an event done, 'in progress' for one another invocation is handling - None for a
+        # new event
+        event_keys = self.event_keys(event_id, self.tunnel_key(VpnConnectionId, OutsideIpAddress, event_time))
+        if not event_keys:
+            return None
+        if event_id and self.seen.get(event_id) == changeType:
+            self.remember(event_id, changeType)
+            return 'memory'
+        item = dict(self.table_key(event_keys))
+        item.update({'change_type': changeType, 'event_id': event_id or '', 'event_state': 'in progress', 'expiry_time': int(now + in_progress_ttl)})
+        try:
+            # the TTL deletion of DynamoDB lags, so an expired marker or record is overwritten here
+            self.table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(lock_key) OR change_type <> :change_type OR expiry_time < :now',
+                ExpressionAttributeValues={':change_type': changeType, ':now': int(now)},
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise e
+            event_state = e.response.get('Item', {}).get('event_state', {}).get('S', 'done')
+            if event_state == 'done':
+                self.remember(event_id, changeType)
+                return 'table'
+            return event_state
+        return None
+
+    def done(self, event_id, VpnConnectionId, OutsideIpAddress, changeType, event_time, now):
+
+        # records the event as handled - from now on its deliveries are dropped, for ttl seconds
+        event_keys = self.event_keys(event_id, self.tunnel_key(VpnConnectionId, OutsideIpAddress, event_time))
+        if not event_keys:
+            return
+        self.remember(event_id, changeType)
+        item = dict(self.table_key(event_keys))
+        item.update({'change_type': changeType, 'event_id': event_id or '', 'event_state': 'done', 'expiry_time': int(now + self.ttl)})
+        try:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(lock_key) OR (change_type = :change_type AND event_id = :event_id)',
+                ExpressionAttributeValues={':change_type': changeType, ':event_id': event_id or ''}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise e
+            # a newer event of the tunnel has taken the record over
+            logger.info('The dedupe record of the event ' + str(event_id) + ' was taken over by a newer event')
+
+    def forget(self, event_id, VpnConnectionId, OutsideIpAddress, changeType, event_time):
+
+        # drops the in progress marker of the event, so that it is not a duplicate when it is delivered again after a failure
+        event_keys = self.event_keys(event_id, self.tunnel_key(VpnConnectionId, OutsideIpAddress, event_time))
+        if not event_keys:
+            return
+        try:
+            self.table.delete_item(
+                Key=self.table_key(event_keys),
+                ConditionExpression='change_type = :change_type AND event_id = :event_id AND event_state = :event_state',
+                ExpressionAttributeValues={':change_type': changeType, ':event_id': event_id or '', ':event_state': 'in progress'}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise e
+
+    @staticmethod
+    def event_keys(event_id, tunnel_key):
+
+        return [key for key in (('id', event_id), ('tunnel', tunnel_key)) if key[1]]
+
+    @staticmethod
+    def table_key(event_keys):
+
+        # keyed on the tunnel and time bucket if the event has a time and an outside IP - a delivery of the same
+        # event has the same time - and on the event ID otherwise
+        return {'lock_key': 'event|' + event_keys[-1][1], 'sort_key': 'event'}
+
+    def remember(self, event_id, changeType):
+
+        if not event_id:
+            return
+        self.seen[event_id] = changeType
+        self.seen.move_to_end(event_id)
+        while len(self.seen) > self.max_entries:
+            self.seen.popitem(last=False)
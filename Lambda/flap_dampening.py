@@ -0,0 +1,175 @@
+import collections
+import logging
+import math
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# Route flap dampening, as BGP does it (RFC 2439) - every UP/DOWN transition of a VPN connection adds
+# flap_penalty to its penalty, which halves every half_life seconds. Fallback to a connection is suppressed
+# once its penalty goes over suppress_limit, till it decays under reuse_limit. The penalty never goes over
+# the ceiling that decays to reuse_limit in max_suppress_time seconds, so a connection that stopped
+# flapping is never suppressed for longer than that.
+DampeningParameters = collections.namedtuple(
+    'DampeningParameters', ['half_life', 'flap_penalty', 'suppress_limit', 'reuse_limit', 'max_suppress_time'])
+
+# transitions kept with each connection, for troubleshooting
+MaxHistory = 10
+# keys a BatchGetItem call takes, and the calls made for the keys it leaves unprocessed
+MaxKeysPerBatchGet = 100
+MaxBatchGetAttempts = 3
+
+
+def penalty_ceiling(parameters):
+
+    return parameters.reuse_limit * 2 ** (parameters.max_suppress_time / parameters.half_life)
+
+
+def decayed_penalty(penalty, elapsed_time, parameters):
+
+    return penalty * 0.5 ** (max(elapsed_time, 0) / parameters.half_life)
+
+
+def record_transition(record, state, transition_time, parameters):
+
+    # the dampening record after a transition to the given state at transition_time (epoch seconds). A record
+    # is a dict: state, penalty - as of updated, suppressed, and history - the latest (time, state) transitions.
+    penalty = decayed_penalty(record['penalty'], transition_time - record['updated'], parameters) + parameters.flap_penalty
+    penalty = min(penalty, penalty_ceiling(parameters))
+    suppressed = is_suppressed(record, transition_time, parameters) or penalty > parameters.suppress_limit
+    history = ([[transition_time, state]] + record['history'])[:MaxHistory]
+    return {'state': state, 'penalty': penalty, 'updated': transition_time, 'suppressed': suppressed, 'history': history}
+
+
+def is_suppressed(record, now, parameters):
+
+    # a suppressed connection stays suppressed till its penalty decays under reuse_limit
+    return record['suppressed'] and decayed_penalty(record['penalty'], now - record['updated'], parameters) >= parameters.reuse_limit
+
+
+def reuse_time(record, now, parameters):
+
+    # seconds till a suppressed connection can be used again, 0 if it is not suppressed
+    if not is_suppressed(record, now, parameters):
+        return 0.0
+    penalty = decayed_penalty(record['penalty'], now - record['updated'], parameters)
+    return parameters.half_life * math.log2(penalty / parameters.reuse_limit)
+
+
+def new_record(state, now):
+
+    return {'state': state, 'penalty': 0.0, 'updated': now, 'suppressed': False, 'history': []}
+
+
+def last_status_change(vpn_connection):
+
+    # epoch seconds of the latest tunnel status change of a VPN connection, None if it is not known
+    status_changes = [tunnel['LastStatusChange'] for tunnel in vpn_connection['VgwTelemetry'] if tunnel.get('LastStatusChange')]
+    return max(status_changes).timestamp() if status_changes else None
+
+
+class FlapDampening:
+
+    # keeps the dampening record of each VPN connection in the DynamoDB lock table. A record is only
+    # written when the connection changed state since it was last seen, with a conditional put - so two
+    # invocations seeing the same transition count it once. The records of many connections can be read
+    # ahead in batches, each is then used by the next observe() of its connection only.
+    def __init__(self, dynamodb_resource, table_name, parameters, ttl):
+        self.dynamodb_resource = dynamodb_resource
+        self.table = dynamodb_resource.Table(table_name)
+        self.table_name = table_name
+        self.parameters = parameters
+        self.ttl = ttl
+        # lock_key -> the item read ahead, None for a connection without a record
+        self.prefetched = {}
+
+    @staticmethod
+    def key(VpnConnectionId):
+
+        return {'lock_key': 'dampening|' + VpnConnectionId, 'sort_key': 'dampening'}
+
+    def prefetch(self, VpnConnectionIds):
+
+        # reads the records of the connections with BatchGetItem, in place of a GetItem each in observe(). The
+        # keys still unprocessed after MaxBatchGetAttempts calls are left to observe() to read.
+        self.prefetched = {}
+        keys = [self.key(VpnConnectionId) for VpnConnectionId in sorted(set(VpnConnectionIds))]
+        for i in range(0, len(keys), MaxKeysPerBatchGet):
+            request_keys = keys[i:i + MaxKeysPerBatchGet]
+            for attempt in range(MaxBatchGetAttempts):
+                response = self.dynamodb_resource.batch_get_item(RequestItems={self.table_name: {'Keys': request_keys, 'ConsistentRead': True}})
+                items = dict((item['lock_key'], item) for item in response['Responses'].get(self.table_name, []))
+                unprocessed_keys = response.get('UnprocessedKeys', {}).get(self.table_name, {}).get('Keys', [])
+                unprocessed = set(key['lock_key'] for key in unprocessed_keys)
+                for key in request_keys:
+                    if key['lock_key'] not in unprocessed:
+                        self.prefetched[key['lock_key']] = items.get(key['lock_key'])
+                if not unprocessed_keys:
+                    break
+                request_keys = unprocessed_keys
+
+    def discard_prefetched(self):
+
+        self.prefetched = {}
+
+    def observe(self, vpn_connection, state, now):
+
+        # records the state of the connection - UP or DOWN - if it changed, and returns whether fallback to it
+        # is suppressed
+        key = self.key(vpn_connection['VpnConnectionId'])
+        for attempt in range(3):
+            if attempt == 0 and key['lock_key'] in self.prefetched:
+                item = self.prefetched.pop(key['lock_key'])
+            else:
+                item = self.table.get_item(Key=key, ConsistentRead=True).get('Item')
+            record = self.record_from_item(item) if item is not None else new_record(state, now)
+            if item is not None and record['state'] == state:
+                return is_suppressed(record, now, self.parameters)
+            if item is not None:
+                # the penalty decays from the time the tunnels actually changed, not from when it was noticed
+                transition_time = min(max(last_status_change(vpn_connection) or now, record['updated']), now)
+                record = record_transition(record, state, transition_time, self.parameters)
+                logger.info('VPN connection ' + vpn_connection['VpnConnectionId'] + ' went ' + state + ', flap penalty ' + str(int(record['penalty'])) + (' - suppressed' if record['suppressed'] else ''))
+            try:
+                self.put_record(key, record, item)
+                return is_suppressed(record, now, self.parameters)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise e
+                # someone else recorded a change in the meantime, start over from theirs
+        return is_suppressed(record, now, self.parameters)
+
+    def put_record(self, key, record, old_item):
+
+        item = dict(key)
+        version = int(old_item['version']) + 1 if old_item is not None else 1
+        item.update({
+            'version': version,
+            'state': record['state'],
+            'penalty': Decimal(str(round(record['penalty'], 3))),
+            'updated': Decimal(str(round(record['updated'], 3))),
+            'suppressed': record['suppressed'],
+            'history': [[Decimal(str(round(transition_time, 3))), state] for transition_time, state in record['history']],
+            'expiry_time': int(record['updated'] + self.ttl),
+        })
+        if old_item is None:
+            self.table.put_item(Item=item, ConditionExpression='attribute_not_exists(lock_key)')
+        else:
+            self.table.put_item(
+                Item=item,
+                ConditionExpression='#version = :old_version',
+                ExpressionAttributeNames={'#version': 'version'},
+                ExpressionAttributeValues={':old_version': old_item['version']}
+            )
+
+    @staticmethod
+    def record_from_item(item):
+
+        return {
+            'state': item['state'],
+            'penalty': float(item['penalty']),
+            'updated': float(item['updated']),
+            'suppressed': item['suppressed'],
+            'history': [[float(transition_time), state] for transition_time, state in item['history']],
+        }
@@ -1,179 +1,1614 @@
 from __future__ import print_function
-import boto3
 import botocore
 from botocore.exceptions import ClientError
+import datetime
+import hashlib
 import logging
 import json
 import os
-from python_dynamodb_lock.python_dynamodb_lock import *
+import ipaddress
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from python_dynamodb_lock.python_dynamodb_lock import BackoffRetryStrategy, DynamoDBLockClient, DynamoDBLockError
+from metrics import Metrics, instrument_client
+from flap_dampening import DampeningParameters, FlapDampening
+from tunnel_health import evaluate_vpn_connections, health_policy
+from route_index import RouteIndexTable
+from event_dedupe import EventDedupe
+from prefix_lists import MaxEntriesPerCall, cidr_address_family, is_prefix_list, plan_migration
+import aws_clients
 
 TGWRegion = os.environ['TGWRegion']
-TGWID = os.environ['TGWID']
-TGWAttachmentID1 = os.environ['TGWAttachmentID1']
-TGWAttachmentID2 = os.environ['TGWAttachmentID2']
+# Single TGW deployments are configured with TGWID and the TGWAttachmentID1/TGWAttachmentID2 pair,
+# multi TGW / multi group deployments with a TGWConfig document (inline JSON or a TGWConfigFile path)
+TGWID = os.environ.get('TGWID', '')
+TGWAttachmentID1 = os.environ.get('TGWAttachmentID1', '')
+TGWAttachmentID2 = os.environ.get('TGWAttachmentID2', '')
+TGWConfig = os.environ.get('TGWConfig', '')
+TGWConfigFile = os.environ.get('TGWConfigFile', '')
 DynamoDBLockTable = os.environ['DynamoDBLockTable']
 FallbackSupport = os.environ['FallbackSupport']
+LockScope = os.environ.get('LockScope', 'global')
+# Route sweep tuning - number of parallel EC2 calls and the overall EC2 API call rate
+SweepParallelism = int(os.environ.get('SweepParallelism', '8'))
+EC2MaxCallsPerSecond = float(os.environ.get('EC2MaxCallsPerSecond', '20'))
+SearchRoutesMaxResults = 1000
+# Topology cache - seconds the route tables, VPN attachments and static route index are reused (0 disables
+# the cache), and whether they are shared with the other containers through the DynamoDB lock table
+TopologyCacheTTL = int(os.environ.get('TopologyCacheTTL', '600'))
+TopologyCachePersist = os.environ.get('TopologyCachePersist', 'yes')
+TopologyCacheMaxItemSize = 350000
+# Route index table - the static routes of the watched attachments, one item per route, used instead of the
+# persisted route index of the topology cache, and trusted for RouteIndexMaxAge seconds after it was last checked
+# against the route tables
+RouteIndexTableName = os.environ.get('RouteIndexTable', '')
+RouteIndexMaxAge = int(os.environ.get('RouteIndexMaxAge', '3600'))
+# route changes written through to the route index table by each worker call, in batches of 25 writes
+RouteIndexWriteChunk = 100
+# Routing mode - 'static' moves the static routes of a group one CIDR at a time, 'prefix-list' moves the prefix list
+# references to its attachments as well, one call per route table and prefix list. Migrating the static routes onto
+# prefix lists waits up to PrefixListWaitTime seconds for each prefix list and reference to be ready.
+RoutingMode = os.environ.get('RoutingMode', 'static')
+PrefixListWaitTime = 120
+PrefixListPollInterval = 2
+# Tunnel health - how the tunnel states of a VPN connection decide whether it is UP, DEGRADED or DOWN
+TunnelHealthPolicy = health_policy(
+    os.environ.get('TunnelHealthPolicy', 'all-down'),
+    quorum=int(os.environ.get('TunnelQuorum', '1')),
+    weights=os.environ.get('TunnelWeights', ''),
+    min_weight=float(os.environ.get('TunnelMinWeight', '0.5')),
+)
+# Failover planning - when a VPN connection loses a tunnel, the failover off its attachment is planned ahead and
+# kept with the topology cache, so that losing the last tunnel only takes checking the plan and replacing the routes
+FailoverPlanning = os.environ.get('FailoverPlanning', 'yes')
+# Deadline - route changes are made CheckpointRoutes at a time, with a checkpoint after each batch, and the rest is
+# handed over to a new invocation of the function once less than DeadlineMargin seconds are left
+CheckpointRoutes = int(os.environ.get('CheckpointRoutes', '500'))
+DeadlineMargin = float(os.environ.get('DeadlineMargin', '30'))
+MaxContinuations = int(os.environ.get('MaxContinuations', '10'))
+# Health check - 'fleet' searches the route tables of all the groups of a TGW once and fixes all their routes under one
+# set of locks, 'group' reconciles the groups one by one
+HealthCheckMode = os.environ.get('HealthCheckMode', 'fleet')
+# Flap dampening - fallback to a bouncing VPN connection is held back till its flap penalty decays
+FlapDampeningEnabled = os.environ.get('FlapDampening', 'yes')
+FlapDampeningParameters = DampeningParameters(
+    half_life=float(os.environ.get('DampeningHalfLife', '900')),
+    flap_penalty=float(os.environ.get('DampeningFlapPenalty', '1000')),
+    suppress_limit=float(os.environ.get('DampeningSuppressLimit', '2000')),
+    reuse_limit=float(os.environ.get('DampeningReuseLimit', '750')),
+    max_suppress_time=float(os.environ.get('DampeningMaxSuppressTime', '3600')),
+)
+FlapDampeningRecordTTL = 86400
+# Event deduplication - a tunnel event delivered again, or repeating the last event of its tunnel within the same
+# EventDedupeWindow seconds, is dropped before any EC2 call or lock
+EventDedupeEnabled = os.environ.get('EventDedupe', 'yes')
+EventDedupeWindow = int(os.environ.get('EventDedupeWindow', '60'))
+EventDedupeRecordTTL = 3600
+EventDedupeCacheSize = 1024
+# how long an event is in progress when the invocation does not tell its deadline - the longest Lambda timeout
+EventDedupeInProgressTTL = 900
+# CloudWatch namespace of the metrics written to the log in Embedded Metric Format
+MetricsNamespace = os.environ.get('MetricsNamespace', 'IPsecManagement')
 
 # Set up  logger
 logger = logging.getLogger()
 logger.setLevel(logging.os.environ['LOGLEVEL'])
 
-ec2 = boto3.client('ec2', region_name=TGWRegion)
+# the shared clients are asked for here, in the init phase - it runs with the full CPU of the sandbox,
+# while building a client (the EC2 one in particular) in the first invocation takes several times longer
+ec2 = aws_clients.client('ec2', region_name=TGWRegion, max_pool_connections=SweepParallelism + 2)
 # get a reference to the DynamoDB resource
-dynamodb_resource = boto3.resource('dynamodb')
+dynamodb_resource = aws_clients.resource('dynamodb')
+# created on first use and reused by the following invocations of a warm container
+lock_client = None
+# the invocation that last used the lock client
+lock_client_invocation = 0
+topology_cache = None
+route_index_cache = None
+route_index_table = None
+flap_dampening = None
+event_dedupe = None
+lambda_client = None
+# the context of the running invocation, the number of invocations of the container so far, and the number of
+# invocations the work was handed over by before it
+invocation_context = None
+invocation_number = 0
+invocation_continuation = 0
+# the tunnel event recorded as seen by the running invocation, forgotten if the invocation fails
+invocation_event = None
+metrics = Metrics(MetricsNamespace, {'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')})
+
+
+class RateLimiter:
+
+    # spaces out the EC2 calls made by all the sweep workers, so the API request rate stays
+    # bounded no matter how many route tables are searched in parallel
+    def __init__(self, calls_per_second):
+        self.interval = 1.0 / calls_per_second if calls_per_second > 0 else 0.0
+        self.next_call_time = time.monotonic()
+        self.thread_lock = threading.Lock()
+
+    def acquire(self):
+        if self.interval == 0.0:
+            return
+        with self.thread_lock:
+            now = time.monotonic()
+            wait_time = self.next_call_time - now
+            self.next_call_time = max(now, self.next_call_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+ec2_rate_limiter = RateLimiter(EC2MaxCallsPerSecond)
+
+
+class TopologyCache:
+
+    # the TGW topology hardly ever changes, so it is kept in the memory of the warm container for ttl seconds
+    # and, with a table, in the DynamoDB lock table as well, for the other containers. The persisted copy is
+    # the one read under the lock - every route change made under the lock is written through to it.
+    def __init__(self, ttl, table=None):
+        self.ttl = ttl
+        self.table = table
+        self.entries = {}
+        self.thread_lock = threading.Lock()
+
+    def get(self, key, consistent=False):
+        # consistent - skip the memory copy and read the persisted one, a miss if nothing is persisted
+        if self.ttl <= 0:
+            return None
+        now = time.time()
+        if not consistent:
+            with self.thread_lock:
+                entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                metrics.increment('TopologyCacheHits')
+                return entry[1]
+        if self.table is None:
+            metrics.increment('TopologyCacheMisses')
+            return None
+        try:
+            item = self.table.get_item(Key={'lock_key': key, 'sort_key': 'topology'}, ConsistentRead=True).get('Item')
+        except ClientError as e:
+            logger.warning('Could not read the cached topology ' + key + ': ' + str(e))
+            return None
+        if item is None or int(item['expiry_time']) <= now:
+            metrics.increment('TopologyCacheMisses')
+            return None
+        metrics.increment('TopologyCacheHits')
+        value = json.loads(item['value'])
+        with self.thread_lock:
+            self.entries[key] = (int(item['expiry_time']), value)
+        return value
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        expiry_time = int(time.time()) + self.ttl
+        with self.thread_lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] == value and entry[0] - expiry_time > -self.ttl / 2:
+                # unchanged and well within its TTL, there is nothing to write
+                return
+            self.entries[key] = (expiry_time, value)
+        if self.table is None:
+            return
+        serialized_value = json.dumps(value, separators=(',', ':'))
+        try:
+            if len(serialized_value) > TopologyCacheMaxItemSize:
+                # too large for a DynamoDB item - drop the persisted copy, it would be out of date
+                logger.warning('The topology ' + key + ' is too large to be persisted, caching it in memory only')
+                self.table.delete_item(Key={'lock_key': key, 'sort_key': 'topology'})
+                return
+            self.table.put_item(Item={'lock_key': key, 'sort_key': 'topology', 'value': serialized_value, 'expiry_time': expiry_time})
+        except ClientError as e:
+            logger.warning('Could not persist the cached topology ' + key + ': ' + str(e))
+
+    def invalidate(self, key):
+        with self.thread_lock:
+            self.entries.pop(key, None)
+        if self.table is None:
+            return
+        try:
+            self.table.delete_item(Key={'lock_key': key, 'sort_key': 'topology'})
+        except ClientError as e:
+            logger.warning('Could not invalidate the cached topology ' + key + ': ' + str(e))
+
+
+class AttachmentGroup:
+
+    # a group of VPCs routed through its own ordered list of TGW VPN attachments - the first
+    # attachment is the primary one, the rest are the failover attachments in order of preference
+    def __init__(self, TGWID, name, TGWAttachmentIDs, VpnConnectionIds=None, TGWRouteTableIDs=None):
+        self.TGWID = TGWID
+        self.name = name
+        self.TGWAttachmentIDs = list(TGWAttachmentIDs)
+        self.VpnConnectionIds = list(VpnConnectionIds or [])
+        self.TGWRouteTableIDs = list(TGWRouteTableIDs or [])
+
+    def next_attachment(self, TGWAttachmentID):
+        return self.TGWAttachmentIDs[(self.TGWAttachmentIDs.index(TGWAttachmentID) + 1) % len(self.TGWAttachmentIDs)]
+
+    def lower_priority_attachments(self, TGWAttachmentID):
+        return self.TGWAttachmentIDs[self.TGWAttachmentIDs.index(TGWAttachmentID) + 1:]
+
+    def __str__(self):
+        return self.TGWID + '/' + self.name
+
+
+def load_config():
+
+    if TGWConfig:
+        config = json.loads(TGWConfig)
+    elif TGWConfigFile:
+        with open(TGWConfigFile) as config_file:
+            config = json.load(config_file)
+    else:
+        config = {
+            'TransitGateways': [
+                {
+                    'TransitGatewayId': TGWID,
+                    'AttachmentGroups': [
+                        {
+                            'Name': 'default',
+                            'Attachments': [TGWAttachmentID1, TGWAttachmentID2]
+                        }
+                    ]
+                }
+            ]
+        }
+    groups = []
+    for transit_gateway in config['TransitGateways']:
+        for group in transit_gateway['AttachmentGroups']:
+            if len(group['Attachments']) < 2:
+                raise ValueError('Attachment group ' + group['Name'] + ' needs at least two attachments')
+            if len(group.get('VpnConnections', [])) not in (0, len(group['Attachments'])):
+                raise ValueError('Attachment group ' + group['Name'] + ' needs one VPN connection per attachment')
+            groups.append(AttachmentGroup(transit_gateway['TransitGatewayId'], group['Name'], group['Attachments'], group.get('VpnConnections'), group.get('RouteTables')))
+    return groups
+
+
+def index_groups(groups):
+
+    # attachment ID / VPN connection ID -> group, so routing an event does not depend on the number of groups
+    group_index = {}
+    for group in groups:
+        for ID in group.TGWAttachmentIDs + group.VpnConnectionIds:
+            if ID in group_index:
+                raise ValueError(ID + ' is configured in both ' + str(group_index[ID]) + ' and ' + str(group))
+            group_index[ID] = group
+    return group_index
+
+
+AttachmentGroups = load_config()
+AttachmentGroupIndex = index_groups(AttachmentGroups)
+TransitGatewayIDs = set(group.TGWID for group in AttachmentGroups)
+
+
+class IPsecManagementError(Exception):
+    pass
+
+
+class UnknownTransitGatewayError(IPsecManagementError):
+    pass
+
+
+class UnknownAttachmentError(IPsecManagementError):
+    pass
+
+
+SupportedChangeTypes = ('VPN-CONNECTION-IPSEC-UP', 'VPN-CONNECTION-IPSEC-DOWN', 'VPN-CONNECTION-IPSEC-HEALTHCHECK', 'VPN-CONNECTION-IPSEC-CONTINUE', 'VPN-CONNECTION-IPSEC-MIGRATE')
+
 
 def lambda_handler(event, context):  
     
+    # the handler returns (rather than calling exit()) so that the runtime, and with it the module level
+    # clients and the lock client, survive for the next invocation of the warm container
+    global invocation_context, invocation_number, invocation_event
+    start_time = time.monotonic()
+    invocation_context = context
+    invocation_number += 1
+    invocation_event = None
+    instrument_client(ec2, metrics, 'EC2')
+    instrument_client(dynamodb_resource.meta.client, metrics, 'DynamoDB')
+    try:
+        result = handle_event(event, start_time)
+        # only an event done drops its retries and deliveries
+        event_done()
+        return result
+    except Exception:
+        metrics.increment('Errors')
+        # the retry of the event must not be taken for a duplicate
+        forget_event()
+        raise
+    finally:
+        # the metrics of the invocation, including the lock client's, go out as one EMF log line
+        metrics.flush()
+
+
+def handle_event(event, start_time):
+
     logger.info('Got event ' + json.dumps(event))
+
+    if 'Records' in event:
+        return handle_event_batch(event['Records'], start_time)
     
     eventreason = event['detail']['changeType']
-    event_transitGatewayArn = event['detail']['transitGatewayArn']
-    event_TGWID = event_transitGatewayArn.split('/')[1]
-    if event_TGWID != TGWID:
-        logger.error ('Lambda function called for the TGW ' + event_TGWID + ' but supposed to work only with TGW ' + TGWID + '. Exiting')
-        exit(1)
-        
-    if eventreason != 'VPN-CONNECTION-IPSEC-HEALTHCHECK':
-        event_transitGatewayAttachmentArn = event['detail']['transitGatewayAttachmentArn']
-        event_transitGatewayAttachment = event_transitGatewayAttachmentArn.split('/')[1]
-        if event_transitGatewayAttachment != TGWAttachmentID1 and event_transitGatewayAttachment != TGWAttachmentID2:
-            logger.error ('Lambda function called for the TGW attachment ' + event_transitGatewayAttachment + ' but supposed to work with the attachments ' + TGWAttachmentID1 + ' and ' + TGWAttachmentID1 + '. Exiting')
-            exit(1)
-    
-        vpnConnectionArn = event['detail']['vpnConnectionArn']
-        VpnConnectionId = vpnConnectionArn.split('/')[1]
+    result = {'changeType': eventreason, 'action': 'none', 'groups': [], 'routesChanged': 0, 'changes': [], 'timings': {}}
+    if eventreason not in SupportedChangeTypes:
+        logger.info('Ignoring the event ' + eventreason)
+        result['action'] = 'ignored'
+        return handler_result(result, start_time)
 
-        logger.info('Got event ' + eventreason + ' for VPNConnectionId : ' + VpnConnectionId)
+    try:
+        event_TGWID = event_transit_gateway(event['detail'])
+    except UnknownTransitGatewayError as e:
+        # with TGWConfig the event rule matches the events of every TGW in the account, not only the configured ones
+        logger.info('Ignoring the event ' + eventreason + ': ' + str(e))
+        result['action'] = 'ignored'
+        return handler_result(result, start_time)
+    if eventreason in ('VPN-CONNECTION-IPSEC-UP', 'VPN-CONNECTION-IPSEC-DOWN'):
+        group, event_transitGatewayAttachment, VpnConnectionId = event_attachment(event['detail'])
+        logger.info('Got event ' + eventreason + ' for VPNConnectionId : ' + VpnConnectionId + ' in the attachment group ' + str(group))
+        if duplicate_event(event, VpnConnectionId):
+            result['action'] = 'duplicate'
+            return handler_result(result, start_time)
 
     if eventreason == 'VPN-CONNECTION-IPSEC-UP':
         if FallbackSupport == 'no':
             logger.info('Got VPN-CONNECTION-IPSEC-UP and fallback is not configured..')
             logger.info('Doing nothing, exiting..')
-            exit(0)
+            return handler_result(result, start_time)
         
+        phase_start_time = time.monotonic()
         vpn_connections_response = ec2.describe_vpn_connections(VpnConnectionIds=[VpnConnectionId])
-        if vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][0]['Status'] == 'DOWN':
-            logger.info ('The tunnel with OutsideIpAddress ' + vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][0]['OutsideIpAddress'] + ' is DOWN for the VPN connection ' + VpnConnectionId)
+        result['timings']['vpnStatus'] = elapsed_ms(phase_start_time)
+        health = evaluate_vpn_connections(vpn_connections_response, TunnelHealthPolicy)[VpnConnectionId]
+        suppressed = fallback_suppressed(vpn_connections_response['VpnConnections'][0], health)
+        if health.state != 'UP':
+            logger.info('The VPN connection ' + VpnConnectionId + ' is ' + health.state + ', not falling back to it')
             logger.info('Doing nothing, exiting..')
-            exit(0)
-        if vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][1]['Status'] == 'DOWN':
-            logger.info ('The tunnel with OutsideIpAddress ' + vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][1]['OutsideIpAddress'] + ' is DOWN for the VPN connection ' + VpnConnectionId)
-            logger.info('Doing nothing, exiting..')
-            exit(0)
-        logger.info("Both connection for " + VpnConnectionId + " are UP and fallback configured.")
+            return handler_result(result, start_time)
+        logger.info('The VPN connection ' + VpnConnectionId + ' is UP and fallback configured.')
+        if suppressed:
+            logger.info('The VPN connection ' + VpnConnectionId + ' is flapping, fallback is suppressed till its flap penalty decays')
+            result['action'] = 'suppressed'
+            return handler_result(result, start_time)
 
-        update_static_route(TGWID, TGWAttachmentID2 if event_transitGatewayAttachment==TGWAttachmentID1 else TGWAttachmentID1, event_transitGatewayAttachment)
-        exit(0)
+        # fall back from every attachment further down the group's failover list
+        TGWAttachmentIDs_Fallback = group.lower_priority_attachments(event_transitGatewayAttachment)
+        if len(TGWAttachmentIDs_Fallback) == 0:
+            logger.info(event_transitGatewayAttachment + ' is the last attachment of the group ' + str(group) + ', nothing to fall back from')
+            logger.info('Doing nothing, exiting..')
+            return handler_result(result, start_time)
+        result['action'] = 'fallback'
+        add_route_update(result, group, reconcile_static_routes(group, {event_transitGatewayAttachment: 'UP'}))
+        return handler_result(result, start_time)
 
     if eventreason == 'VPN-CONNECTION-IPSEC-DOWN':
 
+        phase_start_time = time.monotonic()
         vpn_connections_response = ec2.describe_vpn_connections(VpnConnectionIds=[VpnConnectionId])
-        if vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][0]['Status'] == 'UP':
-            logger.info ('The tunnel with OutsideIpAddress ' + vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][0]['OutsideIpAddress'] + ' is UP for the VPN connection ' + VpnConnectionId)
+        result['timings']['vpnStatus'] = elapsed_ms(phase_start_time)
+        health = evaluate_vpn_connections(vpn_connections_response, TunnelHealthPolicy)[VpnConnectionId]
+        if health.state == 'DEGRADED' and FailoverPlanning == 'yes':
+            logger.info('The VPN connection ' + VpnConnectionId + ' is DEGRADED, planning the failover off it ahead')
+            result['action'] = 'plan'
+            prepare_failover_plan(group, event_transitGatewayAttachment)
+            return handler_result(result, start_time)
+        if health.state != 'DOWN':
+            logger.info('The VPN connection ' + VpnConnectionId + ' is ' + health.state + ', not failing over from it')
             logger.info('Doing nothing, exiting..')
-            exit(0)
-        if vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][1]['Status'] == 'UP':
-            logger.info ('The tunnel with OutsideIpAddress ' + vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][1]['OutsideIpAddress'] + ' is UP for the VPN connection ' + VpnConnectionId)
-            logger.info('Doing nothing, exiting..')
-            exit(0)
-        logger.info("Both connection for " + VpnConnectionId + " are down!")
+            return handler_result(result, start_time)
+        logger.info('The VPN connection ' + VpnConnectionId + ' is DOWN!')
 
-        update_static_route(TGWID, event_transitGatewayAttachment, TGWAttachmentID2 if event_transitGatewayAttachment==TGWAttachmentID1 else TGWAttachmentID1)
-        exit(0)
+        result['action'] = 'failover'
+        add_route_update(result, group, reconcile_static_routes(group, {event_transitGatewayAttachment: 'DOWN'}))
+        # counted towards the flap penalty once the routes are moved, off the failover path
+        fallback_suppressed(vpn_connections_response['VpnConnections'][0], health)
+        return handler_result(result, start_time)
 
     if eventreason == 'VPN-CONNECTION-IPSEC-HEALTHCHECK':
 
-        describe_transit_gateway_attachments_response = ec2.describe_transit_gateway_attachments(
-                TransitGatewayAttachmentIds=[
-                    TGWAttachmentID1,
-                    TGWAttachmentID2
-                ]
-        )
-        for y in range (len (describe_transit_gateway_attachments_response['TransitGatewayAttachments'])):
-                ResourceId = describe_transit_gateway_attachments_response['TransitGatewayAttachments'][y]['ResourceId']
-                vpn_connections_response = ec2.describe_vpn_connections(VpnConnectionIds=[ResourceId])
-                if vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][0]['Status'] == 'UP':
-                    logger.info ('The tunnel with OutsideIpAddress ' + vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][0]['OutsideIpAddress'] + ' is UP for the VPN connection ' + ResourceId)
-                    logger.info('Continue.. ')
-                    continue
-                if vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][1]['Status'] == 'UP':
-                    logger.info ('The tunnel with OutsideIpAddress ' + vpn_connections_response['VpnConnections'][0]['VgwTelemetry'][1]['OutsideIpAddress'] + ' is UP for the VPN connection ' + ResourceId)
-                    logger.info('Continue.. ')
-                    continue
-                logger.info("Both connection for " + ResourceId + " are down!")
-                update_static_route(TGWID, ResourceId, TGWAttachmentID2 if ResourceId==TGWAttachmentID1 else TGWAttachmentID1)
-                exit(0)
-
-
-def update_static_route(TGWID, TGWAttachmentID_Current, TGWAttachmentID_NEW):
-
-    lock_client = DynamoDBLockClient(dynamodb_resource, table_name=DynamoDBLockTable, lease_duration=datetime.timedelta(0, 60), expiry_period=datetime.timedelta(0, 1200))
-    lock = lock_client.acquire_lock('my_key')
-
-    try:
-        describe_transit_gateway_route_tables_response = ec2.describe_transit_gateway_route_tables(
-                Filters=[
-                    {
-                        'Name': 'transit-gateway-id',
-                        'Values': [
-                            TGWID,
-                        ]
-                    },
-                ]
-        )
-        logger.debug (describe_transit_gateway_route_tables_response) 
-        logger.debug (len (describe_transit_gateway_route_tables_response['TransitGatewayRouteTables']))
-        search_transit_gateway_routes_response = ec2.search_transit_gateway_routes(
-                TransitGatewayRouteTableId=describe_transit_gateway_route_tables_response['TransitGatewayRouteTables'][1]['TransitGatewayRouteTableId'],
-                Filters=[
-                    {
-                        'Name': 'attachment.transit-gateway-attachment-id',
-                        'Values': [
-                            TGWAttachmentID_Current,
-                        ]
-                    },
-                    {
-                        'Name': 'type',
-                        'Values': [
-                            'static',
-                        ]
-                    },
+        # the scheduled health check covers every group of the given TGW, or of all the TGWs if none is given
+        groups = [group for group in AttachmentGroups if event_TGWID is None or group.TGWID == event_TGWID]
+        result['action'] = 'reconcile'
+        failed_groups = reconcile_fleet(groups, result) if HealthCheckMode == 'fleet' else reconcile_groups(groups, result)
+        if failed_groups:
+            raise IPsecManagementError('Reconciling the routes of ' + ', '.join(str(group) for group in failed_groups) + ' failed')
+        return handler_result(result, start_time)
+
+    if eventreason == 'VPN-CONNECTION-IPSEC-CONTINUE':
+
+        # handed over by an invocation running out of time - the group is reconciled against the current state of
+        # its VPN connections, from the route index written through up to the last checkpoint
+        global invocation_continuation
+        groups = [group for group in AttachmentGroups if str(group) == event['detail']['group']]
+        if not groups:
+            raise UnknownAttachmentError('Attachment group ' + event['detail']['group'] + ' is not configured')
+        invocation_continuation = event['detail'].get('continuation', 1)
+        logger.info('Continuing the route changes of the group ' + str(groups[0]) + ', handed over ' + str(invocation_continuation) + ' times so far')
+        result['action'] = 'continue'
+        try:
+            failed_groups = reconcile_groups(groups, result)
+        finally:
+            invocation_continuation = 0
+        if failed_groups:
+            raise IPsecManagementError('Reconciling the routes of ' + ', '.join(str(group) for group in failed_groups) + ' failed')
+        return handler_result(result, start_time)
+
+    if eventreason == 'VPN-CONNECTION-IPSEC-MIGRATE':
+
+        # moves the static routes of the given group, or of every group of the TGW, onto prefix list references -
+        # only planned unless dryRun is false, and only made with the prefix list routing mode on
+        groups = [group for group in AttachmentGroups if (event_TGWID is None or group.TGWID == event_TGWID) and event['detail'].get('group', str(group)) == str(group)]
+        if not groups:
+            raise UnknownAttachmentError('Attachment group ' + str(event['detail'].get('group')) + ' is not configured')
+        dry_run = event['detail'].get('dryRun', True)
+        if not dry_run and RoutingMode != 'prefix-list':
+            raise IPsecManagementError('Set RoutingMode to prefix-list before migrating routes onto prefix lists')
+        result['action'] = 'plan' if dry_run else 'migrate'
+        result['migration'] = [migrate_static_routes(group, dry_run, result) for group in groups]
+        return handler_result(result, start_time)
+
+
+def event_transit_gateway(detail):
+
+    # the TGW ID of the event, None if the event does not name one
+    if 'transitGatewayArn' not in detail:
+        return None
+    event_TGWID = detail['transitGatewayArn'].split('/')[1]
+    if event_TGWID not in TransitGatewayIDs:
+        raise UnknownTransitGatewayError('TGW ' + event_TGWID + ' is not configured, the function works only with TGWs ' + ', '.join(sorted(TransitGatewayIDs)))
+    return event_TGWID
+
+
+def event_attachment(detail):
+
+    # the attachment group, TGW attachment ID and VPN connection ID of a tunnel event
+    event_TGWID = event_transit_gateway(detail)
+    event_transitGatewayAttachment = detail['transitGatewayAttachmentArn'].split('/')[1]
+    VpnConnectionId = detail['vpnConnectionArn'].split('/')[1]
+    group = AttachmentGroupIndex.get(event_transitGatewayAttachment) or AttachmentGroupIndex.get(VpnConnectionId)
+    if group is None or group.TGWID != event_TGWID or event_transitGatewayAttachment not in group.TGWAttachmentIDs:
+        logger.error ('Lambda function called for the TGW attachment ' + event_transitGatewayAttachment + ' which is not configured in any attachment group of the TGW ' + str(event_TGWID) + '. Exiting')
+        raise UnknownAttachmentError('TGW attachment ' + event_transitGatewayAttachment + ' is not configured')
+    return group, event_transitGatewayAttachment, VpnConnectionId
+
+
+def handle_event_batch(records, start_time):
+
+    # EventBridge -> SQS -> Lambda: the tunnel events queued during the batching window are collapsed into
+    # the latest event of each VPN connection, and every attachment group they touch is reconciled once,
+    # against the current state of all its VPN connections. The messages of a group that failed are
+    # reported back to SQS to be retried, the rest of the batch is done.
+    result = {'changeType': 'VPN-CONNECTION-IPSEC-BATCH', 'action': 'reconcile', 'groups': [], 'routesChanged': 0, 'changes': [], 'timings': {}, 'batchItemFailures': []}
+    latest_events = coalesce_events(records)
+    groups = []
+    group_messages = {}
+    for VpnConnectionId, latest_event in latest_events.items():
+        group = latest_event['group']
+        logger.info('Latest event for VPNConnectionId : ' + VpnConnectionId + ' in the attachment group ' + str(group) + ' is ' + latest_event['changeType'] + ' (' + str(len(latest_event['messageIds'])) + ' events)')
+        if group not in group_messages:
+            groups.append(group)
+            group_messages[group] = []
+        group_messages[group].extend(latest_event['messageIds'])
+    logger.info('Coalesced ' + str(len(records)) + ' events into ' + str(len(latest_events)) + ' VPN connections of ' + str(len(groups)) + ' attachment groups')
+    metrics.increment('EventsReceived', len(records))
+    metrics.increment('EventsCoalesced', len(records) - len(latest_events))
+    for group in reconcile_groups(groups, result):
+        result['batchItemFailures'].extend({'itemIdentifier': messageId} for messageId in group_messages[group])
+    return handler_result(result, start_time)
+
+
+def coalesce_events(records):
+
+    # VPN connection ID -> its latest tunnel event in the batch, with the IDs of all the messages it stands for.
+    # Events which are not tunnel events of a configured attachment are logged and dropped.
+    latest_events = {}
+    for record in records:
+        event = json.loads(record['body'])
+        eventreason = event['detail']['changeType']
+        if eventreason not in ('VPN-CONNECTION-IPSEC-UP', 'VPN-CONNECTION-IPSEC-DOWN'):
+            logger.info('Ignoring the event ' + eventreason)
+            continue
+        try:
+            group, event_transitGatewayAttachment, VpnConnectionId = event_attachment(event['detail'])
+        except UnknownTransitGatewayError as e:
+            logger.info('Ignoring the event ' + record['messageId'] + ': ' + str(e))
+            continue
+        except IPsecManagementError as e:
+            logger.error('Dropping the event ' + record['messageId'] + ': ' + str(e))
+            continue
+        latest_event = latest_events.setdefault(VpnConnectionId, {'time': '', 'messageIds': []})
+        latest_event['messageIds'].append(record['messageId'])
+        # EventBridge times are ISO 8601 UTC, the later of two events with the same time is the one queued later
+        if event.get('time', '') >= latest_event['time']:
+            latest_event.update({'time': event.get('time', ''), 'changeType': eventreason, 'group': group})
+    return latest_events
+
+
+def reconcile_groups(groups, result):
+
+    # reconciles the given groups against one snapshot of all their VPN connections, and returns the groups
+    # whose routes could not be reconciled
+    failed_groups = []
+    for group, attachment_states in group_attachment_states(groups, result):
+        try:
+            add_route_update(result, group, reconcile_static_routes(group, attachment_states))
+        except (botocore.exceptions.ClientError, DynamoDBLockError) as e:
+            logger.error('Reconciling the routes of the group ' + str(group) + ' failed: ' + str(e))
+            metrics.increment('GroupsFailed')
+            failed_groups.append(group)
+    return failed_groups
+
+
+def group_attachment_states(groups, result):
+
+    # (group, attachment states) for each of the given groups with routes that could have to move, from one
+    # snapshot of all their VPN connections
+    phase_start_time = time.monotonic()
+    vpn_attachments = describe_vpn_attachments(groups)
+    # one batched lookup for all the watched VPN connections - the state of every tunnel is decided from this snapshot
+    try:
+        vpn_connections = describe_vpn_connections_by_id(list(vpn_attachments.values()))
+    except botocore.exceptions.ClientError as e:
+        # a VPN connection may have been replaced since the attachments were cached
+        invalidate_vpn_attachments(groups)
+        raise e
+    result['timings']['vpnStatus'] = elapsed_ms(phase_start_time)
+    connections_health = evaluate_vpn_connections(list(vpn_connections.values()), TunnelHealthPolicy)
+    suppressed = suppressed_connections(vpn_connections, connections_health)
+    group_states = []
+    for group in groups:
+        attachment_states = {}
+        for TGWAttachmentID in group.TGWAttachmentIDs:
+            ResourceId = vpn_attachments[TGWAttachmentID]
+            attachment_states[TGWAttachmentID] = connections_health[ResourceId].state
+            if ResourceId in suppressed and attachment_states[TGWAttachmentID] == 'UP':
+                # UP, but not to fall back to - it still takes routes failed over from a DOWN attachment
+                logger.info('The VPN connection ' + ResourceId + ' is flapping, fallback to it is suppressed')
+                attachment_states[TGWAttachmentID] = 'DAMPENED'
+        # with every attachment UP and no fallback there is nothing any route could move to
+        if FallbackSupport != 'yes' and 'DOWN' not in attachment_states.values():
+            continue
+        group_states.append((group, attachment_states))
+    return group_states
+
+
+def reconcile_fleet(groups, result):
+
+    # the health check of the whole fleet in one pass: one snapshot of every watched VPN connection, one search of
+    # every route table for the attachments of all the groups using it, and every misplaced route of every group
+    # replaced under a single set of locks. Returns the groups whose routes could not be reconciled.
+    group_states = group_attachment_states(groups, result)
+    phase_start_time = time.monotonic()
+    group_route_tables = []
+    for group, attachment_states in group_states:
+        if group.TGWRouteTableIDs:
+            group_route_tables.append([{'TransitGatewayRouteTableId': TGWRouteTableID} for TGWRouteTableID in group.TGWRouteTableIDs])
+        else:
+            group_route_tables.append(cached_route_tables(group.TGWID))
+    result['timings']['routeTables'] = elapsed_ms(phase_start_time)
+
+    # always a fresh search - the health check is what catches the routes the cache does not know about
+    phase_start_time = time.monotonic()
+    route_indexes = fleet_route_indexes([group for group, attachment_states in group_states], group_route_tables)
+    fleet_changes = []
+    for (group, attachment_states), route_tables, route_index in zip(group_states, group_route_tables, route_indexes):
+        store_route_index(group, route_tables, route_index)
+        route_changes = plan_route_changes(group, route_index, attachment_states)
+        if route_changes:
+            fleet_changes.append((group, attachment_states, route_tables, route_index, route_changes))
+    result['timings']['routePlan'] = elapsed_ms(phase_start_time)
+    if not fleet_changes:
+        logger.info ('All the static routes of the ' + str(len(group_states)) + ' attachment groups are in place')
+        return []
+    logger.info ('Found ' + str(sum(len(route_changes) for group, attachment_states, route_tables, route_index, route_changes in fleet_changes)) + ' misplaced routes in ' + str(len(fleet_changes)) + ' attachment groups')
+
+    phase_start_time = time.monotonic()
+    lock_client = get_lock_client()
+    try:
+        locks = lock_client.acquire_locks([lock_key for group, attachment_states, route_tables, route_index, route_changes in fleet_changes for lock_key in lock_keys(group, route_tables)])
+    except DynamoDBLockError as e:
+        logger.error('Locking the routes of the fleet failed: ' + str(e))
+        metrics.increment('GroupsFailed', len(fleet_changes))
+        return [group for group, attachment_states, route_tables, route_index, route_changes in fleet_changes]
+    result['timings']['lockWait'] = elapsed_ms(phase_start_time)
+
+    try:
+        # replanned under the lock from the route index just stored, the routes may have been moved while waiting for it
+        phase_start_time = time.monotonic()
+        replanned_changes = []
+        for group, attachment_states, route_tables, route_index, route_changes in fleet_changes:
+            route_index = group_route_index(group, route_tables, consistent=True)[0]
+            replanned_changes.append((group, attachment_states, route_tables, route_index, plan_route_changes(group, route_index, attachment_states)))
+        fleet_changes = replanned_changes
+        result['timings']['routeSearch'] = elapsed_ms(phase_start_time)
+        phase_start_time = time.monotonic()
+        failed_groups = replace_fleet_routes(fleet_changes, result)
+        result['timings']['routeReplace'] = elapsed_ms(phase_start_time)
+    except botocore.exceptions.ClientError as e:
+        logger.error('Reconciling the routes of the fleet failed: ' + str(e))
+        for group, attachment_states, route_tables, route_index, route_changes in fleet_changes:
+            invalidate_topology(group)
+        metrics.increment('GroupsFailed', len(fleet_changes))
+        failed_groups = [group for group, attachment_states, route_tables, route_index, route_changes in fleet_changes]
+    finally:
+        release_locks(lock_client, locks)
+    return failed_groups
+
+
+def fleet_route_indexes(groups, group_route_tables):
+
+    # the static route index of each of the given groups, from a single search of every route table for the
+    # attachments of all the groups using it - groups sharing the route tables of a TGW are searched together
+    route_table_attachments = {}
+    for group, route_tables in zip(groups, group_route_tables):
+        for route_table in route_tables:
+            route_table_attachments.setdefault(route_table['TransitGatewayRouteTableId'], []).extend(group.TGWAttachmentIDs)
+    TGWRouteTableIDs = list(route_table_attachments)
+    search_results = dict(zip(TGWRouteTableIDs, run_in_parallel(search_route_table, [(TGWRouteTableID, route_table_attachments[TGWRouteTableID]) for TGWRouteTableID in TGWRouteTableIDs])))
+    logger.info ('Searched ' + str(len(TGWRouteTableIDs)) + ' route tables for the routes of ' + str(len(groups)) + ' attachment groups')
+    route_indexes = []
+    for group, route_tables in zip(groups, group_route_tables):
+        route_index = dict((TGWAttachmentID, []) for TGWAttachmentID in group.TGWAttachmentIDs)
+        for route_table in route_tables:
+            for record in search_results[route_table['TransitGatewayRouteTableId']]:
+                destination, RouteAttachmentIDs = route_destination(record)
+                for TGWAttachmentID in RouteAttachmentIDs:
+                    if TGWAttachmentID in route_index:
+                        route_index[TGWAttachmentID].append((route_table['TransitGatewayRouteTableId'], destination))
+        route_indexes.append(route_index)
+    return route_indexes
+
+
+def replace_fleet_routes(fleet_changes, result):
+
+    # replaces the route changes of all the groups together, CheckpointRoutes at a time, writing each batch through
+    # to the route index of its groups. The groups left at the deadline are handed over to a new invocation each,
+    # the groups of a batch that failed are returned with the groups not reached.
+    # group by group, so that a batch writes through to the route index of as few groups as it can
+    fleet_route_changes = [
+        (route_change, group)
+        for group, attachment_states, route_tables, route_index, route_changes in fleet_changes
+        for route_change in sorted(route_changes, key=lambda route_change: route_change[0])
+    ]
+    fleet_state = dict((group, {'route_tables': route_tables, 'route_index': route_index, 'done': []}) for group, attachment_states, route_tables, route_index, route_changes in fleet_changes)
+    batch_duration = 0.0
+    failed_groups = []
+    for i in range(0, len(fleet_route_changes), CheckpointRoutes):
+        if out_of_time(batch_duration):
+            logger.warning ('Running out of time with ' + str(len(fleet_route_changes) - i) + ' routes of the fleet left to replace')
+            for group, attachment_states, route_tables, route_index, route_changes in fleet_changes:
+                if len(fleet_state[group]['done']) < len(route_changes):
+                    if continue_later(group):
+                        result.setdefault('continuedGroups', []).append(str(group))
+            break
+        batch_start_time = time.monotonic()
+        fleet_route_changes_batch = fleet_route_changes[i:i + CheckpointRoutes]
+        batch_groups = []
+        for route_change, group in fleet_route_changes_batch:
+            if group not in batch_groups:
+                batch_groups.append(group)
+        try:
+            replace_static_routes([route_change for route_change, group in fleet_route_changes_batch])
+        except botocore.exceptions.ClientError as e:
+            logger.error('Replacing the routes of the groups ' + ', '.join(str(group) for group in batch_groups) + ' failed: ' + str(e))
+            # the routes of every group not finished are left to the next health check
+            failed_groups = [group for group, attachment_states, route_tables, route_index, route_changes in fleet_changes if len(fleet_state[group]['done']) < len(route_changes)]
+            for group in batch_groups:
+                invalidate_topology(group)
+            metrics.increment('GroupsFailed', len(failed_groups))
+            break
+        for group in batch_groups:
+            group_batch = [route_change for route_change, batch_group in fleet_route_changes_batch if batch_group == group]
+            state = fleet_state[group]
+            state['route_index'] = moved_routes(state['route_index'], group_batch)
+            store_route_index(group, state['route_tables'], state['route_index'], group_batch)
+            state['done'].extend(group_batch)
+        batch_duration = time.monotonic() - batch_start_time
+    for group, attachment_states, route_tables, route_index, route_changes in fleet_changes:
+        if fleet_state[group]['done']:
+            changes = [
+                {'routeTable': TGWRouteTableID, 'destinationCidrBlock': DestinationCidrBlock, 'from': TGWAttachmentID_Current, 'to': TGWAttachmentID_Desired}
+                for TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_Current, TGWAttachmentID_Desired in fleet_state[group]['done']
+            ]
+            add_route_update(result, group, {'routesChanged': len(changes), 'changes': changes, 'timings': {}})
+    return failed_groups
+
+
+def add_route_update(result, group, route_update):
+
+    result['groups'].append(str(group))
+    result['routesChanged'] += route_update['routesChanged']
+    result['changes'].extend(route_update['changes'])
+    if route_update.get('continued'):
+        result.setdefault('continuedGroups', []).append(str(group))
+    for phase, duration in route_update['timings'].items():
+        result['timings'][phase] = result['timings'].get(phase, 0) + duration
+
+
+def handler_result(result, start_time):
+
+    result['timings']['total'] = elapsed_ms(start_time)
+    logger.info('Result ' + json.dumps(result))
+    metrics.set_property('changeType', result['changeType'])
+    metrics.set_property('action', result['action'])
+    metrics.increment('RoutesChanged', result['routesChanged'])
+    metrics.increment('GroupsReconciled', len(result['groups']))
+    for phase, duration in result['timings'].items():
+        metrics.add_timing(phase[0].upper() + phase[1:] + 'Time', duration)
+    return result
+
+
+def elapsed_ms(start_time):
+
+    return int((time.monotonic() - start_time) * 1000)
+
+
+def describe_vpn_attachments(groups):
+
+    # TGW attachment ID -> VPN connection ID for all the attachments of the given groups, taken from
+    # the config document where available and from a single DescribeTransitGatewayAttachments otherwise
+    vpn_attachments = {}
+    TGWAttachmentIDs = []
+    uncached_groups = []
+    for group in groups:
+        if group.VpnConnectionIds:
+            vpn_attachments.update(zip(group.TGWAttachmentIDs, group.VpnConnectionIds))
+            continue
+        cached_vpn_attachments = get_topology_cache().get('topology|' + str(group) + '|vpn-attachments')
+        if cached_vpn_attachments is not None:
+            vpn_attachments.update(cached_vpn_attachments)
+        else:
+            TGWAttachmentIDs.extend(group.TGWAttachmentIDs)
+            uncached_groups.append(group)
+    kwargs = {'TransitGatewayAttachmentIds': TGWAttachmentIDs}
+    while TGWAttachmentIDs:
+        ec2_rate_limiter.acquire()
+        describe_transit_gateway_attachments_response = ec2.describe_transit_gateway_attachments(**kwargs)
+        for attachment in describe_transit_gateway_attachments_response['TransitGatewayAttachments']:
+            vpn_attachments[attachment['TransitGatewayAttachmentId']] = attachment['ResourceId']
+        if not describe_transit_gateway_attachments_response.get('NextToken'):
+            break
+        kwargs['NextToken'] = describe_transit_gateway_attachments_response['NextToken']
+    for group in uncached_groups:
+        get_topology_cache().put('topology|' + str(group) + '|vpn-attachments', dict((TGWAttachmentID, vpn_attachments[TGWAttachmentID]) for TGWAttachmentID in group.TGWAttachmentIDs))
+    return vpn_attachments
+
+
+def invalidate_vpn_attachments(groups):
+
+    for group in groups:
+        if not group.VpnConnectionIds:
+            get_topology_cache().invalidate('topology|' + str(group) + '|vpn-attachments')
+
+
+def describe_vpn_connections_by_id(VpnConnectionIds):
+
+    # a single DescribeVpnConnections call for all the given connections, indexed by VpnConnectionId
+    if len(VpnConnectionIds) == 0:
+        return {}
+    ec2_rate_limiter.acquire()
+    vpn_connections_response = ec2.describe_vpn_connections(VpnConnectionIds=VpnConnectionIds)
+    return dict((vpn_connection['VpnConnectionId'], vpn_connection) for vpn_connection in vpn_connections_response['VpnConnections'])
+
+
+def reconcile_static_routes(group, attachment_states):
+
+    # desired state reconciliation - the target attachment of every static route of the group is computed
+    # from the known attachment states, and only the routes whose target differs from the route table are
+    # replaced. A first pass without the lock returns straight away when everything is already in place,
+    # so duplicate events and health checks of a healthy group do not write anything, not even a lock.
+    timings = {}
+    phase_start_time = time.monotonic()
+    failover_plan = cached_failover_plan(group, attachment_states)
+    if failover_plan is not None:
+        # planned when the attachment lost its first tunnel - the route tables and the routes to move are in the plan
+        route_tables = [{'TransitGatewayRouteTableId': TGWRouteTableID} for TGWRouteTableID in failover_plan['RouteTables']]
+    elif group.TGWRouteTableIDs:
+        route_tables = [{'TransitGatewayRouteTableId': TGWRouteTableID} for TGWRouteTableID in group.TGWRouteTableIDs]
+    else:
+        route_tables = cached_route_tables(group.TGWID)
+    logger.debug (route_tables)
+    logger.debug (len (route_tables))
+    timings['routeTables'] = elapsed_ms(phase_start_time)
+
+    phase_start_time = time.monotonic()
+    if failover_plan is not None:
+        route_changes, cached = [tuple(route_change) for route_change in failover_plan['Changes']], True
+    else:
+        route_index, cached = group_route_index(group, route_tables)
+        route_changes = plan_route_changes(group, route_index, attachment_states)
+    if len(route_changes) == 0 and cached:
+        # a route added since the index was cached would be missed, so "nothing to do" is never taken from the cache
+        route_index, cached = group_route_index(group, route_tables, refresh=True)
+        route_changes = plan_route_changes(group, route_index, attachment_states)
+    timings['routePlan'] = elapsed_ms(phase_start_time)
+    if len(route_changes) == 0:
+        logger.info ('All the static routes of the group ' + str(group) + ' in ' + str(len(route_tables)) + ' route tables are in place')
+        return {'routesChanged': 0, 'changes': [], 'timings': timings}
+
+    phase_start_time = time.monotonic()
+    lock_client = get_lock_client()
+    locks = lock_client.acquire_locks(lock_keys(group, route_tables))
+    timings['lockWait'] = elapsed_ms(phase_start_time)
+
+    try:
+        # the plan is redone under the lock, the routes may have been moved while waiting for it - from the
+        # persisted route index if there is one, by searching the route tables again otherwise
+        phase_start_time = time.monotonic()
+        route_index, cached = group_route_index(group, route_tables, consistent=True)
+        if failover_plan is not None and cached and route_index_fingerprint(route_tables, route_index) == failover_plan['RouteIndex']:
+            # nothing moved since the plan was made, it is still the plan
+            logger.info ('Running the failover plan of ' + str(len(route_changes)) + ' route changes made ahead for the group ' + str(group))
+            metrics.increment('FailoverPlansUsed')
+        else:
+            if failover_plan is not None:
+                logger.info ('The routes of the group ' + str(group) + ' changed since the failover was planned, planning it again')
+                metrics.increment('FailoverPlansStale')
+            route_changes = plan_route_changes(group, route_index, attachment_states)
+        timings['routeSearch'] = elapsed_ms(phase_start_time)
+        phase_start_time = time.monotonic()
+        route_changes_done = []
+        try:
+            finished = replace_static_routes_checkpointed(group, route_tables, route_index, route_changes, route_changes_done)
+        except botocore.exceptions.ClientError as e:
+            if not cached:
+                raise e
+            logger.warning ('Replacing the routes of the group ' + str(group) + ' from the cached route index failed, searching the route tables again: ' + str(e))
+            invalidate_topology(group)
+            route_index, cached = group_route_index(group, route_tables, refresh=True)
+            route_changes = plan_route_changes(group, route_index, attachment_states)
+            finished = replace_static_routes_checkpointed(group, route_tables, route_index, route_changes, route_changes_done)
+        timings['routeReplace'] = elapsed_ms(phase_start_time)
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+        # a call that failed or timed out may have moved routes or not, the cached route index is not to be trusted
+        invalidate_topology(group)
+        raise e
+    finally:
+        # whatever went wrong - a lock held by the module level client would be heartbeated for as long as the container lives
+        release_locks(lock_client, locks)
+    changes = [
+        {'routeTable': TGWRouteTableID, 'destinationCidrBlock': DestinationCidrBlock, 'from': TGWAttachmentID_Current, 'to': TGWAttachmentID_Desired}
+        for TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_Current, TGWAttachmentID_Desired in route_changes_done
+    ]
+    route_update = {'routesChanged': len(route_changes_done), 'changes': changes, 'timings': timings}
+    if not finished:
+        route_update['continued'] = continue_later(group)
+    return route_update
+
+
+def replace_static_routes_checkpointed(group, route_tables, route_index, route_changes, route_changes_done):
+
+    # replaces the routes CheckpointRoutes at a time - each batch is written through to the route index, so a run
+    # stopped at the deadline leaves a route index the rest of the work can be planned from.
+    # route_changes_done is extended with the changes made, returns whether all of them were made.
+    route_changes = sorted(route_changes, key=lambda route_change: route_change[0])
+    batch_duration = 0.0
+    for i in range(0, len(route_changes), CheckpointRoutes):
+        if out_of_time(batch_duration):
+            logger.warning ('Running out of time with ' + str(len(route_changes) - i) + ' routes of the group ' + str(group) + ' left to replace')
+            return False
+        batch_start_time = time.monotonic()
+        route_changes_batch = route_changes[i:i + CheckpointRoutes]
+        replace_static_routes(route_changes_batch)
+        route_index = moved_routes(route_index, route_changes_batch)
+        store_route_index(group, route_tables, route_index, route_changes_batch)
+        route_changes_done.extend(route_changes_batch)
+        batch_duration = time.monotonic() - batch_start_time
+    return True
+
+
+def replace_static_routes(route_changes):
+
+    run_in_parallel(replace_static_route, [(TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_Desired) for TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_Current, TGWAttachmentID_Desired in route_changes])
+
+
+def plan_route_changes(group, route_index, attachment_states):
+
+    # (route table, CIDR, current attachment, desired attachment) for every route that has to move
+    route_changes = []
+    for TGWAttachmentID_Current in group.TGWAttachmentIDs:
+        TGWAttachmentID_Desired = desired_attachment(group, TGWAttachmentID_Current, attachment_states)
+        if TGWAttachmentID_Desired == TGWAttachmentID_Current:
+            continue
+        for TGWRouteTableID, DestinationCidrBlock in route_index.get(TGWAttachmentID_Current, []):
+            route_changes.append((TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_Current, TGWAttachmentID_Desired))
+    return route_changes
+
+
+def desired_attachment(group, TGWAttachmentID_Current, attachment_states):
+
+    # attachment_states maps attachment IDs to 'UP' / 'DEGRADED' / 'DAMPENED' / 'DOWN', attachments missing from it
+    # are of unknown state and are left alone. With fallback a route goes back to the highest priority attachment known to be UP,
+    # a route on a DOWN attachment moves to the next attachment of the group not known to be DOWN.
+    if FallbackSupport == 'yes':
+        for TGWAttachmentID in group.TGWAttachmentIDs[:group.TGWAttachmentIDs.index(TGWAttachmentID_Current)]:
+            if attachment_states.get(TGWAttachmentID) == 'UP':
+                return TGWAttachmentID
+    if attachment_states.get(TGWAttachmentID_Current) != 'DOWN':
+        return TGWAttachmentID_Current
+    TGWAttachmentID = group.next_attachment(TGWAttachmentID_Current)
+    while TGWAttachmentID != TGWAttachmentID_Current:
+        if attachment_states.get(TGWAttachmentID) != 'DOWN':
+            return TGWAttachmentID
+        TGWAttachmentID = group.next_attachment(TGWAttachmentID)
+    logger.warning ('All the attachments of the group ' + str(group) + ' are DOWN, leaving the routes to ' + TGWAttachmentID_Current + ' alone')
+    return TGWAttachmentID_Current
+
+
+def out_of_time(batch_duration):
+
+    # whether the invocation would get too close to its deadline making another batch of route changes
+    if invocation_context is None:
+        return False
+    return invocation_context.get_remaining_time_in_millis() / 1000.0 < DeadlineMargin + batch_duration
+
+
+def continue_later(group):
+
+    # hands the rest of the route changes of the group over to a new asynchronous invocation of the function, and
+    # returns whether it did - the health check is left to finish the work of a run handed over too many times
+    if invocation_continuation >= MaxContinuations:
+        logger.error ('The route changes of the group ' + str(group) + ' were handed over ' + str(invocation_continuation) + ' times, leaving the rest to the health check')
+        return False
+    get_lambda_client().invoke(
+        FunctionName=invocation_context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps({
+            'source': 'ipsec-management',
+            'detail-type': 'IPsec management continuation',
+            'detail': {'changeType': 'VPN-CONNECTION-IPSEC-CONTINUE', 'group': str(group), 'continuation': invocation_continuation + 1},
+        })
+    )
+    metrics.increment('Continuations')
+    logger.info ('Handed the rest of the route changes of the group ' + str(group) + ' over to a new invocation')
+    return True
+
+
+def get_lambda_client():
+
+    # only needed to hand work over, so not created at init
+    global lambda_client
+    if lambda_client is None:
+        lambda_client = aws_clients.client('lambda')
+    return lambda_client
+
+
+def lock_keys(group, route_tables):
+
+    # LockScope decides what a route update is serialized on: 'global' - every update in the account,
+    # 'route-table' - updates touching the same TGW route tables, 'group' - updates of the same attachment group
+    if LockScope == 'route-table':
+        return [group.TGWID + '|' + route_table['TransitGatewayRouteTableId'] for route_table in route_tables]
+    if LockScope == 'group':
+        return ['group|' + str(group)]
+    return ['my_key']
+
+
+def release_locks(lock_client, locks):
+
+    for lock in reversed(locks):
+        lock.release()
+    lock_client.pause()
+
+
+def get_lock_client():
+
+    # the lock client and its background threads live as long as the warm Lambda container,
+    # and are parked between invocations
+    global lock_client, lock_client_invocation
+    if lock_client is not None and not lock_client.is_healthy():
+        logger.warning('The lock client is not healthy any more, creating a new one')
+        lock_client.close()
+        lock_client = None
+    if lock_client is None:
+        lock_client = DynamoDBLockClient(dynamodb_resource, table_name=DynamoDBLockTable, lease_duration=datetime.timedelta(0, 60), expiry_period=datetime.timedelta(0, 1200), retry_strategy=BackoffRetryStrategy(), heartbeat_batch_size=25, metrics=metrics)
+    elif lock_client_invocation != invocation_number:
+        # the locks a previous invocation failed to release - they are not anybody's any more
+        released = lock_client.release_all_locks()
+        if released:
+            logger.warning('Released ' + str(released) + ' locks left over by a previous invocation')
+    lock_client_invocation = invocation_number
+    lock_client.resume()
+    return lock_client
+
+
+def get_topology_cache():
+
+    global topology_cache
+    if topology_cache is None:
+        topology_cache = TopologyCache(TopologyCacheTTL, dynamodb_resource.Table(DynamoDBLockTable) if TopologyCachePersist == 'yes' else None)
+    return topology_cache
+
+
+def get_route_index_table():
+
+    # None unless a route index table is configured
+    global route_index_table
+    if not RouteIndexTableName:
+        return None
+    if route_index_table is None:
+        route_index_table = RouteIndexTable(dynamodb_resource.Table(RouteIndexTableName), RouteIndexMaxAge)
+    return route_index_table
+
+
+def get_route_index_cache():
+
+    # with a route index table the route indexes are cached in memory only, the table is the persisted copy
+    global route_index_cache
+    if get_route_index_table() is None:
+        return get_topology_cache()
+    if route_index_cache is None:
+        route_index_cache = TopologyCache(TopologyCacheTTL)
+    return route_index_cache
+
+
+def get_flap_dampening():
+
+    # None unless both fallback and flap dampening are enabled - it only ever holds back a fallback
+    global flap_dampening
+    if FallbackSupport != 'yes' or FlapDampeningEnabled != 'yes':
+        return None
+    if flap_dampening is None:
+        flap_dampening = FlapDampening(dynamodb_resource, DynamoDBLockTable, FlapDampeningParameters, FlapDampeningRecordTTL)
+    return flap_dampening
+
+
+def get_event_dedupe():
+
+    global event_dedupe
+    if EventDedupeEnabled != 'yes':
+        return None
+    if event_dedupe is None:
+        event_dedupe = EventDedupe(dynamodb_resource.Table(DynamoDBLockTable), EventDedupeWindow, EventDedupeRecordTTL, EventDedupeCacheSize)
+    return event_dedupe
+
+
+def duplicate_event(event, VpnConnectionId):
+
+    # marks the tunnel event in progress till the deadline of the invocation, and tells whether it was done already
+    # or is in progress in another invocation - events with neither an ID nor a time are never duplicates
+    global invocation_event
+    if get_event_dedupe() is None:
+        return False
+    invocation_event = (event.get('id'), VpnConnectionId, event['detail'].get('outsideIpAddress'), event['detail']['changeType'], event.get('time'))
+    in_progress_ttl = invocation_context.get_remaining_time_in_millis() / 1000.0 if invocation_context is not None else EventDedupeInProgressTTL
+    try:
+        seen = get_event_dedupe().check(*invocation_event, now=time.time(), in_progress_ttl=in_progress_ttl)
+    except ClientError as e:
+        # deduplication only saves work, an event that cannot be checked is handled
+        logger.warning('Could not check the event ' + str(event.get('id')) + ' for a duplicate: ' + str(e))
+        invocation_event = None
+        return False
+    if seen is None:
+        metrics.increment('EventDedupeMisses')
+        return False
+    invocation_event = None
+    logger.info('The event ' + str(event.get('id')) + ' is a duplicate (found in ' + seen + '), dropping it')
+    metrics.increment('EventDedupeHits')
+    return True
+
+
+def event_done():
+
+    global invocation_event
+    if invocation_event is None or get_event_dedupe() is None:
+        return
+    try:
+        get_event_dedupe().done(*invocation_event, now=time.time())
+    except ClientError as e:
+        # the in progress marker expires with the invocation, the next delivery is handled again
+        logger.warning('Could not record the event ' + str(invocation_event[0]) + ' as done: ' + str(e))
+    invocation_event = None
+
+
+def forget_event():
+
+    global invocation_event
+    if invocation_event is None or get_event_dedupe() is None:
+        return
+    try:
+        get_event_dedupe().forget(*invocation_event)
+    except ClientError as e:
+        logger.warning('Could not forget the event ' + str(invocation_event[0]) + ', its next delivery is dropped: ' + str(e))
+    invocation_event = None
+
+
+def suppressed_connections(vpn_connections, connections_health):
+
+    # the IDs of the VPN connections fallback to which is suppressed - the state of each is recorded with
+    # fallback_suppressed(), from flap dampening records read in batches
+    if get_flap_dampening() is None:
+        return set()
+    try:
+        get_flap_dampening().prefetch(list(vpn_connections))
+    except ClientError as e:
+        logger.warning('Could not read the flap penalties ahead, reading them one by one: ' + str(e))
+    try:
+        return set(ResourceId for ResourceId, vpn_connection in vpn_connections.items() if fallback_suppressed(vpn_connection, connections_health[ResourceId]))
+    finally:
+        # a record read ahead is never used by a later invocation
+        get_flap_dampening().discard_prefetched()
+
+
+def fallback_suppressed(vpn_connection, health):
+
+    # records the state of the VPN connection for flap dampening, and tells whether fallback to it is suppressed.
+    # Only going DOWN and back counts as a flap, a DEGRADED connection is still up.
+    if get_flap_dampening() is None:
+        return False
+    try:
+        suppressed = get_flap_dampening().observe(vpn_connection, 'DOWN' if health.state == 'DOWN' else 'UP', time.time())
+    except ClientError as e:
+        # dampening is a nicety, it must never get in the way of a route update
+        logger.warning('Could not update the flap penalty of ' + vpn_connection['VpnConnectionId'] + ': ' + str(e))
+        return False
+    if suppressed:
+        metrics.increment('ConnectionsSuppressed')
+    return suppressed
+
+
+def cached_route_tables(TGWID):
+
+    TGWRouteTableIDs = get_topology_cache().get('topology|' + TGWID + '|route-tables')
+    if TGWRouteTableIDs is None:
+        TGWRouteTableIDs = [route_table['TransitGatewayRouteTableId'] for route_table in describe_route_tables(TGWID)]
+        get_topology_cache().put('topology|' + TGWID + '|route-tables', TGWRouteTableIDs)
+    return [{'TransitGatewayRouteTableId': TGWRouteTableID} for TGWRouteTableID in TGWRouteTableIDs]
+
+
+def group_route_index(group, route_tables, consistent=False, refresh=False):
+
+    # the static route index of the group and whether it came from the cache. The cached index is used only
+    # if it covers exactly the given route tables, refresh searches the route tables regardless.
+    TGWRouteTableIDs = [route_table['TransitGatewayRouteTableId'] for route_table in route_tables]
+    if not refresh:
+        cached_route_index = get_route_index_cache().get('topology|' + str(group) + '|routes', consistent)
+        if cached_route_index is not None and sorted(cached_route_index['RouteTables']) == sorted(TGWRouteTableIDs):
+            return dict((TGWAttachmentID, [tuple(route) for route in routes]) for TGWAttachmentID, routes in cached_route_index['Routes'].items()), True
+        route_index = indexed_routes(group, TGWRouteTableIDs)
+        if route_index is not None:
+            get_route_index_cache().put('topology|' + str(group) + '|routes', route_index_document(route_tables, route_index))
+            return route_index, True
+    route_index = build_route_index(route_tables, group.TGWAttachmentIDs)
+    store_route_index(group, route_tables, route_index)
+    return route_index, False
+
+
+def indexed_routes(group, TGWRouteTableIDs):
+
+    # the route index of the group from the route index table, None if there is no table or no usable index in it
+    if get_route_index_table() is None:
+        return None
+    try:
+        route_index = get_route_index_table().route_index(group, TGWRouteTableIDs, time.time())
+    except ClientError as e:
+        logger.warning('Could not read the route index of the group ' + str(group) + ': ' + str(e))
+        return None
+    metrics.increment('RouteIndexHits' if route_index is not None else 'RouteIndexMisses')
+    return route_index
+
+
+def route_index_document(route_tables, route_index):
+
+    return {
+        'RouteTables': [route_table['TransitGatewayRouteTableId'] for route_table in route_tables],
+        'Routes': dict((TGWAttachmentID, [list(route) for route in routes]) for TGWAttachmentID, routes in route_index.items()),
+    }
+
+
+def store_route_index(group, route_tables, route_index, route_changes=None):
+
+    # route_changes - the changes made to the stored index, which is written through to the route index table.
+    # Without them route_index is a fresh search of the route tables, and the table is checked against it.
+    get_route_index_cache().put('topology|' + str(group) + '|routes', route_index_document(route_tables, route_index))
+    if get_route_index_table() is None:
+        return
+    try:
+        if route_changes is not None:
+            run_in_parallel(get_route_index_table().move, [(route_changes[i:i + RouteIndexWriteChunk],) for i in range(0, len(route_changes), RouteIndexWriteChunk)])
+            return
+        drift = get_route_index_table().reconcile(group, [route_table['TransitGatewayRouteTableId'] for route_table in route_tables], route_index, time.time())
+        if drift:
+            logger.warning('Fixed ' + str(drift) + ' routes of the group ' + str(group) + ' in the route index table')
+            metrics.increment('RouteIndexDrift', drift)
+    except ClientError as e:
+        logger.warning('Could not update the route index of the group ' + str(group) + ', searching the route tables next time: ' + str(e))
+        invalidate_route_index(group)
+
+
+def moved_routes(route_index, route_changes):
+
+    # the route index after the given changes, for the write-through to the cache
+    moved = set((TGWRouteTableID, DestinationCidrBlock) for TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_Current, TGWAttachmentID_Desired in route_changes)
+    new_route_index = dict((TGWAttachmentID, [route for route in routes if route not in moved]) for TGWAttachmentID, routes in route_index.items())
+    for TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_Current, TGWAttachmentID_Desired in route_changes:
+        new_route_index.setdefault(TGWAttachmentID_Desired, []).append((TGWRouteTableID, DestinationCidrBlock))
+    return new_route_index
+
+
+def invalidate_topology(group):
+
+    invalidate_route_index(group)
+    get_topology_cache().invalidate('topology|' + group.TGWID + '|route-tables')
+
+
+def invalidate_route_index(group):
+
+    get_route_index_cache().invalidate('topology|' + str(group) + '|routes')
+    if get_route_index_table() is None:
+        return
+    try:
+        get_route_index_table().invalidate(group)
+    except ClientError as e:
+        logger.warning('Could not invalidate the route index of the group ' + str(group) + ': ' + str(e))
+
+
+def route_index_fingerprint(route_tables, route_index):
+
+    # tells apart two versions of the route index of a group, whatever order their routes are in
+    document = {
+        'RouteTables': sorted(route_table['TransitGatewayRouteTableId'] for route_table in route_tables),
+        'Routes': dict((TGWAttachmentID, sorted(list(route) for route in routes)) for TGWAttachmentID, routes in route_index.items()),
+    }
+    return hashlib.sha256(json.dumps(document, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def prepare_failover_plan(group, TGWAttachmentID):
+
+    # the failover off an attachment that lost a tunnel, worked out while its other tunnels still carry the traffic:
+    # the route changes are kept with the topology cache, along with the fingerprint of the route index they were
+    # planned from. The plan comes from the cached route tables and route index, the route tables are only searched
+    # when those are stale - and a tunnel flapping keeps the plan it has as long as the route index is the same.
+    phase_start_time = time.monotonic()
+    if group.TGWRouteTableIDs:
+        route_tables = [{'TransitGatewayRouteTableId': TGWRouteTableID} for TGWRouteTableID in group.TGWRouteTableIDs]
+    else:
+        route_tables = cached_route_tables(group.TGWID)
+    TGWRouteTableIDs = [route_table['TransitGatewayRouteTableId'] for route_table in route_tables]
+    route_index, cached = group_route_index(group, route_tables)
+    fingerprint = route_index_fingerprint(route_tables, route_index)
+    failover_plan = get_topology_cache().get('topology|' + str(group) + '|failover-plan|' + TGWAttachmentID)
+    if failover_plan is not None and failover_plan['RouteIndex'] == fingerprint and failover_plan['RouteTables'] == TGWRouteTableIDs:
+        metrics.increment('FailoverPlansReused')
+        logger.info ('The failover of ' + str(len(failover_plan['Changes'])) + ' routes off ' + TGWAttachmentID + ' is planned already')
+    else:
+        route_changes = plan_route_changes(group, route_index, {TGWAttachmentID: 'DOWN'})
+        # a plan too large for a DynamoDB item is kept in the memory of this container only
+        get_topology_cache().put('topology|' + str(group) + '|failover-plan|' + TGWAttachmentID, {
+            'RouteTables': TGWRouteTableIDs,
+            'Changes': [list(route_change) for route_change in route_changes],
+            'RouteIndex': fingerprint,
+        })
+        metrics.increment('FailoverPlansPrepared')
+        logger.info ('Planned the failover of ' + str(len(route_changes)) + ' routes off ' + TGWAttachmentID + ' in ' + str(elapsed_ms(phase_start_time)) + 'ms')
+    # the lock client is set up ahead as well
+    get_lock_client().pause()
+
+
+def cached_failover_plan(group, attachment_states):
+
+    # the failover plan made ahead for a single attachment going DOWN, None if there is none
+    if FailoverPlanning != 'yes' or list(attachment_states.values()) != ['DOWN']:
+        return None
+    TGWAttachmentID, = attachment_states
+    failover_plan = get_topology_cache().get('topology|' + str(group) + '|failover-plan|' + TGWAttachmentID)
+    if failover_plan is None or not failover_plan['Changes']:
+        return None
+    return failover_plan
+
+
+def describe_route_tables(TGWID):
+
+    route_tables = []
+    kwargs = {
+        'Filters': [
+            {
+                'Name': 'transit-gateway-id',
+                'Values': [
+                    TGWID,
                 ]
+            },
+        ]
+    }
+    while True:
+        ec2_rate_limiter.acquire()
+        describe_transit_gateway_route_tables_response = ec2.describe_transit_gateway_route_tables(**kwargs)
+        route_tables.extend(describe_transit_gateway_route_tables_response['TransitGatewayRouteTables'])
+        if not describe_transit_gateway_route_tables_response.get('NextToken'):
+            return route_tables
+        kwargs['NextToken'] = describe_transit_gateway_route_tables_response['NextToken']
+
+
+def build_route_index(route_tables, TGWAttachmentIDs):
+
+    # maps each of the given attachments to the (route table, CIDR) of every static route pointing to it
+    route_index = dict((TGWAttachmentID, []) for TGWAttachmentID in TGWAttachmentIDs)
+    TGWRouteTableIDs = [route_table['TransitGatewayRouteTableId'] for route_table in route_tables]
+    search_results = run_in_parallel(search_route_table, [(TGWRouteTableID, TGWAttachmentIDs) for TGWRouteTableID in TGWRouteTableIDs])
+    for TGWRouteTableID, routes in zip(TGWRouteTableIDs, search_results):
+        logger.debug (routes)
+        for record in routes:
+            destination, RouteAttachmentIDs = route_destination(record)
+            for TGWAttachmentID in RouteAttachmentIDs:
+                route_index.setdefault(TGWAttachmentID, []).append((TGWRouteTableID, destination))
+    return route_index
+
+
+def search_route_table(TGWRouteTableID, TGWAttachmentIDs):
+
+    # the static routes to the given attachments, and with prefix list routing their prefix list references
+    routes = search_static_routes(TGWRouteTableID, TGWAttachmentIDs)
+    if RoutingMode == 'prefix-list':
+        routes = routes + get_prefix_list_references(TGWRouteTableID, TGWAttachmentIDs)
+    return routes
+
+
+def route_destination(record):
+
+    # (destination, attachment IDs) of a static route - its CIDR - or of a prefix list reference - its prefix list ID.
+    # The routes a reference makes turn up in the search without a CIDR, and are moved with the reference.
+    if 'DestinationCidrBlock' in record:
+        return record['DestinationCidrBlock'], [attachment['TransitGatewayAttachmentId'] for attachment in record.get('TransitGatewayAttachments', [])]
+    if record.get('TransitGatewayAttachment') and not record.get('Blackhole'):
+        return record['PrefixListId'], [record['TransitGatewayAttachment']['TransitGatewayAttachmentId']]
+    return None, []
+
+
+def get_prefix_list_references(TGWRouteTableID, TGWAttachmentIDs):
+
+    references = []
+    kwargs = {
+        'TransitGatewayRouteTableId': TGWRouteTableID,
+        'Filters': [
+            {
+                'Name': 'attachment.transit-gateway-attachment-id',
+                'Values': TGWAttachmentIDs
+            },
+        ]
+    }
+    while True:
+        ec2_rate_limiter.acquire()
+        get_transit_gateway_prefix_list_references_response = ec2.get_transit_gateway_prefix_list_references(**kwargs)
+        references.extend(get_transit_gateway_prefix_list_references_response['TransitGatewayPrefixListReferences'])
+        if not get_transit_gateway_prefix_list_references_response.get('NextToken'):
+            return references
+        kwargs['NextToken'] = get_transit_gateway_prefix_list_references_response['NextToken']
+
+
+def run_in_parallel(function, calls):
+
+    # runs function(*args) for every args tuple on a bounded worker pool and returns the results in
+    # order - the first error, if any, is raised once all the calls are finished
+    with ThreadPoolExecutor(max_workers=SweepParallelism) as executor:
+        futures = [executor.submit(function, *args) for args in calls]
+    return [future.result() for future in futures]
+
+
+def search_static_routes(TGWRouteTableID, TGWAttachmentIDs, prefix=None):
+
+    # SearchTransitGatewayRoutes has no NextToken, it only flags AdditionalRoutesAvailable when
+    # the result was truncated at MaxResults. Narrow the search down by halving the destination
+    # prefix until every part fits into a single page.
+    filters = [
+        {
+            'Name': 'attachment.transit-gateway-attachment-id',
+            'Values': TGWAttachmentIDs
+        },
+        {
+            'Name': 'type',
+            'Values': [
+                'static',
+            ]
+        },
+    ]
+    if prefix:
+        filters.append({'Name': 'route-search.subnet-of-match', 'Values': [prefix]})
+    ec2_rate_limiter.acquire()
+    search_transit_gateway_routes_response = ec2.search_transit_gateway_routes(
+            TransitGatewayRouteTableId=TGWRouteTableID,
+            Filters=filters,
+            MaxResults=SearchRoutesMaxResults
+    )
+    routes = search_transit_gateway_routes_response['Routes']
+    if not search_transit_gateway_routes_response.get('AdditionalRoutesAvailable'):
+        return routes
+
+    network = ipaddress.ip_network(prefix) if prefix else None
+    if network is not None and network.prefixlen == network.max_prefixlen:
+        return routes
+    logger.info ('Search in ' + TGWRouteTableID + ' truncated at ' + str(len(routes)) + ' routes, splitting ' + (prefix or 'the address space'))
+    if network is None:
+        subnets = [ipaddress.ip_network('0.0.0.0/0'), ipaddress.ip_network('::/0')]
+    else:
+        subnets = list(network.subnets(prefixlen_diff=1))
+        # the route for the prefix itself is not a subnet of either half
+        ec2_rate_limiter.acquire()
+        routes = routes + ec2.search_transit_gateway_routes(
+                TransitGatewayRouteTableId=TGWRouteTableID,
+                Filters=filters[:2] + [{'Name': 'route-search.exact-match', 'Values': [prefix]}]
+        )['Routes']
+    for subnet in subnets:
+        routes = routes + search_static_routes(TGWRouteTableID, TGWAttachmentIDs, str(subnet))
+    unique_routes = {}
+    for record in routes:
+        unique_routes[record.get('DestinationCidrBlock') or record.get('PrefixListId')] = record
+    return list(unique_routes.values())
+
+
+def replace_static_route(TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_NEW):
+
+    if is_prefix_list(DestinationCidrBlock):
+        logger.info ('Modifying the reference to ' + DestinationCidrBlock + ' to ' + TGWAttachmentID_NEW + ' in TGW route table ' + TGWRouteTableID)
+        ec2_rate_limiter.acquire()
+        return ec2.modify_transit_gateway_prefix_list_reference(
+            TransitGatewayRouteTableId=TGWRouteTableID,
+            PrefixListId=DestinationCidrBlock,
+            TransitGatewayAttachmentId=TGWAttachmentID_NEW,
+            Blackhole=False
         )
-        logger.debug (search_transit_gateway_routes_response)
-        for i in range (len (describe_transit_gateway_route_tables_response['TransitGatewayRouteTables'])):
-            search_transit_gateway_routes_response = ec2.search_transit_gateway_routes(
-                TransitGatewayRouteTableId=describe_transit_gateway_route_tables_response['TransitGatewayRouteTables'][i]['TransitGatewayRouteTableId'],
-                Filters=[
-                    {
-                        'Name': 'attachment.transit-gateway-attachment-id',
-                        'Values': [
-                            TGWAttachmentID_Current,
-                        ]
-                    },
-                    {
-                        'Name': 'type',
-                        'Values': [
-                            'static',
-                        ]
-                    },
-                ]
-            )
-            logger.debug (search_transit_gateway_routes_response)
-            if len(search_transit_gateway_routes_response['Routes']) == 0:
-                logger.info ('No routes to '+ TGWAttachmentID_Current + ' found in ' + describe_transit_gateway_route_tables_response['TransitGatewayRouteTables'][i]['TransitGatewayRouteTableId'])
-            for y in range (len (search_transit_gateway_routes_response['Routes'])):
-                record = search_transit_gateway_routes_response['Routes'][y]
-                logger.info ('Replacing route ' + record['DestinationCidrBlock'] + ' to ' + TGWAttachmentID_NEW +' in TGW route table ' + describe_transit_gateway_route_tables_response['TransitGatewayRouteTables'][i]['TransitGatewayRouteTableId'] )
-                replace_transit_gateway_route_response = ec2.replace_transit_gateway_route(
-                    DestinationCidrBlock=record['DestinationCidrBlock'],
-                    TransitGatewayRouteTableId=describe_transit_gateway_route_tables_response['TransitGatewayRouteTables'][i]['TransitGatewayRouteTableId'],
-                    TransitGatewayAttachmentId=TGWAttachmentID_NEW
-                )
-    except botocore.exceptions.ClientError as e:
-            lock.release()
-            lock_client.close()
-            raise e
-     #    close the lock_client
-    lock.release()
-    lock_client.close()
\ No newline at end of file
+    logger.info ('Replacing route ' + DestinationCidrBlock + ' to ' + TGWAttachmentID_NEW +' in TGW route table ' + TGWRouteTableID)
+    ec2_rate_limiter.acquire()
+    return ec2.replace_transit_gateway_route(
+        DestinationCidrBlock=DestinationCidrBlock,
+        TransitGatewayRouteTableId=TGWRouteTableID,
+        TransitGatewayAttachmentId=TGWAttachmentID_NEW
+    )
+
+
+def migrate_static_routes(group, dry_run, result):
+
+    # plans - and unless dry_run, makes - the move of the static routes of the group onto prefix list references.
+    # Under the locks of the group the prefix lists are created, each route table gets a reference to the attachment
+    # its routes point to, and the static routes are deleted once the references are available - a static route
+    # wins over the same CIDR in a prefix list, so the traffic is never left without a route.
+    if group.TGWRouteTableIDs:
+        route_tables = [{'TransitGatewayRouteTableId': TGWRouteTableID} for TGWRouteTableID in group.TGWRouteTableIDs]
+    else:
+        route_tables = cached_route_tables(group.TGWID)
+    migration = migration_plan(group, route_tables)
+    logger.info ('Migration of the group ' + str(group) + ' onto prefix lists: ' + json.dumps(migration))
+    if dry_run or not migration['prefixLists']:
+        return migration
+
+    lock_client = get_lock_client()
+    locks = lock_client.acquire_locks(lock_keys(group, route_tables))
+    try:
+        # planned again under the lock, the routes may have been moved while waiting for it
+        migration = migration_plan(group, route_tables)
+        migration.update({'referencesCreated': 0, 'routesDeleted': 0})
+        for prefix_list in migration['prefixLists']:
+            if prefix_list['prefixListId'] is None:
+                prefix_list['prefixListId'] = create_prefix_list(prefix_list['prefixListName'], prefix_list['cidrs'])
+            steps = prefix_list['routeTables']
+            run_in_parallel(create_prefix_list_reference, [(step['routeTable'], prefix_list['prefixListId'], step['attachment']) for step in steps if step['createReference']])
+            run_in_parallel(wait_for_prefix_list_reference, [(step['routeTable'], prefix_list['prefixListId']) for step in steps])
+            run_in_parallel(delete_static_route, [(step['routeTable'], DestinationCidrBlock) for step in steps for DestinationCidrBlock in step['deleteRoutes']])
+            migration['referencesCreated'] += len([step for step in steps if step['createReference']])
+            migration['routesDeleted'] += sum(len(step['deleteRoutes']) for step in steps)
+    finally:
+        # searched afresh next time, the references included
+        invalidate_topology(group)
+        release_locks(lock_client, locks)
+    result['groups'].append(str(group))
+    logger.info ('Moved ' + str(migration['routesDeleted']) + ' static routes of the group ' + str(group) + ' onto ' + str(migration['referencesCreated']) + ' prefix list references')
+    return migration
+
+
+def migration_plan(group, route_tables):
+
+    # the migration plan of the group, from a fresh search of its route tables and prefix list references
+    TGWRouteTableIDs = [route_table['TransitGatewayRouteTableId'] for route_table in route_tables]
+    route_index = build_route_index(route_tables, group.TGWAttachmentIDs)
+    if RoutingMode != 'prefix-list':
+        # not indexed with static routing, but a migration that did not finish has to be picked up
+        for TGWRouteTableID, references in zip(TGWRouteTableIDs, run_in_parallel(get_prefix_list_references, [(TGWRouteTableID, group.TGWAttachmentIDs) for TGWRouteTableID in TGWRouteTableIDs])):
+            for record in references:
+                destination, RouteAttachmentIDs = route_destination(record)
+                for TGWAttachmentID in RouteAttachmentIDs:
+                    route_index.setdefault(TGWAttachmentID, []).append((TGWRouteTableID, destination))
+    PrefixListIds = sorted(set(destination for routes in route_index.values() for TGWRouteTableID, destination in routes if is_prefix_list(destination)))
+    prefix_list_entries = dict(zip(PrefixListIds, run_in_parallel(get_prefix_list_cidrs, [(PrefixListId,) for PrefixListId in PrefixListIds])))
+    migration = plan_migration(group, route_index, prefix_list_entries)
+    migration['group'] = str(group)
+    return migration
+
+
+def get_prefix_list_cidrs(PrefixListId):
+
+    cidrs = []
+    kwargs = {'PrefixListId': PrefixListId}
+    while True:
+        ec2_rate_limiter.acquire()
+        get_managed_prefix_list_entries_response = ec2.get_managed_prefix_list_entries(**kwargs)
+        cidrs.extend(entry['Cidr'] for entry in get_managed_prefix_list_entries_response['Entries'])
+        if not get_managed_prefix_list_entries_response.get('NextToken'):
+            return cidrs
+        kwargs['NextToken'] = get_managed_prefix_list_entries_response['NextToken']
+
+
+def create_prefix_list(PrefixListName, cidrs):
+
+    # the prefix list of the given name with the given CIDRs - created, or the one left by a migration that did not finish.
+    # Sized to the CIDRs, as a reference counts the most entries of its prefix list against the routes of the route table.
+    ec2_rate_limiter.acquire()
+    prefix_lists = ec2.describe_managed_prefix_lists(Filters=[{'Name': 'prefix-list-name', 'Values': [PrefixListName]}])['PrefixLists']
+    if prefix_lists:
+        PrefixListId = prefix_lists[0]['PrefixListId']
+        entries = set(get_prefix_list_cidrs(PrefixListId))
+        if not entries <= set(cidrs):
+            raise IPsecManagementError('The prefix list ' + PrefixListName + ' (' + PrefixListId + ') holds other CIDRs than ' + ', '.join(cidrs))
+        cidrs_left = [cidr for cidr in cidrs if cidr not in entries]
+    else:
+        logger.info ('Creating the prefix list ' + PrefixListName + ' of ' + str(len(cidrs)) + ' CIDRs')
+        ec2_rate_limiter.acquire()
+        PrefixListId = ec2.create_managed_prefix_list(
+            PrefixListName=PrefixListName,
+            Entries=[{'Cidr': cidr} for cidr in cidrs[:MaxEntriesPerCall]],
+            MaxEntries=len(cidrs),
+            AddressFamily=cidr_address_family(cidrs[0])
+        )['PrefixList']['PrefixListId']
+        cidrs_left = cidrs[MaxEntriesPerCall:]
+    version = wait_for_prefix_list(PrefixListId)
+    for i in range(0, len(cidrs_left), MaxEntriesPerCall):
+        ec2_rate_limiter.acquire()
+        ec2.modify_managed_prefix_list(PrefixListId=PrefixListId, CurrentVersion=version, AddEntries=[{'Cidr': cidr} for cidr in cidrs_left[i:i + MaxEntriesPerCall]])
+        version = wait_for_prefix_list(PrefixListId)
+    return PrefixListId
+
+
+def wait_for_prefix_list(PrefixListId):
+
+    # the version of the prefix list once it is created or modified
+    wait_until = time.monotonic() + PrefixListWaitTime
+    while True:
+        ec2_rate_limiter.acquire()
+        prefix_list = ec2.describe_managed_prefix_lists(PrefixListIds=[PrefixListId])['PrefixLists'][0]
+        if prefix_list['State'].endswith('-complete'):
+            return prefix_list['Version']
+        if prefix_list['State'].endswith('-failed') or time.monotonic() > wait_until:
+            raise IPsecManagementError('The prefix list ' + PrefixListId + ' is ' + prefix_list['State'] + ' ' + prefix_list.get('StateMessage', ''))
+        time.sleep(PrefixListPollInterval)
+
+
+def create_prefix_list_reference(TGWRouteTableID, PrefixListId, TGWAttachmentID):
+
+    logger.info ('Creating the reference to ' + PrefixListId + ' to ' + TGWAttachmentID + ' in TGW route table ' + TGWRouteTableID)
+    ec2_rate_limiter.acquire()
+    return ec2.create_transit_gateway_prefix_list_reference(
+        TransitGatewayRouteTableId=TGWRouteTableID,
+        PrefixListId=PrefixListId,
+        TransitGatewayAttachmentId=TGWAttachmentID,
+        Blackhole=False
+    )
+
+
+def wait_for_prefix_list_reference(TGWRouteTableID, PrefixListId):
+
+    wait_until = time.monotonic() + PrefixListWaitTime
+    while True:
+        ec2_rate_limiter.acquire()
+        references = ec2.get_transit_gateway_prefix_list_references(
+            TransitGatewayRouteTableId=TGWRouteTableID,
+            Filters=[{'Name': 'prefix-list-id', 'Values': [PrefixListId]}]
+        )['TransitGatewayPrefixListReferences']
+        state = references[0]['State'] if references else 'missing'
+        if state == 'available':
+            return
+        if state not in ('pending', 'modifying') or time.monotonic() > wait_until:
+            raise IPsecManagementError('The reference to ' + PrefixListId + ' in TGW route table ' + TGWRouteTableID + ' is ' + state)
+        time.sleep(PrefixListPollInterval)
+
+
+def delete_static_route(TGWRouteTableID, DestinationCidrBlock):
+
+    logger.info ('Deleting route ' + DestinationCidrBlock + ' in TGW route table ' + TGWRouteTableID + ', routed by its prefix list')
+    ec2_rate_limiter.acquire()
+    return ec2.delete_transit_gateway_route(
+        TransitGatewayRouteTableId=TGWRouteTableID,
+        DestinationCidrBlock=DestinationCidrBlock
+    )
@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+
+
+# CloudWatch caps the values of a metric at 100 per EMF document
+MaxValuesPerMetric = 100
+
+
+def emf_stdout_sink(document):
+
+    # Lambda ships stdout to CloudWatch Logs as is, where EMF documents are turned into metrics
+    print(json.dumps(document, separators=(',', ':')))
+
+
+class Metrics:
+
+    # collects counters and timings - from the handler, the sweep workers and the lock client threads -
+    # and writes them as CloudWatch Embedded Metric Format (EMF) documents on flush(), with no API calls.
+    # The sink is any callable taking an EMF document (a dict), e.g. list.append in tests and benchmarks.
+    def __init__(self, namespace, dimensions=None, sink=emf_stdout_sink):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self.sink = sink
+        self.counters = {}
+        self.timings = {}
+        self.properties = {}
+        self.thread_lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self.thread_lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_timing(self, name, milliseconds):
+        with self.thread_lock:
+            self.timings.setdefault(name, []).append(round(milliseconds, 2))
+
+    def set_property(self, name, value):
+        # searchable in CloudWatch Logs Insights, but not a metric
+        with self.thread_lock:
+            self.properties[name] = value
+
+    def flush(self):
+        with self.thread_lock:
+            counters, self.counters = self.counters, {}
+            timings, self.timings = self.timings, {}
+            properties, self.properties = self.properties, {}
+        if not counters and not timings:
+            return
+        # timings with more values than a document takes are spread over several documents
+        first_document = True
+        while first_document or timings:
+            document = dict(properties)
+            document.update(self.dimensions)
+            metric_definitions = []
+            if first_document:
+                for name, value in counters.items():
+                    document[name] = value
+                    metric_definitions.append({'Name': name, 'Unit': 'Count'})
+            for name in list(timings):
+                document[name] = timings[name][:MaxValuesPerMetric]
+                metric_definitions.append({'Name': name, 'Unit': 'Milliseconds'})
+                timings[name] = timings[name][MaxValuesPerMetric:]
+                if not timings[name]:
+                    del timings[name]
+            document['_aws'] = {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [
+                    {
+                        'Namespace': self.namespace,
+                        'Dimensions': [sorted(self.dimensions)],
+                        'Metrics': metric_definitions,
+                    }
+                ],
+            }
+            self.sink(document)
+            first_document = False
+
+
+def instrument_client(client, metrics, service_name):
+
+    # counts and times every API call of a boto3 client through the botocore event hooks - registered
+    # under fixed IDs, so instrumenting the same client again is a no-op
+    def before_call(model, context, **kwargs):
+        context['metrics_start_time'] = time.monotonic()
+
+    def after_call(model, context, **kwargs):
+        metrics.increment(service_name + '.' + model.name)
+        if 'metrics_start_time' in context:
+            metrics.add_timing(service_name + '.' + model.name + '.Latency', (time.monotonic() - context['metrics_start_time']) * 1000.0)
+
+    service_id = client.meta.service_model.service_id.hyphenize()
+    client.meta.events.register('before-call.' + service_id, before_call, unique_id='metrics-before-call-' + service_name)
+    client.meta.events.register('after-call.' + service_id, after_call, unique_id='metrics-after-call-' + service_name)
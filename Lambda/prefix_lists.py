@@ -0,0 +1,81 @@
+import collections
+import ipaddress
+import logging
+
+logger = logging.getLogger()
+
+# Prefix list routing - the CIDRs of an attachment group are kept in EC2 managed prefix lists, and each TGW route
+# table routes them with one prefix list reference to the attachment they go to. Failing over and back modifies the
+# references - one call per route table, whatever the number of CIDRs. In the route index of a group, a reference
+# stands in for its routes under the prefix list ID, where a static route has its CIDR.
+
+# entries a CreateManagedPrefixList / ModifyManagedPrefixList call takes
+MaxEntriesPerCall = 100
+
+
+def is_prefix_list(destination):
+
+    return destination.startswith('pl-')
+
+
+def prefix_list_name(group, address_family, index):
+
+    return 'ipsec-management/' + str(group) + '/' + address_family + '/' + str(index)
+
+
+def plan_migration(group, route_index, prefix_list_entries):
+
+    # the steps that move the static routes of the group onto prefix list references, and the route tables
+    # that cannot be moved yet. route_index is the route index of the group, with its prefix list references,
+    # prefix_list_entries maps the prefix lists it references to their CIDRs. Route tables routing the same
+    # CIDRs share a prefix list, one per address family - an existing one if it holds exactly those CIDRs.
+    route_tables = collections.OrderedDict()
+    for TGWAttachmentID, routes in route_index.items():
+        for TGWRouteTableID, destination in routes:
+            route_table = route_tables.setdefault(TGWRouteTableID, {'routes': {}, 'references': {}})
+            route_table['references' if is_prefix_list(destination) else 'routes'][destination] = TGWAttachmentID
+    prefix_lists = collections.OrderedDict()
+    for PrefixListId, cidrs in prefix_list_entries.items():
+        prefix_lists.setdefault(frozenset(cidrs), {'prefixListId': PrefixListId, 'prefixListName': None, 'cidrs': sorted(cidrs), 'routeTables': []})
+    skipped = []
+    for TGWRouteTableID, route_table in sorted(route_tables.items()):
+        if not route_table['routes']:
+            continue
+        TGWAttachmentIDs = sorted(set(route_table['routes'].values()))
+        if len(TGWAttachmentIDs) > 1:
+            skipped.append({'routeTable': TGWRouteTableID, 'reason': 'the static routes point to ' + ', '.join(TGWAttachmentIDs) + ', reconcile the group first'})
+            continue
+        TGWAttachmentID = TGWAttachmentIDs[0]
+        for address_family, cidrs in address_families(route_table['routes']).items():
+            # the reference may be there already, made by a migration that did not finish
+            PrefixListIds = [
+                PrefixListId for PrefixListId, reference_attachment in route_table['references'].items()
+                if reference_attachment == TGWAttachmentID and cidrs <= set(prefix_list_entries.get(PrefixListId, []))
+            ]
+            if PrefixListIds:
+                prefix_list = prefix_lists[frozenset(prefix_list_entries[PrefixListIds[0]])]
+            else:
+                prefix_list = prefix_lists.setdefault(cidrs, {'prefixListId': None, 'prefixListName': None, 'cidrs': sorted(cidrs), 'routeTables': []})
+            prefix_list['routeTables'].append({'routeTable': TGWRouteTableID, 'attachment': TGWAttachmentID, 'createReference': not PrefixListIds, 'deleteRoutes': sorted(cidrs)})
+    plan = [prefix_list for prefix_list in prefix_lists.values() if prefix_list['routeTables']]
+    names = collections.Counter()
+    for prefix_list in plan:
+        if prefix_list['prefixListId'] is None:
+            address_family = cidr_address_family(prefix_list['cidrs'][0])
+            prefix_list['prefixListName'] = prefix_list_name(group, address_family, names[address_family])
+            names[address_family] += 1
+    return {'prefixLists': plan, 'skipped': skipped}
+
+
+def address_families(routes):
+
+    # 'IPv4' / 'IPv6' -> the CIDRs of that family, a prefix list only holds one
+    families = {}
+    for cidr in routes:
+        families.setdefault(cidr_address_family(cidr), set()).add(cidr)
+    return dict((address_family, frozenset(cidrs)) for address_family, cidrs in families.items())
+
+
+def cidr_address_family(cidr):
+
+    return 'IPv%d' % ipaddress.ip_network(cidr).version
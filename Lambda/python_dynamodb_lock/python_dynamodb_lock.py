@@ -6,11 +6,14 @@ This is a general purpose distributed locking library built on top of DynamoDB.
 and fine-grained locking.
 """
 
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 from botocore.exceptions import ClientError
 from concurrent.futures import ThreadPoolExecutor
+import contextlib
 import datetime
 from decimal import Decimal
 import logging
+import random
 import socket
 import time
 import threading
@@ -36,6 +39,9 @@ class DynamoDBLockClient:
     _DEFAULT_LEASE_DURATION = datetime.timedelta(seconds=30)
     _DEFAULT_EXPIRY_PERIOD = datetime.timedelta(hours=1)
     _DEFAULT_HEARTBEAT_TPS = -1
+    _DEFAULT_HEARTBEAT_BATCH_SIZE = 1
+    # DynamoDB limit on the number of items in a single transaction
+    _MAX_HEARTBEAT_BATCH_SIZE = 100
     _DEFAULT_APP_CALLBACK_THREADPOOL_SIZE = 5
     # for optional create-table method
     _DEFAULT_READ_CAPACITY = 5
@@ -62,7 +68,10 @@ class DynamoDBLockClient:
                  lease_duration=_DEFAULT_LEASE_DURATION,
                  expiry_period=_DEFAULT_EXPIRY_PERIOD,
                  heartbeat_tps=_DEFAULT_HEARTBEAT_TPS,
-                 app_callback_executor=None
+                 app_callback_executor=None,
+                 retry_strategy=None,
+                 heartbeat_batch_size=_DEFAULT_HEARTBEAT_BATCH_SIZE,
+                 metrics=None
                  ):
         """
         :param boto3.ServiceResource dynamodb_resource: mandatory argument
@@ -91,6 +100,16 @@ class DynamoDBLockClient:
         :param ThreadPoolExecutor app_callback_executor: The executor to be used for invoking the
                 app_callbacks in case of un-expected errors. Defaults to a ThreadPoolExecutor with a
                 maximum of 5 threads.
+        :param BackoffRetryStrategy retry_strategy: How acquire_lock() spaces out its retries while the
+                lock is held by someone else. Defaults to None - i.e. a fixed retry_period.
+        :param int heartbeat_batch_size: The maximum number of leases renewed by a single DynamoDB request.
+                If set to more than 1, the heartbeats are sent as transactional writes (TransactWriteItems)
+                of up to this many locks - which keeps the heartbeat window flat for clients holding many
+                locks, at the cost of transactional write capacity. The heartbeat_tps is then counted in
+                batches. Defaults to 1 - i.e. one UpdateItem per lock. Capped at 100.
+        :param metrics: Where the client records its metrics - any object with increment(name, value)
+                and add_timing(name, milliseconds) methods. It is called from the background threads as
+                well, and must be thread-safe. Defaults to None - i.e. no metrics.
         """
         self._uuid = uuid.uuid4().hex
         self._dynamodb_resource = dynamodb_resource
@@ -104,6 +123,9 @@ class DynamoDBLockClient:
         self._lease_duration = lease_duration
         self._expiry_period = expiry_period
         self._heartbeat_tps = heartbeat_tps
+        self._retry_strategy = retry_strategy
+        self._heartbeat_batch_size = max(1, min(heartbeat_batch_size, self._MAX_HEARTBEAT_BATCH_SIZE))
+        self._metrics = metrics
         self._app_callback_executor = app_callback_executor or ThreadPoolExecutor(
             max_workers=self._DEFAULT_APP_CALLBACK_THREADPOOL_SIZE,
             thread_name_prefix='DynamoDBLockClient-AC-' + self._uuid + "-"
@@ -111,7 +133,13 @@ class DynamoDBLockClient:
         # additional properties
         self._locks = {}
         self._shutting_down = False
+        self._paused = False
+        # the background threads wait on this condition - so that they can be woken up as soon as
+        # the client is shut down / paused / resumed, or its set of locks changes
+        self._state_changed = threading.Condition()
+        self._locks_version = 0
         self._dynamodb_table = dynamodb_resource.Table(table_name)
+        self._return_existing_lock_on_put = self._supports_return_values_on_condition_check_failure()
         # and, initialization
         self._start_heartbeat_sender_thread()
         self._start_heartbeat_checker_thread()
@@ -136,35 +164,47 @@ class DynamoDBLockClient:
         Keeps renewing the leases for the locks owned by this client - till the client is closed.
 
         The method has a while loop that wakes up on a periodic basis (as defined by the _heartbeat_period)
-        and invokes the _send_heartbeat() method on each lock. It spreads the heartbeat-calls evenly over
-        the heartbeat window - to minimize the DynamoDB write throughput requirements.
+        and invokes the _send_heartbeat() method on each lock - or the _send_heartbeats() method on each
+        batch of locks. It spreads the heartbeat-calls evenly over the heartbeat window - to minimize the
+        DynamoDB write throughput requirements.
         """
         while not self._shutting_down:
+            self._wait_while_paused()
+            if self._shutting_down: break
             logger.info('Starting a send_heartbeat loop')
             start_time = time.monotonic()
-            locks = self._locks.copy()
+            locks_version = self._locks_version
+            locks = list(self._locks.values())
+            batches = [
+                locks[i:i + self._heartbeat_batch_size] for i in range(0, len(locks), self._heartbeat_batch_size)
+            ]
 
             avg_loop_time = 1.0 / self._heartbeat_tps
             if self._heartbeat_tps == -1:
                 # use an "adaptive" algorithm if the TPS is set to -1
-                avg_loop_time = self._heartbeat_period.total_seconds() / len(locks) if locks else -1.0
+                avg_loop_time = self._heartbeat_period.total_seconds() / len(batches) if batches else -1.0
 
             count = 0
-            for uid, lock in locks.items():
+            for batch in batches:
+                if self._shutting_down: break
                 count += 1
-                self._send_heartbeat(lock)
-                # After each lock, sleep a little (if needed) to honor the _heartbeat_tps
+                if self._heartbeat_batch_size == 1:
+                    self._send_heartbeat(batch[0])
+                else:
+                    self._send_heartbeats(batch)
+                # After each lock (or batch), sleep a little (if needed) to honor the _heartbeat_tps
                 curr_loop_end_time = time.monotonic()
                 next_loop_start_time = start_time + count * avg_loop_time
                 if curr_loop_end_time < next_loop_start_time:
-                    time.sleep( next_loop_start_time - curr_loop_end_time )
+                    self._wait_until(next_loop_start_time)
 
-            # After all the locks have been "heartbeat"-ed, sleep before the next run (if needed)
+            # After all the locks have been "heartbeat"-ed, sleep before the next run (if needed) - a
+            # change in the set of locks cuts the sleep short, so that the heartbeats get re-scheduled
             logger.info('Finished the send_heartbeat loop')
             end_time = time.monotonic()
             next_start_time = start_time + self._heartbeat_period.total_seconds()
             if end_time < next_start_time and not self._shutting_down:
-                time.sleep( next_start_time - end_time )
+                self._wait_until(next_start_time, locks_version)
             elif end_time > next_start_time + avg_loop_time:
                 logger.warning('Sending heartbeats for all the locks took longer than the _heartbeat_period')
 
@@ -201,11 +241,17 @@ class DynamoDBLockClient:
                     logger.info('Skipping the heartbeat as the lock is not locked any more: %s', lock.status)
                     return
 
+                # skip if the lease was renewed recently - e.g. a lock acquired just before an early wake-up
+                if time.monotonic() - lock.last_updated_time < self._heartbeat_period.total_seconds() / 2:
+                    logger.debug('Skipping the heartbeat as the lease was renewed recently: %s', lock.unique_identifier)
+                    return
+
                 old_record_version_number = lock.record_version_number
                 new_record_version_number = str(uuid.uuid4())
                 new_expiry_time = int(time.time() + self._expiry_period.total_seconds())
 
                 # first, try to update the database
+                heartbeat_start_time = time.monotonic()
                 self._dynamodb_table.update_item(
                     Key={
                         self._partition_key_name: lock.partition_key,
@@ -231,23 +277,124 @@ class DynamoDBLockClient:
                 lock.expiry_time = new_expiry_time
                 lock.last_updated_time = time.monotonic()
                 lock.status = DynamoDBLock.LOCKED
+                self._add_timing_metric('HeartbeatLatency', heartbeat_start_time)
+                self._increment_metric('HeartbeatsSent')
                 logger.debug('Successfully sent the heartbeat: %s', lock.unique_identifier)
             except ClientError as e:
                 if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
                     # someone else stole our lock!
                     logger.warning('LockStolenError while sending heartbeat: %s', lock.unique_identifier)
+                    self._increment_metric('LocksStolen')
                     # let's mark the in-memory lock representation as invalid
                     lock.status = DynamoDBLock.INVALID
                     # let's drop it from our in-memory collection as well
                     del self._locks[lock.unique_identifier]
+                    self._notify_state_changed(locks_changed=True)
                     # callback - the app should abort its processing; no need to release
                     self._call_app_callback(lock, DynamoDBLockError.LOCK_STOLEN)
                 else:
                     logger.warning('ClientError while sending heartbeat: %s', lock.unique_identifier, exc_info=True)
+                    self._increment_metric('HeartbeatErrors')
             except Exception:
                 logger.warning('Unexpected error while sending heartbeat: %s', lock.unique_identifier, exc_info=True)
 
 
+    def _send_heartbeats(self, locks):
+        """
+        Renews the leases for a batch of locks - with a single DynamoDB transaction.
+
+        Works like _send_heartbeat(), for many locks at once. As DynamoDB transactions are all-or-nothing,
+        a lock that fails its condition check (i.e. was stolen) cancels the whole transaction - such locks
+        are identified from the cancellation reasons and dealt with like in _send_heartbeat() (LOCK_STOLEN),
+        and the transaction is retried for the remaining ones.
+
+        :param list locks: the lock instances that need their leases to be renewed
+        """
+        logger.info('Sending a DynamoDBLock heartbeat for %d locks', len(locks))
+        with contextlib.ExitStack() as thread_locks:
+            # always take the thread-locks in the same order
+            for lock in sorted(locks, key=lambda lock: lock.unique_identifier):
+                thread_locks.enter_context(lock.thread_lock)
+
+            pending_locks = []
+            for lock in locks:
+                # the ddb-lock might have been released while waiting for the thread-lock
+                if lock.unique_identifier not in self._locks: continue
+                # skip if the lock is not in the LOCKED state
+                if lock.status != DynamoDBLock.LOCKED: continue
+                # skip if the lease was renewed recently - e.g. a lock acquired just before an early wake-up
+                if time.monotonic() - lock.last_updated_time < self._heartbeat_period.total_seconds() / 2: continue
+                pending_locks.append(lock)
+
+            serializer = TypeSerializer()
+            while pending_locks:
+                new_record_version_numbers = [str(uuid.uuid4()) for lock in pending_locks]
+                new_expiry_time = int(time.time() + self._expiry_period.total_seconds())
+                heartbeat_start_time = time.monotonic()
+                try:
+                    self._dynamodb_resource.meta.client.transact_write_items(
+                        TransactItems=[
+                            {
+                                'Update': {
+                                    'TableName': self._table_name,
+                                    'Key': {
+                                        self._partition_key_name: serializer.serialize(lock.partition_key),
+                                        self._sort_key_name: serializer.serialize(lock.sort_key),
+                                    },
+                                    'UpdateExpression': 'SET #rvn = :new_rvn, #et = :new_et',
+                                    'ConditionExpression': 'attribute_exists(#pk) AND attribute_exists(#sk) AND #rvn = :old_rvn',
+                                    'ExpressionAttributeNames': {
+                                        '#pk': self._partition_key_name,
+                                        '#sk': self._sort_key_name,
+                                        '#rvn': self._COL_RECORD_VERSION_NUMBER,
+                                        '#et': self._ttl_attribute_name,
+                                    },
+                                    'ExpressionAttributeValues': {
+                                        ':old_rvn': serializer.serialize(lock.record_version_number),
+                                        ':new_rvn': serializer.serialize(new_record_version_number),
+                                        ':new_et': serializer.serialize(new_expiry_time),
+                                    },
+                                }
+                            }
+                            for lock, new_record_version_number in zip(pending_locks, new_record_version_numbers)
+                        ]
+                    )
+                except ClientError as e:
+                    reasons = e.response.get('CancellationReasons', [])
+                    stolen_locks = [
+                        lock for lock, reason in zip(pending_locks, reasons)
+                        if reason.get('Code') == 'ConditionalCheckFailed'
+                    ]
+                    if e.response['Error']['Code'] != 'TransactionCanceledException' or not stolen_locks:
+                        logger.warning('ClientError while sending heartbeats for %d locks', len(pending_locks), exc_info=True)
+                        self._increment_metric('HeartbeatErrors')
+                        return
+                    for lock in stolen_locks:
+                        # someone else stole our lock!
+                        logger.warning('LockStolenError while sending heartbeat: %s', lock.unique_identifier)
+                        self._increment_metric('LocksStolen')
+                        lock.status = DynamoDBLock.INVALID
+                        del self._locks[lock.unique_identifier]
+                        self._notify_state_changed(locks_changed=True)
+                        self._call_app_callback(lock, DynamoDBLockError.LOCK_STOLEN)
+                    pending_locks = [lock for lock in pending_locks if lock not in stolen_locks]
+                    continue
+                except Exception:
+                    logger.warning('Unexpected error while sending heartbeats for %d locks', len(pending_locks), exc_info=True)
+                    return
+
+                # if successful, update the in-memory lock representations
+                for lock, new_record_version_number in zip(pending_locks, new_record_version_numbers):
+                    lock.record_version_number = new_record_version_number
+                    lock.expiry_time = new_expiry_time
+                    lock.last_updated_time = time.monotonic()
+                    lock.status = DynamoDBLock.LOCKED
+                self._add_timing_metric('HeartbeatLatency', heartbeat_start_time)
+                self._increment_metric('HeartbeatsSent', len(pending_locks))
+                logger.debug('Successfully sent the heartbeat for %d locks', len(pending_locks))
+                return
+
+
     def _start_heartbeat_checker_thread(self):
         """
         Creates and starts a daemon thread - that checks that the locks are heartbeat-ing as expected
@@ -269,6 +416,8 @@ class DynamoDBLockClient:
         and invokes the _check_heartbeat() method on each lock.
         """
         while not self._shutting_down:
+            self._wait_while_paused()
+            if self._shutting_down: break
             logger.info('Starting a check_heartbeat loop')
             start_time = time.monotonic()
             locks = self._locks.copy()
@@ -281,8 +430,8 @@ class DynamoDBLockClient:
             end_time = time.monotonic()
             next_start_time = start_time + self._heartbeat_period.total_seconds()
             if end_time < next_start_time and not self._shutting_down:
-                time.sleep( next_start_time - end_time )
-            else:
+                self._wait_until(next_start_time)
+            elif not self._shutting_down:
                 logger.warning('Checking heartbeats for all the locks took longer than the _heartbeat_period')
 
 
@@ -331,6 +480,42 @@ class DynamoDBLockClient:
                 logger.warning('Unexpected error while checking heartbeat: %s', lock.unique_identifier, exc_info=True)
 
 
+    def _wait_until(self, deadline, locks_version=None):
+        """
+        Interruptible replacement for time.sleep() - blocks till the given deadline, or till the client
+        is shut down (or paused), whichever comes first.
+
+        :param float deadline: time.monotonic() value to wait for
+        :param int locks_version: if provided, also stop waiting as soon as the set of locks changes
+        """
+        with self._state_changed:
+            while not self._shutting_down and not self._paused:
+                if locks_version is not None and locks_version != self._locks_version: return
+                remaining_time = deadline - time.monotonic()
+                if remaining_time <= 0: return
+                self._state_changed.wait(remaining_time)
+
+
+    def _wait_while_paused(self):
+        """
+        Blocks the calling background thread while the client is paused.
+        """
+        with self._state_changed:
+            while self._paused and not self._shutting_down:
+                self._state_changed.wait()
+
+
+    def _notify_state_changed(self, locks_changed=False):
+        """
+        Wakes up all the threads waiting on the client - after a shutdown, pause/resume or lock change.
+
+        :param bool locks_changed: True if a lock was added to / removed from the in-memory collection
+        """
+        with self._state_changed:
+            if locks_changed: self._locks_version += 1
+            self._state_changed.notify_all()
+
+
     def _call_app_callback(self, lock, code):
         """
         Utility function to route the app_callback through the thread-pool-executor
@@ -341,6 +526,22 @@ class DynamoDBLockClient:
         self._app_callback_executor.submit(lock.app_callback, code, lock)
 
 
+    def _increment_metric(self, name, value=1):
+        """
+        Adds the value to the named counter of the metrics sink - if any.
+        """
+        if self._metrics is not None:
+            self._metrics.increment(name, value)
+
+
+    def _add_timing_metric(self, name, start_time):
+        """
+        Records the time since start_time (a time.monotonic() value) with the metrics sink - if any.
+        """
+        if self._metrics is not None:
+            self._metrics.add_timing(name, (time.monotonic() - start_time) * 1000.0)
+
+
     def acquire_lock(self,
                      partition_key,
                      sort_key=_DEFAULT_SORT_KEY_VALUE,
@@ -348,6 +549,7 @@ class DynamoDBLockClient:
                      retry_timeout=None,
                      additional_attributes=None,
                      app_callback=None,
+                     retry_strategy=None,
                      ):
         """
         Acquires a distributed DynaomDBLock for the given key(s).
@@ -377,7 +579,8 @@ class DynamoDBLockClient:
         :param str partition_key: The primary lock identifier
         :param str sort_key: Forms a "composite identifier" along with the partition_key. Defaults to '-'
         :param datetime.timedelta retry_period: If the lock is not immediately available, how long
-                should we wait between retries? Defaults to heartbeat_period.
+                should we wait between retries? Defaults to heartbeat_period. Ignored if a retry_strategy
+                is in use.
         :param datetime.timedelta retry_timeout: If the lock is not available for an extended period,
                 how long should we keep trying before giving up and timing out? This value should be set
                 higher than the lease_duration to ensure that other clients can pick up locks abandoned
@@ -385,14 +588,19 @@ class DynamoDBLockClient:
         :param dict additional_attributes: Arbitrary application metadata to be stored with the lock
         :param Callable app_callback: Callback function that can be used to notify the app of lock entering
                 the danger period, or an unexpected release
+        :param BackoffRetryStrategy retry_strategy: Overrides the client's retry_strategy for this call
         :rtype: DynamoDBLock
         :return: A distributed lock instance
         """
         logger.info('Trying to acquire lock for: %s, %s', partition_key, sort_key)
 
+        # the new lock will need heartbeats
+        self.resume()
+
         # plug in default values as needed
         if not retry_period: retry_period = self._heartbeat_period
         if not retry_timeout: retry_timeout = self._lease_duration + self._heartbeat_period
+        if not retry_strategy: retry_strategy = self._retry_strategy
 
         # create the "new" lock that needs to be acquired
         new_lock = DynamoDBLock(
@@ -421,16 +629,19 @@ class DynamoDBLockClient:
                 new_lock.last_updated_time = time.monotonic()
                 new_lock.expiry_time = int(time.time() + self._expiry_period.total_seconds())
 
-                logger.debug('Checking the database for existing owner: %s', new_lock.unique_identifier)
-                existing_lock = self._get_lock_from_dynamodb(partition_key, sort_key)
+                # optimistically try to add the lock - if someone else holds it, the failed condition
+                # check hands back the existing lock in the same round trip
+                logger.debug('Attempting to add a new lock: %s', new_lock.unique_identifier)
+                existing_lock = self._add_new_lock_or_get_existing(new_lock)
 
                 if existing_lock is None:
-                    logger.debug('No existing lock - attempting to add one: %s', new_lock.unique_identifier)
-                    self._add_new_lock_to_dynamodb(new_lock)
                     logger.debug('Added to the DDB. Adding to in-memory map: %s', new_lock.unique_identifier)
                     new_lock.status = DynamoDBLock.LOCKED
                     self._locks[new_lock.unique_identifier] = new_lock
+                    self._notify_state_changed(locks_changed=True)
                     logger.info('Successfully added a new lock: %s', str(new_lock))
+                    self._add_timing_metric('LockAcquireTime', start_time)
+                    self._increment_metric('LockAcquireRetries', retry_count)
                     return new_lock
                 else:
                     if existing_lock.record_version_number != last_record_version_number:
@@ -455,7 +666,11 @@ class DynamoDBLockClient:
                             logger.debug('Added to the DDB. Adding to in-memory map: %s', new_lock.unique_identifier)
                             new_lock.status = DynamoDBLock.LOCKED
                             self._locks[new_lock.unique_identifier] = new_lock
+                            self._notify_state_changed(locks_changed=True)
                             logger.info('Successfully updated with the new lock: %s', str(new_lock))
+                            self._add_timing_metric('LockAcquireTime', start_time)
+                            self._increment_metric('LockAcquireRetries', retry_count)
+                            self._increment_metric('LocksTakenOver')
                             return new_lock
             except ClientError as e:
                 if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
@@ -471,15 +686,94 @@ class DynamoDBLockClient:
             # sleep and retry
             retry_count += 1
             curr_loop_end_time = time.monotonic()
-            next_loop_start_time = start_time + retry_count * retry_period.total_seconds()
+            if retry_strategy:
+                # back off from the previous attempt - with one last attempt right at the timeout
+                if curr_loop_end_time >= retry_timeout_time:
+                    next_loop_start_time = retry_timeout_time + 1.0
+                else:
+                    next_loop_start_time = min(
+                        curr_loop_end_time + retry_strategy.get_delay(retry_count, self._lease_duration),
+                        retry_timeout_time
+                    )
+            else:
+                next_loop_start_time = start_time + retry_count * retry_period.total_seconds()
             if next_loop_start_time > retry_timeout_time:
+                self._increment_metric('LockAcquireTimeouts')
                 raise DynamoDBLockError(
                     DynamoDBLockError.ACQUIRE_TIMEOUT,
                     'acquire_lock() timed out: ' + new_lock.unique_identifier
                 )
             elif next_loop_start_time > curr_loop_end_time:
                 logger.info('Sleeping before a retry: %s', new_lock.unique_identifier)
-                time.sleep(next_loop_start_time - curr_loop_end_time)
+                self._wait_for_retry(next_loop_start_time)
+
+
+    def _wait_for_retry(self, deadline):
+        """
+        Sleeps till the next acquire_lock() attempt - cut short only by the client shutting down.
+
+        :param float deadline: time.monotonic() value to wait for
+        """
+        with self._state_changed:
+            while not self._shutting_down:
+                remaining_time = deadline - time.monotonic()
+                if remaining_time <= 0: return
+                self._state_changed.wait(remaining_time)
+
+
+    def acquire_locks(self,
+                      partition_keys,
+                      sort_key=_DEFAULT_SORT_KEY_VALUE,
+                      retry_period=None,
+                      retry_timeout=None,
+                      additional_attributes=None,
+                      app_callback=None,
+                      retry_strategy=None,
+                      ):
+        """
+        Acquires the distributed DynamoDBLocks for several keys - as a single, all-or-nothing operation.
+
+        The locks are always acquired in the same (sorted) order, irrespective of the order of the given
+        keys - so that two clients asking for overlapping sets of keys can not deadlock each other. If
+        any one of the locks can not be acquired, the ones already acquired are released (best-effort)
+        before the DynamoDBLockError is raised to the caller.
+
+        :param list partition_keys: The primary lock identifiers - duplicates are ignored
+        :param str sort_key: Forms a "composite identifier" along with each partition_key. Defaults to '-'
+        :param datetime.timedelta retry_period: See acquire_lock(). Defaults to heartbeat_period.
+        :param datetime.timedelta retry_timeout: The overall time to keep trying for all the locks.
+                Defaults to lease_duration + heartbeat_period.
+        :param dict additional_attributes: Arbitrary application metadata to be stored with each lock
+        :param Callable app_callback: See acquire_lock()
+        :param BackoffRetryStrategy retry_strategy: See acquire_lock()
+        :rtype: list
+        :return: The distributed lock instances, in the order they were acquired
+        """
+        logger.info('Trying to acquire locks for: %s, %s', partition_keys, sort_key)
+
+        if not retry_timeout: retry_timeout = self._lease_duration + self._heartbeat_period
+        retry_timeout_time = time.monotonic() + retry_timeout.total_seconds()
+
+        locks = []
+        try:
+            for partition_key in sorted(set(partition_keys)):
+                remaining_time = max(retry_timeout_time - time.monotonic(), 0.0)
+                locks.append(self.acquire_lock(
+                    partition_key,
+                    sort_key=sort_key,
+                    retry_period=retry_period,
+                    # acquire_lock() treats a zero timeout as "use the default"
+                    retry_timeout=datetime.timedelta(seconds=remaining_time or 0.001),
+                    additional_attributes=additional_attributes,
+                    app_callback=app_callback,
+                    retry_strategy=retry_strategy,
+                ))
+        except DynamoDBLockError:
+            logger.warning('Could not acquire all the locks, releasing the %d acquired so far', len(locks))
+            for lock in reversed(locks):
+                self.release_lock(lock, best_effort=True)
+            raise
+        return locks
 
 
     def release_lock(self, lock, best_effort=True):
@@ -518,6 +812,7 @@ class DynamoDBLockClient:
                 # even if the database call fails, it will auto-release after the lease expires
                 lock.status = DynamoDBLock.RELEASED
                 del self._locks[lock.unique_identifier]
+                self._notify_state_changed(locks_changed=True)
 
                 # then, remove it from the database
                 self._dynamodb_table.delete_item(
@@ -581,6 +876,9 @@ class DynamoDBLockClient:
         :param DynamoDBLock lock: The lock instance that needs to be added to the database.
         """
         logger.debug('Adding a new lock: %s', str(lock))
+        kwargs = {}
+        if self._return_existing_lock_on_put:
+            kwargs['ReturnValuesOnConditionCheckFailure'] = 'ALL_OLD'
         self._dynamodb_table.put_item(
             Item=self._get_item_from_lock(lock),
             ConditionExpression='NOT(attribute_exists(#pk) AND attribute_exists(#sk))',
@@ -588,9 +886,54 @@ class DynamoDBLockClient:
                 '#pk': self._partition_key_name,
                 '#sk': self._sort_key_name,
             },
+            **kwargs
         )
 
 
+    def _add_new_lock_or_get_existing(self, lock):
+        """
+        Adds a new lock into the database - or, if one exists already, returns that existing lock.
+
+        The existing lock comes back with the ConditionalCheckFailedException itself (thanks to the
+        ReturnValuesOnConditionCheckFailure option), so an uncontended acquire takes a single round trip,
+        and a contended one does not need a separate read either. Older SDKs without the option fall back
+        to a strongly consistent read.
+
+        :param DynamoDBLock lock: The lock instance that needs to be added to the database.
+        :rtype: BaseDynamoDBLock
+        :return: None if the lock was added, the existing lock otherwise
+        """
+        try:
+            self._add_new_lock_to_dynamodb(lock)
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            if 'Item' in e.response:
+                deserializer = TypeDeserializer()
+                item = dict((name, deserializer.deserialize(value)) for name, value in e.response['Item'].items())
+                return self._get_lock_from_item(item)
+            existing_lock = self._get_lock_from_dynamodb(lock.partition_key, lock.sort_key)
+            if existing_lock is None:
+                # the existing lock was released in the meantime - let the caller retry
+                raise
+            return existing_lock
+
+
+    def _supports_return_values_on_condition_check_failure(self):
+        """
+        Checks if the SDK in use knows about the ReturnValuesOnConditionCheckFailure option of PutItem.
+
+        :rtype: bool
+        """
+        try:
+            input_shape = self._dynamodb_table.meta.client.meta.service_model.operation_model('PutItem').input_shape
+            return 'ReturnValuesOnConditionCheckFailure' in input_shape.members
+        except AttributeError:
+            # not a boto3 Table - e.g. a stand-in used for testing
+            return True
+
+
     def _overwrite_existing_lock_in_dynamodb(self, lock, record_version_number):
         """
         Overwrites an existing lock in the database - while checking that the version has not changed.
@@ -653,6 +996,19 @@ class DynamoDBLockClient:
         return item
 
 
+    def release_all_locks(self):
+        """
+        Releases all the locks held by this client - e.g. the ones a unit of work failed to release, before the
+        client is used for the next one. Best effort, like _release_all_locks().
+
+        :rtype: int
+        :return: the number of locks released
+        """
+        count = len(self._locks)
+        self._release_all_locks()
+        return count
+
+
     def _release_all_locks(self):
         """
         Iterates over all the locks and releases each one.
@@ -664,6 +1020,44 @@ class DynamoDBLockClient:
             # self._call_app_callback(lock, DynamoDBLockError.LOCK_STOLEN)
 
 
+    def pause(self):
+        """
+        Parks the background threads - till the client is resumed, or a new lock is acquired.
+
+        Meant for long-lived clients that go idle between units of work (e.g. a lock client kept in a
+        warm AWS Lambda container between invocations). The heartbeats stop while the client is paused,
+        so a client still holding locks is not paused.
+        """
+        if self._locks:
+            logger.warning('Not pausing, the client still holds %d locks', len(self._locks))
+            return
+        logger.info('Pausing')
+        self._paused = True
+        self._notify_state_changed()
+
+
+    def resume(self):
+        """
+        Wakes up the background threads of a paused client.
+        """
+        if self._paused:
+            logger.info('Resuming')
+            self._paused = False
+            self._notify_state_changed()
+
+
+    def is_healthy(self):
+        """
+        Checks that the client can still be used - i.e. it has not been closed, and both the background
+        threads are still alive.
+
+        :rtype: bool
+        """
+        return (not self._shutting_down
+                and self._heartbeat_sender_thread.is_alive()
+                and self._heartbeat_checker_thread.is_alive())
+
+
     def close(self, release_locks=False):
         """
         Shuts down the background thread - and releases all locks if so asked.
@@ -685,6 +1079,7 @@ class DynamoDBLockClient:
         if self._shutting_down: return
         logger.info('Shutting down')
         self._shutting_down = True
+        self._notify_state_changed()
         self._heartbeat_sender_thread.join()
         self._heartbeat_checker_thread.join()
         if release_locks: self._release_all_locks()
@@ -899,6 +1294,62 @@ class DynamoDBLock(BaseDynamoDBLock):
 
 
 
+class BackoffRetryStrategy:
+    """
+    Spaces out the acquire_lock() retries with an exponential backoff and jitter.
+
+    The first retries come quickly - so that a waiter picks up a released lock within milliseconds
+    instead of a whole heartbeat_period - and they slow down exponentially while the lock stays
+    busy, to keep the DynamoDB read rate under control. The jitter keeps competing waiters from
+    retrying in lock-step.
+    """
+
+    _DEFAULT_INITIAL_DELAY = datetime.timedelta(milliseconds=50)
+    _DEFAULT_MULTIPLIER = 2.0
+    _DEFAULT_JITTER = 0.5
+
+    def __init__(self,
+                 initial_delay=_DEFAULT_INITIAL_DELAY,
+                 multiplier=_DEFAULT_MULTIPLIER,
+                 max_delay=None,
+                 jitter=_DEFAULT_JITTER
+                 ):
+        """
+        :param datetime.timedelta initial_delay: The delay before the first retry. Defaults to 50 milliseconds.
+        :param float multiplier: How much the delay grows with every retry. Defaults to 2.0.
+        :param datetime.timedelta max_delay: The cap on the delay between two retries. Defaults to None -
+                i.e. the lease_duration of the lock client.
+        :param float jitter: The fraction (0.0 - 1.0) of each delay that is randomized - 0.0 means no
+                jitter, 1.0 means "full jitter". Defaults to 0.5.
+        """
+        self.initial_delay = initial_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+
+    def get_delay(self, retry_count, lease_duration):
+        """
+        Returns the delay (in seconds) before the given retry.
+
+        :param int retry_count: The number of the upcoming retry - starting with 1
+        :param datetime.timedelta lease_duration: The lease duration - the default cap on the delay
+        :rtype: float
+        """
+        max_delay = (self.max_delay or lease_duration).total_seconds()
+        # (the exponent is capped to keep the float from overflowing on very long waits)
+        delay = min(self.initial_delay.total_seconds() * (self.multiplier ** min(retry_count - 1, 64)), max_delay)
+        return delay * (1.0 - self.jitter * random.random())
+
+
+    def __str__(self):
+        """
+        Returns a readable string representation of this instance.
+        """
+        return '%s::%s' % (self.__class__.__name__, self.__dict__)
+
+
+
 class DynamoDBLockError(Exception):
     """
     Wrapper for all kinds of errors that might occur during the acquire and release calls.
@@ -0,0 +1,90 @@
+import logging
+from boto3.dynamodb.conditions import Key
+
+logger = logging.getLogger()
+
+
+class RouteIndexTable:
+
+    # the static routes of the watched TGW attachments, kept in a DynamoDB table of their own - one item per
+    # route, under the attachment it points to (attachment_id, the partition key) and its route table and CIDR
+    # (route, the sort key). Every route replaced by the Lambda function is written through, and the index of
+    # a group is checked against a search of its route tables by the health check. The coverage item of a
+    # group names the route tables its index covers and when it was last checked - the index is used only
+    # while the coverage item is there, covers the route tables asked for and is not older than max_age.
+    def __init__(self, table, max_age):
+        self.table = table
+        self.max_age = max_age
+
+    @staticmethod
+    def route_key(TGWAttachmentID, TGWRouteTableID, DestinationCidrBlock):
+        return {'attachment_id': TGWAttachmentID, 'route': TGWRouteTableID + '|' + DestinationCidrBlock}
+
+    @staticmethod
+    def coverage_key(group):
+        return {'attachment_id': 'group|' + str(group), 'route': 'coverage'}
+
+    def route_index(self, group, TGWRouteTableIDs, now):
+
+        # attachment ID -> [(route table ID, CIDR)] for every attachment of the group, None if the index
+        # of the group cannot be used
+        coverage = self.table.get_item(Key=self.coverage_key(group), ConsistentRead=True).get('Item')
+        if coverage is None or sorted(coverage['route_tables']) != sorted(TGWRouteTableIDs) or now - float(coverage['checked']) > self.max_age:
+            return None
+        return self.stored_routes(group)
+
+    def stored_routes(self, group):
+
+        return dict((TGWAttachmentID, self.routes(TGWAttachmentID)) for TGWAttachmentID in group.TGWAttachmentIDs)
+
+    def routes(self, TGWAttachmentID):
+
+        routes = []
+        kwargs = {'KeyConditionExpression': Key('attachment_id').eq(TGWAttachmentID), 'ConsistentRead': True}
+        while True:
+            response = self.table.query(**kwargs)
+            routes.extend((item['route_table_id'], item['destination_cidr_block']) for item in response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return routes
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def move(self, route_changes):
+
+        # write-through of the routes replaced, (route table, CIDR, current attachment, new attachment) each
+        with self.table.batch_writer() as batch:
+            for TGWRouteTableID, DestinationCidrBlock, TGWAttachmentID_Current, TGWAttachmentID_Desired in route_changes:
+                batch.delete_item(Key=self.route_key(TGWAttachmentID_Current, TGWRouteTableID, DestinationCidrBlock))
+                batch.put_item(Item=self.route_item(TGWAttachmentID_Desired, TGWRouteTableID, DestinationCidrBlock))
+
+    def reconcile(self, group, TGWRouteTableIDs, route_index, now):
+
+        # brings the index of the group in line with a search of its route tables, and returns the number
+        # of routes that were missing from it or wrong - 0 when the group was not indexed yet
+        stored_routes = self.stored_routes(group)
+        indexed = any(stored_routes.values())
+        drift = 0
+        with self.table.batch_writer() as batch:
+            for TGWAttachmentID in group.TGWAttachmentIDs:
+                routes = set(route_index.get(TGWAttachmentID, []))
+                stored = set(stored_routes.get(TGWAttachmentID, []))
+                for TGWRouteTableID, DestinationCidrBlock in stored - routes:
+                    batch.delete_item(Key=self.route_key(TGWAttachmentID, TGWRouteTableID, DestinationCidrBlock))
+                for TGWRouteTableID, DestinationCidrBlock in routes - stored:
+                    batch.put_item(Item=self.route_item(TGWAttachmentID, TGWRouteTableID, DestinationCidrBlock))
+                drift += len(stored ^ routes) if indexed else 0
+        coverage = self.coverage_key(group)
+        coverage.update({'route_tables': list(TGWRouteTableIDs), 'checked': int(now)})
+        self.table.put_item(Item=coverage)
+        return drift
+
+    def invalidate(self, group):
+
+        # the routes are kept, but not used till the next check against the route tables
+        self.table.delete_item(Key=self.coverage_key(group))
+
+    @staticmethod
+    def route_item(TGWAttachmentID, TGWRouteTableID, DestinationCidrBlock):
+
+        item = RouteIndexTable.route_key(TGWAttachmentID, TGWRouteTableID, DestinationCidrBlock)
+        item.update({'route_table_id': TGWRouteTableID, 'destination_cidr_block': DestinationCidrBlock})
+        return item
@@ -0,0 +1,70 @@
+import collections
+import json
+import logging
+
+logger = logging.getLogger()
+
+# How the tunnel states of a VPN connection add up to the state of the connection:
+# - all-down: DOWN once every tunnel is down
+# - quorum: DOWN once fewer than quorum tunnels are up
+# - weighted: DOWN once the tunnels up weigh less than min_weight of all the tunnels - weights maps tunnel
+#   outside IP addresses to their weight, tunnels not in it weigh 1
+# A connection which is not DOWN is UP with all its tunnels up, DEGRADED otherwise. Failover moves routes off
+# DOWN connections only, fallback moves them back to UP connections only.
+HealthPolicy = collections.namedtuple('HealthPolicy', ['name', 'quorum', 'weights', 'min_weight'])
+
+HealthPolicyNames = ('all-down', 'quorum', 'weighted')
+
+# the health of a VPN connection - its state, and the number and total weight of its tunnels that are up
+ConnectionHealth = collections.namedtuple('ConnectionHealth', ['state', 'tunnels_up', 'tunnels', 'weight_up', 'weight'])
+
+
+def health_policy(name, quorum=1, weights=None, min_weight=0.5):
+
+    # weights is a dict or a JSON object of outside IP address -> weight
+    if name not in HealthPolicyNames:
+        raise ValueError('Unknown tunnel health policy ' + name + ', expected one of ' + ', '.join(HealthPolicyNames))
+    if isinstance(weights, str):
+        weights = json.loads(weights) if weights.strip() else {}
+    if quorum < 1:
+        raise ValueError('The tunnel quorum must be at least 1')
+    return HealthPolicy(name, int(quorum), {address: float(weight) for address, weight in (weights or {}).items()}, float(min_weight))
+
+
+def connection_health(vpn_connection, policy):
+
+    tunnels = vpn_connection['VgwTelemetry']
+    tunnels_up = [tunnel for tunnel in tunnels if tunnel['Status'] == 'UP']
+    weight = sum(policy.weights.get(tunnel['OutsideIpAddress'], 1.0) for tunnel in tunnels)
+    weight_up = sum(policy.weights.get(tunnel['OutsideIpAddress'], 1.0) for tunnel in tunnels_up)
+    if not tunnels_up:
+        down = True
+    elif policy.name == 'quorum':
+        # a connection with fewer tunnels than the quorum needs all of them
+        down = len(tunnels_up) < min(policy.quorum, len(tunnels))
+    elif policy.name == 'weighted':
+        down = weight_up < policy.min_weight * weight
+    else:
+        down = False
+    if down:
+        state = 'DOWN'
+    elif len(tunnels_up) == len(tunnels):
+        state = 'UP'
+    else:
+        state = 'DEGRADED'
+    return ConnectionHealth(state, len(tunnels_up), len(tunnels), weight_up, weight)
+
+
+def evaluate_vpn_connections(vpn_connections, policy):
+
+    # VPN connection ID -> ConnectionHealth, for a describe_vpn_connections response or a list of VPN connections
+    if isinstance(vpn_connections, dict):
+        vpn_connections = vpn_connections['VpnConnections']
+    health = {}
+    for vpn_connection in vpn_connections:
+        VpnConnectionId = vpn_connection['VpnConnectionId']
+        health[VpnConnectionId] = connection_health(vpn_connection, policy)
+        tunnels_down = [tunnel['OutsideIpAddress'] for tunnel in vpn_connection['VgwTelemetry'] if tunnel['Status'] != 'UP']
+        logger.info('The VPN connection ' + VpnConnectionId + ' is ' + health[VpnConnectionId].state + ', ' + str(health[VpnConnectionId].tunnels_up) + ' of its '
+                    + str(health[VpnConnectionId].tunnels) + ' tunnels are UP' + (' - DOWN: ' + ', '.join(tunnels_down) if tunnels_down else ''))
+    return health
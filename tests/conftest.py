@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+The function runs against the in-memory AWS stand-ins of Benchmarks/simulator.py - one attachment group of two
+VPN attachments, configured through the environment before the function is loaded.
+
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'Lambda'))
+sys.path.insert(0, os.path.join(ROOT, 'Benchmarks'))
+
+os.environ.update({
+    'TGWRegion': 'us-west-2',
+    'TGWID': 'tgw-0000000000000000a',
+    'TGWAttachmentID1': 'tgw-attach-0000000000000001',
+    'TGWAttachmentID2': 'tgw-attach-0000000000000002',
+    'DynamoDBLockTable': 'DynamoDBLockTable',
+    'FallbackSupport': 'yes',
+    'FlapDampening': 'no',
+    'LOGLEVEL': 'WARNING',
+})
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+import lambda_function
+from simulator import InMemoryDynamoDBResource, InMemoryEC2Client
+
+TGWID = os.environ['TGWID']
+TGWAttachmentID1 = os.environ['TGWAttachmentID1']
+TGWAttachmentID2 = os.environ['TGWAttachmentID2']
+VpnConnectionID1 = 'vpn-0000000000000001'
+VpnConnectionID2 = 'vpn-0000000000000002'
+
+
+def tunnel_event(change_type, attachment_id, vpn_connection_id, **fields):
+    event = {
+        'detail': {
+            'changeType': change_type,
+            'transitGatewayArn': 'arn:aws:ec2:us-west-2:123456789012:transit-gateway/' + TGWID,
+            'transitGatewayAttachmentArn': 'arn:aws:ec2:us-west-2:123456789012:transit-gateway-attachment/' + attachment_id,
+            'vpnConnectionArn': 'arn:aws:ec2:us-west-2:123456789012:vpn-connection/' + vpn_connection_id,
+        }
+    }
+    for name, value in fields.items():
+        if name in ('id', 'time'):
+            event[name] = value
+        else:
+            event['detail'][name] = value
+    return event
+
+
+def add_routes(ec2, route_table_count, route_count, attachment_id=TGWAttachmentID1):
+    for i in range(route_table_count):
+        route_table_id = 'tgw-rtb-%016d' % i
+        ec2.add_route_table(TGWID, route_table_id)
+        for j in range(route_count):
+            ec2.add_route(route_table_id, '10.%d.%d.%d/28' % (i, j // 16, j % 16 * 16), attachment_id)
+
+
+@pytest.fixture
+def container():
+    # the module state of a new Lambda container, on top of new stand-ins with both VPN attachments in place
+    ec2 = InMemoryEC2Client()
+    dynamodb_resource = InMemoryDynamoDBResource()
+    ec2.add_vpn_attachment(TGWID, TGWAttachmentID1, VpnConnectionID1)
+    ec2.add_vpn_attachment(TGWID, TGWAttachmentID2, VpnConnectionID2)
+    lambda_function.ec2 = ec2
+    lambda_function.dynamodb_resource = dynamodb_resource
+    lambda_function.lock_client = None
+    lambda_function.topology_cache = None
+    lambda_function.route_index_cache = None
+    lambda_function.route_index_table = None
+    lambda_function.flap_dampening = None
+    lambda_function.event_dedupe = None
+    lambda_function.ec2_rate_limiter = lambda_function.RateLimiter(0)
+    lambda_function.metrics.sink = lambda document: None
+    yield ec2, dynamodb_resource
+    if lambda_function.lock_client is not None:
+        lambda_function.lock_client.close()
+        lambda_function.lock_client = None
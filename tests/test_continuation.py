@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Route changes left at the Lambda deadline are handed over to a new invocation of the function, which carries on
+from the route index written through at the last checkpoint.
+"""
+
+import json
+
+from conftest import TGWAttachmentID1, TGWAttachmentID2, VpnConnectionID1, add_routes, lambda_function, tunnel_event
+
+
+class LambdaContext:
+    # the Lambda context of an invocation with time for replacing the given number of routes
+    invoked_function_arn = 'arn:aws:lambda:us-west-2:123456789012:function:stack-IPsecManagementLambda-0123456789AB'
+
+    def __init__(self, ec2, routes):
+        self.ec2 = ec2
+        self.routes = routes + ec2.calls['ReplaceTransitGatewayRoute']
+
+    def get_remaining_time_in_millis(self):
+        return 300000 if self.ec2.calls['ReplaceTransitGatewayRoute'] < self.routes else 0
+
+
+class LambdaClient:
+
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invocations.append((FunctionName, InvocationType, json.loads(Payload)))
+
+
+def test_route_changes_are_handed_over_at_the_deadline(container, monkeypatch):
+    ec2, dynamodb_resource = container
+    monkeypatch.setattr(lambda_function, 'CheckpointRoutes', 10)
+    lambda_client = LambdaClient()
+    monkeypatch.setattr(lambda_function, 'lambda_client', lambda_client)
+    add_routes(ec2, 3, 10)
+    ec2.set_tunnel_status(VpnConnectionID1, 'DOWN', 'DOWN')
+
+    result = lambda_function.lambda_handler(tunnel_event('VPN-CONNECTION-IPSEC-DOWN', TGWAttachmentID1, VpnConnectionID1), LambdaContext(ec2, 20))
+    assert result['routesChanged'] == 20
+    assert result['continuedGroups'] == ['tgw-0000000000000000a/default']
+    FunctionName, InvocationType, event = lambda_client.invocations.pop()
+    assert FunctionName == LambdaContext.invoked_function_arn
+    assert InvocationType == 'Event'
+    assert event['detail'] == {'changeType': 'VPN-CONNECTION-IPSEC-CONTINUE', 'group': 'tgw-0000000000000000a/default', 'continuation': 1}
+
+    ec2.calls.clear()
+    result = lambda_function.lambda_handler(event, LambdaContext(ec2, 20))
+    assert result['action'] == 'continue'
+    assert result['routesChanged'] == 10
+    assert 'continuedGroups' not in result
+    assert not lambda_client.invocations
+    assert ec2.calls['SearchTransitGatewayRoutes'] == 0
+    assert not ec2.routes_to(TGWAttachmentID1)
+    assert len(ec2.routes_to(TGWAttachmentID2)) == 30
+
+
+def test_hand_over_stops_after_max_continuations(container, monkeypatch):
+    ec2, dynamodb_resource = container
+    monkeypatch.setattr(lambda_function, 'CheckpointRoutes', 10)
+    monkeypatch.setattr(lambda_function, 'MaxContinuations', 1)
+    lambda_client = LambdaClient()
+    monkeypatch.setattr(lambda_function, 'lambda_client', lambda_client)
+    add_routes(ec2, 3, 10)
+    ec2.set_tunnel_status(VpnConnectionID1, 'DOWN', 'DOWN')
+
+    lambda_function.lambda_handler(tunnel_event('VPN-CONNECTION-IPSEC-DOWN', TGWAttachmentID1, VpnConnectionID1), LambdaContext(ec2, 10))
+    FunctionName, InvocationType, event = lambda_client.invocations.pop()
+    result = lambda_function.lambda_handler(event, LambdaContext(ec2, 10))
+    assert result['routesChanged'] == 10
+    assert 'continuedGroups' not in result
+    assert not lambda_client.invocations
+    assert len(ec2.routes_to(TGWAttachmentID1)) == 10
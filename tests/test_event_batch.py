@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+A burst of queued tunnel events is coalesced into one reconciliation of each attachment group it touches, and only
+the messages of a group that could not be reconciled are handed back to the queue to be retried.
+"""
+
+import collections
+
+from conftest import TGWAttachmentID1, TGWAttachmentID2, TGWID, VpnConnectionID1, add_routes, lambda_function, tunnel_event
+from simulator import InMemoryEventQueue, client_error
+
+TGWAttachmentID3 = 'tgw-attach-0000000000000003'
+TGWAttachmentID4 = 'tgw-attach-0000000000000004'
+VpnConnectionID3 = 'vpn-0000000000000003'
+VpnConnectionID4 = 'vpn-0000000000000004'
+
+
+def test_burst_with_a_failing_group(container, monkeypatch):
+    ec2, dynamodb_resource = container
+    groups = [
+        lambda_function.AttachmentGroup(TGWID, 'default', [TGWAttachmentID1, TGWAttachmentID2]),
+        lambda_function.AttachmentGroup(TGWID, 'second', [TGWAttachmentID3, TGWAttachmentID4]),
+    ]
+    monkeypatch.setattr(lambda_function, 'AttachmentGroups', groups)
+    monkeypatch.setattr(lambda_function, 'AttachmentGroupIndex', lambda_function.index_groups(groups))
+    ec2.add_vpn_attachment(TGWID, TGWAttachmentID3, VpnConnectionID3)
+    ec2.add_vpn_attachment(TGWID, TGWAttachmentID4, VpnConnectionID4)
+    add_routes(ec2, 2, 5)
+    ec2.add_route_table(TGWID, 'tgw-rtb-second')
+    for j in range(5):
+        ec2.add_route('tgw-rtb-second', '10.128.0.%d/28' % (j * 16), TGWAttachmentID3)
+    ec2.set_tunnel_status(VpnConnectionID1, 'DOWN', 'DOWN')
+    ec2.set_tunnel_status(VpnConnectionID3, 'DOWN', 'DOWN')
+
+    # the routes of the second group cannot be replaced
+    replace_route = ec2.replace_transit_gateway_route
+
+    def replace_transit_gateway_route(**kwargs):
+        if kwargs['TransitGatewayRouteTableId'] == 'tgw-rtb-second':
+            raise client_error('InternalError', 'An internal error has occurred', 'ReplaceTransitGatewayRoute')
+        return replace_route(**kwargs)
+    monkeypatch.setattr(ec2, 'replace_transit_gateway_route', replace_transit_gateway_route)
+    reconciled = collections.Counter()
+    reconcile_static_routes = lambda_function.reconcile_static_routes
+
+    def counted_reconcile_static_routes(group, attachment_states):
+        reconciled[str(group)] += 1
+        return reconcile_static_routes(group, attachment_states)
+    monkeypatch.setattr(lambda_function, 'reconcile_static_routes', counted_reconcile_static_routes)
+
+    # the tunnels of both groups flap during the batching window
+    queue = InMemoryEventQueue(batching_window=30)
+    failing_messages = []
+    for i in range(10):
+        change_type = 'VPN-CONNECTION-IPSEC-DOWN' if i % 2 == 0 else 'VPN-CONNECTION-IPSEC-UP'
+        queue.send(tunnel_event(change_type, TGWAttachmentID1, VpnConnectionID1, id='event-1-%d' % i, time='2026-01-01T00:00:%02dZ' % (i * 2)), i * 2)
+        queue.send(tunnel_event(change_type, TGWAttachmentID3, VpnConnectionID3, id='event-3-%d' % i, time='2026-01-01T00:00:%02dZ' % (i * 2 + 1)), i * 2 + 1)
+        failing_messages.append('message-%d' % (i * 2 + 2))
+    batch = queue.receive_batch(30)
+    assert len(batch['Records']) == 20
+
+    result = lambda_function.lambda_handler(batch, None)
+    assert reconciled == {TGWID + '/default': 1, TGWID + '/second': 1}
+    assert result['routesChanged'] == 10
+    assert len(ec2.routes_to(TGWAttachmentID2)) == 10
+    assert sorted(failure['itemIdentifier'] for failure in result['batchItemFailures']) == sorted(failing_messages)
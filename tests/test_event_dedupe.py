@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deliveries of a tunnel event seen already are dropped before any EC2 call or lock, new events of the tunnels are not.
+"""
+
+from conftest import TGWAttachmentID1, TGWAttachmentID2, VpnConnectionID1, add_routes, lambda_function, tunnel_event
+from event_dedupe import EventDedupe
+from simulator import InMemoryDynamoDBResource
+
+
+def tunnel_down(ec2, event_id, event_time, *tunnel_status, **fields):
+    ec2.set_tunnel_status(VpnConnectionID1, *tunnel_status)
+    ec2.calls.clear()
+    event = tunnel_event('VPN-CONNECTION-IPSEC-DOWN', TGWAttachmentID1, VpnConnectionID1, id=event_id, time=event_time, **fields)
+    return lambda_function.lambda_handler(event, None)
+
+
+def test_redelivery_is_dropped(container):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, 2, 5)
+    result = tunnel_down(ec2, 'event-1', '2026-01-01T00:00:05Z', 'DOWN', 'DOWN', outsideIpAddress='203.0.113.1')
+    assert result['routesChanged'] == 10
+    result = tunnel_down(ec2, 'event-1', '2026-01-01T00:00:05Z', 'DOWN', 'DOWN', outsideIpAddress='203.0.113.1')
+    assert result['action'] == 'duplicate'
+    assert not ec2.calls
+
+
+def test_down_of_each_tunnel_without_outside_ip_is_handled(container):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, 2, 5)
+    # the tunnels go down one after the other, in the same dedupe window, and neither event tells which tunnel it is
+    result = tunnel_down(ec2, 'event-1', '2026-01-01T00:00:05Z', 'DOWN', 'UP')
+    assert result['action'] != 'duplicate'
+    assert len(ec2.routes_to(TGWAttachmentID1)) == 10
+    result = tunnel_down(ec2, 'event-2', '2026-01-01T00:00:07Z', 'DOWN', 'DOWN')
+    assert result['action'] != 'duplicate'
+    assert result['routesChanged'] == 10
+    assert len(ec2.routes_to(TGWAttachmentID2)) == 10
+    # a delivery of either event is still dropped on its ID
+    result = tunnel_down(ec2, 'event-1', '2026-01-01T00:00:05Z', 'DOWN', 'DOWN')
+    assert result['action'] == 'duplicate'
+
+
+def test_down_of_the_other_tunnel_is_handled(container):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, 2, 5)
+    result = tunnel_down(ec2, 'event-1', '2026-01-01T00:00:05Z', 'DOWN', 'UP', outsideIpAddress='203.0.113.1')
+    assert result['action'] != 'duplicate'
+    result = tunnel_down(ec2, 'event-2', '2026-01-01T00:00:07Z', 'DOWN', 'DOWN', outsideIpAddress='203.0.113.2')
+    assert result['routesChanged'] == 10
+    # the same tunnel going down again in the window is a repeat
+    result = tunnel_down(ec2, 'event-3', '2026-01-01T00:00:09Z', 'DOWN', 'DOWN', outsideIpAddress='203.0.113.2')
+    assert result['action'] == 'duplicate'
+
+
+class InvocationKilled(BaseException):
+    # a Lambda timeout or out of memory kill - the function gets no chance to handle it
+    pass
+
+
+class LambdaContext:
+    invoked_function_arn = 'arn:aws:lambda:us-west-2:123456789012:function:stack-IPsecManagementLambda-0123456789AB'
+
+    def get_remaining_time_in_millis(self):
+        return 300000
+
+
+def test_retry_of_a_killed_invocation_is_handled(container, monkeypatch):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, 2, 5)
+    ec2.set_tunnel_status(VpnConnectionID1, 'DOWN', 'DOWN')
+    event = tunnel_event('VPN-CONNECTION-IPSEC-DOWN', TGWAttachmentID1, VpnConnectionID1, id='event-1', time='2026-01-01T00:00:05Z', outsideIpAddress='203.0.113.1')
+
+    def killed(**kwargs):
+        raise InvocationKilled()
+    with monkeypatch.context() as patch:
+        patch.setattr(ec2, 'describe_vpn_connections', killed)
+        try:
+            lambda_function.lambda_handler(event, LambdaContext())
+        except InvocationKilled:
+            pass
+    # a delivery while the event is in progress is dropped
+    assert lambda_function.lambda_handler(event, LambdaContext())['action'] == 'duplicate'
+    # the retry comes after the deadline of the killed invocation
+    now = lambda_function.time.time()
+    monkeypatch.setattr(lambda_function.time, 'time', lambda: now + 301)
+    result = lambda_function.lambda_handler(event, LambdaContext())
+    assert result['routesChanged'] == 10
+    assert not ec2.routes_to(TGWAttachmentID1)
+    # once done, the event is dropped for good
+    assert lambda_function.lambda_handler(event, LambdaContext())['action'] == 'duplicate'
+    lambda_function.event_dedupe = None
+    assert lambda_function.lambda_handler(event, LambdaContext())['action'] == 'duplicate'
+
+
+def test_tunnel_events_are_checked_across_containers():
+    table = InMemoryDynamoDBResource().Table('DynamoDBLockTable')
+    container_a = EventDedupe(table, 60, 3600, 1024)
+    container_b = EventDedupe(table, 60, 3600, 1024)
+    tunnel = (VpnConnectionID1, '203.0.113.1')
+
+    def handle(container, event_id, change_type, event_time, now):
+        seen = container.check(event_id, tunnel[0], tunnel[1], change_type, event_time, now=now, in_progress_ttl=300)
+        if seen is None:
+            container.done(event_id, tunnel[0], tunnel[1], change_type, event_time, now=now)
+        return seen
+
+    now = 1767225600.0
+    assert handle(container_a, 'event-1', 'VPN-CONNECTION-IPSEC-DOWN', '2026-01-01T00:00:01Z', now + 1) is None
+    assert handle(container_b, 'event-2', 'VPN-CONNECTION-IPSEC-UP', '2026-01-01T00:00:20Z', now + 20) is None
+    # the tunnel went down again - container A last saw it go down, but that is not its last event any more
+    assert handle(container_a, 'event-3', 'VPN-CONNECTION-IPSEC-DOWN', '2026-01-01T00:00:40Z', now + 40) is None
+    # deliveries are still dropped, from memory in the container that handled the event, from the table in the other
+    assert handle(container_a, 'event-3', 'VPN-CONNECTION-IPSEC-DOWN', '2026-01-01T00:00:40Z', now + 41) == 'memory'
+    assert handle(container_b, 'event-3', 'VPN-CONNECTION-IPSEC-DOWN', '2026-01-01T00:00:40Z', now + 42) == 'table'
+    # as is a repeat of the tunnel's last event with a new ID, in either container
+    assert handle(container_a, 'event-4', 'VPN-CONNECTION-IPSEC-DOWN', '2026-01-01T00:00:45Z', now + 45) == 'table'
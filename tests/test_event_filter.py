@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+With TGWConfig the event rule matches the tunnel events of every TGW in the account - the events of the TGWs the
+function is not configured for are ignored, not failed and retried.
+"""
+
+import json
+
+from conftest import TGWAttachmentID1, VpnConnectionID1, add_routes, lambda_function, tunnel_event
+
+
+def other_tunnel_down():
+    event = tunnel_event('VPN-CONNECTION-IPSEC-DOWN', 'tgw-attach-00000000000000ff', 'vpn-00000000000000ff')
+    event['detail']['transitGatewayArn'] = 'arn:aws:ec2:us-west-2:123456789012:transit-gateway/tgw-00000000000000ff'
+    return event
+
+
+def test_event_of_another_tgw_is_ignored(container):
+    ec2, dynamodb_resource = container
+    metrics = []
+    lambda_function.metrics.sink = metrics.append
+    add_routes(ec2, 2, 5)
+    ec2.calls.clear()
+    result = lambda_function.lambda_handler(other_tunnel_down(), None)
+    assert result['action'] == 'ignored'
+    assert not ec2.calls
+    assert all('Errors' not in document for document in metrics)
+
+
+def test_queued_event_of_another_tgw_is_not_retried(container):
+    ec2, dynamodb_resource = container
+    ec2.set_tunnel_status(VpnConnectionID1, 'DOWN', 'DOWN')
+    add_routes(ec2, 2, 5)
+    records = [
+        {'messageId': 'message-1', 'body': json.dumps(other_tunnel_down())},
+        {'messageId': 'message-2', 'body': json.dumps(tunnel_event('VPN-CONNECTION-IPSEC-DOWN', TGWAttachmentID1, VpnConnectionID1))},
+    ]
+    result = lambda_function.lambda_handler({'Records': records}, None)
+    assert result['batchItemFailures'] == []
+    assert result['routesChanged'] == 10
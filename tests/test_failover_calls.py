@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+The EC2 calls of a failover and fallback, counted by the in-memory EC2 stand-in. Each route table is searched
+once, only on a cold container, and each route that moves is replaced once - the function used to search one
+route table before the sweep and every route table again in the sweep.
+"""
+
+import pytest
+
+from conftest import TGWAttachmentID1, VpnConnectionID1, add_routes, lambda_function, tunnel_event
+
+
+def tunnel_change(ec2, change_type, *tunnel_status):
+    ec2.set_tunnel_status(VpnConnectionID1, *tunnel_status)
+    ec2.calls.clear()
+    event = tunnel_event('VPN-CONNECTION-IPSEC-' + change_type, TGWAttachmentID1, VpnConnectionID1)
+    return lambda_function.lambda_handler(event, None)
+
+
+@pytest.mark.parametrize('route_table_count, route_count', [(1, 1), (1, 20), (4, 10), (16, 5)])
+def test_cold_failover_searches_each_route_table_once(container, route_table_count, route_count):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, route_table_count, route_count)
+    result = tunnel_change(ec2, 'DOWN', 'DOWN', 'DOWN')
+    assert result['routesChanged'] == route_table_count * route_count
+    assert ec2.calls['DescribeTransitGatewayRouteTables'] == 1
+    assert ec2.calls['SearchTransitGatewayRoutes'] == route_table_count
+    assert ec2.calls['ReplaceTransitGatewayRoute'] == route_table_count * route_count
+    assert not ec2.routes_to(TGWAttachmentID1)
+
+
+def test_warm_failover_and_fallback_make_no_searches(container):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, 4, 10)
+    tunnel_change(ec2, 'DOWN', 'DOWN', 'DOWN')
+    for change_type in ('UP', 'DOWN'):
+        result = tunnel_change(ec2, change_type, change_type, change_type)
+        assert result['routesChanged'] == 40
+        assert ec2.calls['SearchTransitGatewayRoutes'] == 0
+        assert ec2.calls['DescribeTransitGatewayRouteTables'] == 0
+        assert ec2.calls['ReplaceTransitGatewayRoute'] == 40
+
+
+def test_failover_in_place_replaces_nothing(container):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, 4, 10)
+    tunnel_change(ec2, 'DOWN', 'DOWN', 'DOWN')
+    result = tunnel_change(ec2, 'DOWN', 'DOWN', 'DOWN')
+    assert result['routesChanged'] == 0
+    assert ec2.calls['ReplaceTransitGatewayRoute'] == 0
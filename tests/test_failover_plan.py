@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+The failover off an attachment that lost a tunnel is planned ahead - from the cached route index, and only once
+for as long as the route index stays the same, so that a flapping tunnel costs a DescribeVpnConnections call.
+"""
+
+from conftest import TGWAttachmentID1, TGWAttachmentID2, VpnConnectionID1, add_routes, lambda_function, tunnel_event
+
+
+def tunnel_down(ec2, *tunnel_status):
+    ec2.set_tunnel_status(VpnConnectionID1, *tunnel_status)
+    ec2.calls.clear()
+    return lambda_function.lambda_handler(tunnel_event('VPN-CONNECTION-IPSEC-DOWN', TGWAttachmentID1, VpnConnectionID1), None)
+
+
+def test_flapping_tunnel_reuses_the_plan(container):
+    ec2, dynamodb_resource = container
+    metrics = []
+    lambda_function.metrics.sink = metrics.append
+    add_routes(ec2, 20, 5)
+
+    assert tunnel_down(ec2, 'DOWN', 'UP')['action'] == 'plan'
+    assert ec2.calls['SearchTransitGatewayRoutes'] == 20
+    assert metrics[-1].get('FailoverPlansPrepared') == 1
+    for i in range(3):
+        dynamodb_resource.calls.clear()
+        assert tunnel_down(ec2, 'DOWN', 'UP')['action'] == 'plan'
+        assert dict(ec2.calls) == {'DescribeVpnConnections': 1}
+        assert 'PutItem' not in dynamodb_resource.calls
+        assert metrics[-1].get('FailoverPlansReused') == 1
+
+    result = tunnel_down(ec2, 'DOWN', 'DOWN')
+    assert result['routesChanged'] == 100
+    assert metrics[-1].get('FailoverPlansUsed') == 1
+    assert len(ec2.routes_to(TGWAttachmentID2)) == 100
+
+
+def test_plan_is_made_again_when_the_routes_change(container):
+    ec2, dynamodb_resource = container
+    metrics = []
+    lambda_function.metrics.sink = metrics.append
+    add_routes(ec2, 2, 5)
+    tunnel_down(ec2, 'DOWN', 'UP')
+    # a route of the group added, and the cached route index dropped
+    ec2.add_route('tgw-rtb-0000000000000000', '10.255.0.0/28', TGWAttachmentID2)
+    lambda_function.invalidate_route_index(lambda_function.AttachmentGroups[0])
+    assert tunnel_down(ec2, 'DOWN', 'UP')['action'] == 'plan'
+    assert metrics[-1].get('FailoverPlansPrepared') == 1
+    result = tunnel_down(ec2, 'DOWN', 'DOWN')
+    assert result['routesChanged'] == 10
+    assert metrics[-1].get('FailoverPlansUsed') == 1
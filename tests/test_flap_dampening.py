@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+The flap dampening records of a health check are read in batches, and written only when a connection changes state.
+The penalty of a flapping connection suppresses fallback to it after the expected number of flaps, for no longer
+than max_suppress_time.
+"""
+
+import datetime
+import math
+
+from conftest import VpnConnectionID1, add_routes, lambda_function
+from flap_dampening import FlapDampening, is_suppressed, new_record, penalty_ceiling, record_transition, reuse_time
+from simulator import InMemoryDynamoDBResource
+
+HEALTHCHECK = {'detail': {'changeType': 'VPN-CONNECTION-IPSEC-HEALTHCHECK'}}
+
+
+NOW = 1767225600.0
+
+
+def vpn_connection(VpnConnectionId, LastStatusChange=datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)):
+    return {'VpnConnectionId': VpnConnectionId, 'VgwTelemetry': [{'LastStatusChange': LastStatusChange}]}
+
+
+def flaps(count, interval=10.0):
+    # the record of a connection that went DOWN and UP again count times, interval seconds apart
+    record = new_record('UP', NOW)
+    for i in range(count):
+        record = record_transition(record, 'DOWN' if i % 2 == 0 else 'UP', NOW + (i + 1) * interval, lambda_function.FlapDampeningParameters)
+    return record
+
+
+def test_third_flap_suppresses_the_connection():
+    # with the default parameters two flaps in a row stay under suppress_limit, the third goes over it
+    parameters = lambda_function.FlapDampeningParameters
+    assert not flaps(1)['suppressed']
+    assert not flaps(2)['suppressed']
+    assert flaps(3)['suppressed']
+    # flaps far enough apart never add up to suppress_limit
+    assert not flaps(10, interval=parameters.half_life)['suppressed']
+
+
+def test_suppression_ends_when_the_penalty_decays_under_reuse_limit():
+    parameters = lambda_function.FlapDampeningParameters
+    record = flaps(3)
+    delay = reuse_time(record, record['updated'], parameters)
+    assert delay == parameters.half_life * math.log2(record['penalty'] / parameters.reuse_limit)
+    assert is_suppressed(record, record['updated'] + delay - 1, parameters)
+    assert not is_suppressed(record, record['updated'] + delay + 1, parameters)
+    assert reuse_time(record, record['updated'] + delay + 1, parameters) == 0.0
+    # a flap during suppression keeps the connection suppressed, even from under suppress_limit
+    later = record_transition(record, 'DOWN', record['updated'] + delay - 1, parameters)
+    assert later['penalty'] < parameters.suppress_limit and later['suppressed']
+
+
+def test_suppression_is_capped_at_max_suppress_time():
+    parameters = lambda_function.FlapDampeningParameters
+    assert penalty_ceiling(parameters) == 12000
+    record = flaps(50, interval=1.0)
+    assert record['penalty'] == penalty_ceiling(parameters)
+    assert reuse_time(record, record['updated'], parameters) == parameters.max_suppress_time
+    assert not is_suppressed(record, record['updated'] + parameters.max_suppress_time + 1, parameters)
+
+
+def test_transition_time_is_clamped_to_the_record():
+    flap_dampening = FlapDampening(InMemoryDynamoDBResource(), 'DynamoDBLockTable', lambda_function.FlapDampeningParameters, 3600)
+    table = flap_dampening.table
+    flap_dampening.observe(vpn_connection(VpnConnectionID1), 'UP', NOW + 600)
+    # the tunnels last changed before the record was written - the transition cannot predate it
+    flap_dampening.observe(vpn_connection(VpnConnectionID1), 'DOWN', NOW + 660)
+    record = FlapDampening.record_from_item(table.get_item(Key=FlapDampening.key(VpnConnectionID1))['Item'])
+    assert record['updated'] == NOW + 600
+    assert record['history'] == [[NOW + 600, 'DOWN']]
+    # nor be later than the time it is noticed
+    future = datetime.datetime(2026, 1, 2, tzinfo=datetime.timezone.utc)
+    flap_dampening.observe(vpn_connection(VpnConnectionID1, future), 'UP', NOW + 720)
+    record = FlapDampening.record_from_item(table.get_item(Key=FlapDampening.key(VpnConnectionID1))['Item'])
+    assert record['updated'] == NOW + 720
+
+
+def test_health_check_reads_the_records_in_one_batch(container, monkeypatch):
+    ec2, dynamodb_resource = container
+    monkeypatch.setattr(lambda_function, 'FlapDampeningEnabled', 'yes')
+    add_routes(ec2, 3, 5)
+    lambda_function.lambda_handler(HEALTHCHECK, None)
+
+    dynamodb_resource.calls.clear()
+    lambda_function.lambda_handler(HEALTHCHECK, None)
+    assert dict(dynamodb_resource.calls) == {'BatchGetItem': 1}
+
+    ec2.set_tunnel_status(VpnConnectionID1, 'DOWN', 'DOWN')
+    lambda_function.lambda_handler(HEALTHCHECK, None)
+    record = dynamodb_resource.Table('DynamoDBLockTable').get_item(Key=FlapDampening.key(VpnConnectionID1))['Item']
+    assert record['state'] == 'DOWN' and record['version'] == 2
+
+    dynamodb_resource.calls.clear()
+    lambda_function.lambda_handler(HEALTHCHECK, None)
+    assert dict(dynamodb_resource.calls) == {'BatchGetItem': 1}
+
+
+def test_records_read_ahead_are_used_once():
+    dynamodb_resource = InMemoryDynamoDBResource()
+    flap_dampening = FlapDampening(dynamodb_resource, 'DynamoDBLockTable', lambda_function.FlapDampeningParameters, 3600)
+    VpnConnectionIds = ['vpn-%017d' % i for i in range(250)]
+    for VpnConnectionId in VpnConnectionIds:
+        flap_dampening.observe(vpn_connection(VpnConnectionId), 'UP', 1767225600.0)
+
+    dynamodb_resource.calls.clear()
+    flap_dampening.prefetch(VpnConnectionIds)
+    for VpnConnectionId in VpnConnectionIds:
+        assert not flap_dampening.observe(vpn_connection(VpnConnectionId), 'UP', 1767225660.0)
+    assert dict(dynamodb_resource.calls) == {'BatchGetItem': 3}
+
+    dynamodb_resource.calls.clear()
+    flap_dampening.observe(vpn_connection(VpnConnectionIds[0]), 'UP', 1767225720.0)
+    assert dict(dynamodb_resource.calls) == {'GetItem': 1}
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+The lock client renews the leases of its locks in batches, and acquires sets of locks without deadlocking another
+client asking for an overlapping set - or holding on to part of a set it could not get.
+"""
+
+import datetime
+import threading
+import time
+
+import pytest
+
+from python_dynamodb_lock.python_dynamodb_lock import DynamoDBLockClient, DynamoDBLockError
+from simulator import InMemoryDynamoDBResource
+
+
+def lock_client(dynamodb_resource, **kwargs):
+    # heartbeats are sent by the tests, not by the background threads
+    kwargs.setdefault('heartbeat_period', datetime.timedelta(hours=1))
+    return DynamoDBLockClient(dynamodb_resource, **kwargs)
+
+
+def test_heartbeat_of_a_batch_with_a_stolen_lock():
+    dynamodb_resource = InMemoryDynamoDBResource()
+    table = dynamodb_resource.Table('DynamoDBLockTable')
+    client = lock_client(dynamodb_resource, heartbeat_batch_size=25)
+    try:
+        callbacks = []
+        called = threading.Event()
+
+        def app_callback(code, lock):
+            callbacks.append((code, lock.partition_key))
+            called.set()
+        locks = client.acquire_locks(['key-1', 'key-2', 'key-3'], app_callback=app_callback)
+        # another client took over key-2
+        table.items[('key-2', '-')]['record_version_number'] = 'stolen'
+        record_version_numbers = dict((lock.partition_key, lock.record_version_number) for lock in locks)
+        for lock in locks:
+            lock.last_updated_time -= 3600
+
+        dynamodb_resource.calls.clear()
+        client._send_heartbeats(locks)
+        assert called.wait(5)
+        assert callbacks == [(DynamoDBLockError.LOCK_STOLEN, 'key-2')]
+        assert sorted(client._locks) == sorted(lock.unique_identifier for lock in locks if lock.partition_key != 'key-2')
+        # the transaction cancelled by the stolen lock is sent again for the others
+        assert dynamodb_resource.calls['TransactWriteItems'] == 2
+        for lock in locks:
+            if lock.partition_key == 'key-2':
+                assert lock.status == lock.INVALID
+                assert table.items[('key-2', '-')]['record_version_number'] == 'stolen'
+            else:
+                assert lock.record_version_number != record_version_numbers[lock.partition_key]
+                assert table.items[(lock.partition_key, '-')]['record_version_number'] == lock.record_version_number
+    finally:
+        client.close()
+
+
+def test_overlapping_key_sets_in_opposite_order():
+    dynamodb_resource = InMemoryDynamoDBResource()
+    clients = [lock_client(dynamodb_resource, lease_duration=datetime.timedelta(seconds=5)) for i in range(2)]
+    key_sets = [['key-1', 'key-2', 'key-3'], ['key-3', 'key-2', 'key-1', 'key-2']]
+    start = threading.Barrier(2)
+    acquired = [[], []]
+    errors = []
+
+    def work(i):
+        try:
+            for attempt in range(5):
+                start.wait()
+                locks = clients[i].acquire_locks(key_sets[i], retry_period=datetime.timedelta(seconds=0.01), retry_timeout=datetime.timedelta(seconds=4))
+                acquired[i].append([lock.partition_key for lock in locks])
+                time.sleep(0.02)
+                for lock in locks:
+                    clients[i].release_lock(lock)
+        except Exception as e:
+            errors.append(e)
+            start.abort()
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(2)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        # both take the keys in the same order, without duplicates - neither holds a key the other is waiting on
+        assert not errors
+        assert acquired == [[['key-1', 'key-2', 'key-3']] * 5] * 2
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_locks_acquired_so_far_are_released_on_timeout():
+    dynamodb_resource = InMemoryDynamoDBResource()
+    table = dynamodb_resource.Table('DynamoDBLockTable')
+    client_a = lock_client(dynamodb_resource)
+    client_b = lock_client(dynamodb_resource)
+    try:
+        client_a.acquire_lock('key-2')
+        with pytest.raises(DynamoDBLockError) as e:
+            client_b.acquire_locks(['key-3', 'key-2', 'key-1'], retry_period=datetime.timedelta(seconds=0.01), retry_timeout=datetime.timedelta(seconds=0.2))
+        assert e.value.code == DynamoDBLockError.ACQUIRE_TIMEOUT
+        # key-1 was taken first and given back, key-3 was never tried
+        assert not client_b._locks
+        assert sorted(table.items) == [('key-2', '-')]
+        assert table.items[('key-2', '-')]['owner_name'] == client_a._owner_name
+    finally:
+        client_a.close()
+        client_b.close()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""
+The locks of a route update are released whatever ends it - a lock left with the lock client of a warm container
+would be heartbeated for as long as the container lives, and block every other invocation.
+"""
+
+import pytest
+from botocore.exceptions import ReadTimeoutError
+
+from conftest import TGWAttachmentID1, TGWAttachmentID2, VpnConnectionID1, add_routes, lambda_function, tunnel_event
+
+
+def failover():
+    return lambda_function.lambda_handler(tunnel_event('VPN-CONNECTION-IPSEC-DOWN', TGWAttachmentID1, VpnConnectionID1), None)
+
+
+def lock_items(dynamodb_resource):
+    return [key for key in dynamodb_resource.Table('DynamoDBLockTable').items if key[1] == '-']
+
+
+def test_locks_are_released_after_a_read_timeout(container, monkeypatch):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, 2, 5)
+    ec2.set_tunnel_status(VpnConnectionID1, 'DOWN', 'DOWN')
+
+    def read_timeout(**kwargs):
+        raise ReadTimeoutError(endpoint_url='https://ec2.us-west-2.amazonaws.com/')
+    with monkeypatch.context() as patch:
+        patch.setattr(ec2, 'replace_transit_gateway_route', read_timeout)
+        with pytest.raises(ReadTimeoutError):
+            failover()
+    assert not lambda_function.lock_client._locks
+    assert lambda_function.lock_client._paused
+    assert not lock_items(dynamodb_resource)
+
+    assert failover()['routesChanged'] == 10
+    assert len(ec2.routes_to(TGWAttachmentID2)) == 10
+
+
+def test_locks_left_over_are_released_by_the_next_invocation(container):
+    ec2, dynamodb_resource = container
+    add_routes(ec2, 2, 5)
+    # an invocation that ended without releasing its lock
+    lambda_function.get_lock_client().acquire_lock('my_key')
+    assert lock_items(dynamodb_resource)
+
+    ec2.set_tunnel_status(VpnConnectionID1, 'DOWN', 'DOWN')
+    assert failover()['routesChanged'] == 10
+    assert not lambda_function.lock_client._locks
+    assert not lock_items(dynamodb_resource)
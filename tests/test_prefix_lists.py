@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+The static routes of a group are moved onto prefix list references without ever leaving a CIDR unrouted - a static
+route is only deleted once the reference of its route table is available - and a migration that did not finish is
+picked up where it stopped.
+"""
+
+import collections
+
+import pytest
+from botocore.exceptions import ClientError
+
+from conftest import TGWAttachmentID1, TGWAttachmentID2, TGWID, add_routes, lambda_function
+from simulator import client_error
+
+
+@pytest.fixture
+def prefix_list_routing(container, monkeypatch):
+    monkeypatch.setattr(lambda_function, 'RoutingMode', 'prefix-list')
+    monkeypatch.setattr(lambda_function, 'PrefixListPollInterval', 0)
+    return container
+
+
+def migrate():
+    result = lambda_function.lambda_handler({'detail': {'changeType': 'VPN-CONNECTION-IPSEC-MIGRATE', 'dryRun': False}}, None)
+    return result['migration'][0]
+
+
+def test_routes_are_deleted_once_the_references_are_available(prefix_list_routing, monkeypatch):
+    ec2, dynamodb_resource = prefix_list_routing
+    add_routes(ec2, 4, 5)
+    # a new reference is pending for the first two polls of its state
+    polls = collections.Counter()
+    available = set()
+    deleted_before_available = []
+    get_references = ec2.get_transit_gateway_prefix_list_references
+    delete_route = ec2.delete_transit_gateway_route
+
+    def pending_references(**kwargs):
+        response = get_references(**kwargs)
+        for reference in response['TransitGatewayPrefixListReferences']:
+            key = (reference['TransitGatewayRouteTableId'], reference['PrefixListId'])
+            if polls[key] < 2:
+                polls[key] += 1
+                reference['State'] = 'pending'
+            else:
+                available.add(key)
+        return response
+
+    def delete_transit_gateway_route(**kwargs):
+        if not any(route_table_id == kwargs['TransitGatewayRouteTableId'] for route_table_id, prefix_list_id in available):
+            deleted_before_available.append((kwargs['TransitGatewayRouteTableId'], kwargs['DestinationCidrBlock']))
+        return delete_route(**kwargs)
+    monkeypatch.setattr(ec2, 'get_transit_gateway_prefix_list_references', pending_references)
+    monkeypatch.setattr(ec2, 'delete_transit_gateway_route', delete_transit_gateway_route)
+
+    migration = migrate()
+    assert migration['referencesCreated'] == 4
+    assert migration['routesDeleted'] == 20
+    assert len(polls) == 4
+    assert not deleted_before_available
+    assert not ec2.routes_to(TGWAttachmentID1)
+    assert len(ec2.effective_routes_to(TGWAttachmentID1)) == 20
+
+
+def test_route_tables_split_across_attachments_are_skipped(prefix_list_routing):
+    ec2, dynamodb_resource = prefix_list_routing
+    add_routes(ec2, 2, 5)
+    ec2.add_route('tgw-rtb-0000000000000001', '10.255.0.0/28', TGWAttachmentID2)
+    migration = migrate()
+    assert [skipped['routeTable'] for skipped in migration['skipped']] == ['tgw-rtb-0000000000000001']
+    assert migration['routesDeleted'] == 5
+    # the split route table keeps its static routes, until the group is reconciled
+    assert len(ec2.route_tables['tgw-rtb-0000000000000001']['Routes']) == 6
+    assert not ec2.route_tables['tgw-rtb-0000000000000001']['References']
+
+
+@pytest.mark.parametrize('operation', ['create_transit_gateway_prefix_list_reference', 'delete_transit_gateway_route'])
+def test_migration_that_did_not_finish_is_resumed(prefix_list_routing, monkeypatch, operation):
+    ec2, dynamodb_resource = prefix_list_routing
+    # route tables routing the same CIDRs share a prefix list
+    for i in range(3):
+        ec2.add_route_table(TGWID, 'tgw-rtb-%016d' % i)
+        for j in range(5):
+            ec2.add_route('tgw-rtb-%016d' % i, '10.0.0.%d/28' % (j * 16), TGWAttachmentID1)
+
+    # the call fails after two of its kind went through
+    calls = []
+    original = getattr(ec2, operation)
+
+    def fail_after_two(**kwargs):
+        calls.append(kwargs)
+        if len(calls) > 2:
+            raise client_error('InternalError', 'An internal error has occurred', operation)
+        return original(**kwargs)
+    with monkeypatch.context() as patch:
+        patch.setattr(ec2, operation, fail_after_two)
+        with pytest.raises(ClientError):
+            migrate()
+
+    migration = migrate()
+    assert migration['referencesCreated'] == (1 if operation == 'create_transit_gateway_prefix_list_reference' else 0)
+    assert len(ec2.prefix_lists) == 1
+    for route_table in ec2.route_tables.values():
+        assert list(route_table['References'].values()) == [TGWAttachmentID1]
+        assert not route_table['Routes']
+    assert len(ec2.effective_routes_to(TGWAttachmentID1)) == 15
+    # nothing is left to migrate
+    assert not migrate()['prefixLists']
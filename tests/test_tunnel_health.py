@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+The tunnel states of a VPN connection add up to UP, DEGRADED or DOWN under each tunnel health policy, whatever the
+number of its tunnels.
+"""
+
+import pytest
+
+from tunnel_health import connection_health, health_policy
+
+ALL_DOWN = health_policy('all-down')
+QUORUM = health_policy('quorum', quorum=2)
+# the first tunnel weighs as much as three others
+WEIGHTED = health_policy('weighted', weights='{"203.0.113.1": 3}', min_weight=0.5)
+
+
+def vpn_connection(*statuses):
+    return {
+        'VpnConnectionId': 'vpn-0000000000000001',
+        'VgwTelemetry': [{'OutsideIpAddress': '203.0.113.%d' % (i + 1), 'Status': status} for i, status in enumerate(statuses)],
+    }
+
+
+@pytest.mark.parametrize('policy, statuses, state', [
+    (ALL_DOWN, ['UP'], 'UP'),
+    (ALL_DOWN, ['DOWN'], 'DOWN'),
+    (ALL_DOWN, ['UP', 'UP'], 'UP'),
+    (ALL_DOWN, ['UP', 'DOWN'], 'DEGRADED'),
+    (ALL_DOWN, ['DOWN', 'DOWN'], 'DOWN'),
+    (ALL_DOWN, ['UP', 'UP', 'UP', 'UP'], 'UP'),
+    (ALL_DOWN, ['DOWN', 'DOWN', 'DOWN', 'UP'], 'DEGRADED'),
+    (ALL_DOWN, ['DOWN', 'DOWN', 'DOWN', 'DOWN'], 'DOWN'),
+    # a connection with fewer tunnels than the quorum needs all of them
+    (QUORUM, ['UP'], 'UP'),
+    (QUORUM, ['DOWN'], 'DOWN'),
+    (QUORUM, ['UP', 'UP'], 'UP'),
+    (QUORUM, ['UP', 'DOWN'], 'DOWN'),
+    (QUORUM, ['DOWN', 'DOWN'], 'DOWN'),
+    (QUORUM, ['UP', 'UP', 'UP', 'UP'], 'UP'),
+    (QUORUM, ['UP', 'UP', 'UP', 'DOWN'], 'DEGRADED'),
+    (QUORUM, ['UP', 'DOWN', 'UP', 'DOWN'], 'DEGRADED'),
+    (QUORUM, ['DOWN', 'DOWN', 'DOWN', 'UP'], 'DOWN'),
+    (QUORUM, ['DOWN', 'DOWN', 'DOWN', 'DOWN'], 'DOWN'),
+    (WEIGHTED, ['UP'], 'UP'),
+    (WEIGHTED, ['DOWN'], 'DOWN'),
+    (WEIGHTED, ['UP', 'UP'], 'UP'),
+    (WEIGHTED, ['UP', 'DOWN'], 'DEGRADED'),
+    (WEIGHTED, ['DOWN', 'UP'], 'DOWN'),
+    (WEIGHTED, ['DOWN', 'DOWN'], 'DOWN'),
+    (WEIGHTED, ['UP', 'UP', 'UP', 'UP'], 'UP'),
+    (WEIGHTED, ['DOWN', 'UP', 'UP', 'UP'], 'DEGRADED'),
+    (WEIGHTED, ['DOWN', 'DOWN', 'UP', 'UP'], 'DOWN'),
+    (WEIGHTED, ['UP', 'DOWN', 'DOWN', 'DOWN'], 'DEGRADED'),
+    (WEIGHTED, ['DOWN', 'DOWN', 'DOWN', 'DOWN'], 'DOWN'),
+])
+def test_connection_state(policy, statuses, state):
+    health = connection_health(vpn_connection(*statuses), policy)
+    assert health.state == state
+    assert health.tunnels_up == statuses.count('UP')
+    assert health.tunnels == len(statuses)
+
+
+@pytest.mark.parametrize('statuses, weight_up, state', [
+    (['UP', 'UP', 'UP', 'UP'], 4.0, 'UP'),
+    (['UP', 'UP', 'DOWN', 'DOWN'], 2.0, 'DEGRADED'),
+    (['UP', 'DOWN', 'DOWN', 'DOWN'], 1.0, 'DOWN'),
+])
+def test_tunnels_of_unknown_outside_ip_weigh_1(statuses, weight_up, state):
+    policy = health_policy('weighted', weights={'198.51.100.1': 10}, min_weight=0.5)
+    health = connection_health(vpn_connection(*statuses), policy)
+    assert (health.weight, health.weight_up, health.state) == (4.0, weight_up, state)